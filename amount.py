@@ -0,0 +1,42 @@
+from decimal import Decimal, InvalidOperation
+
+'''
+All the amounts are integers of base units, so that every node sums them exactly.
+The users still give and see amounts in NBCs, e.g. "5" or "2.5".
+'''
+
+# 1 NBC = UNITS_PER_NBC base units
+UNITS_PER_NBC = 10 ** 8
+
+# Size of the canonical encoding of an amount, which is used for hashing
+AMOUNT_SIZE = 8
+
+'''
+Convert an amount of NBCs (string or number) into base units, without any rounding
+'''
+def parse_nbc(amount) -> int:
+
+    try:
+        units = Decimal(str(amount)) * UNITS_PER_NBC
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount '{amount}'")
+
+    if not units.is_finite() or units != units.to_integral_value() or units < 0:
+        raise ValueError(f"Invalid amount '{amount}'")
+
+    return int(units)
+
+def format_nbc(units: int) -> str:
+
+    nbc = f"{Decimal(units) / UNITS_PER_NBC:f}"
+    return nbc.rstrip('0').rstrip('.') if '.' in nbc else nbc
+
+'''
+The canonical encoding of an amount (big endian), which is used when we hash transactions and their outputs
+'''
+def encode_amount(units: int) -> bytes:
+
+    if not isinstance(units, int) or isinstance(units, bool) or units < 0:
+        raise ValueError(f"Invalid amount '{units}'")
+
+    return units.to_bytes(AMOUNT_SIZE, 'big')
@@ -0,0 +1,251 @@
+from argparse import ArgumentParser
+from Crypto.Random import get_random_bytes
+from Crypto.Hash import SHA256
+import multiprocessing
+import statistics
+import datetime
+import platform
+import hashlib
+import json
+import time
+import os
+
+import mining
+from difficulty import diff_to_target, target_to_bytes
+from block import Block
+from transaction import Transaction
+from amount import parse_nbc
+
+'''
+Benchmark of the mining path.
+Run it from the root of the repository:
+    python -m bench.mining --output bench_mining.json
+'''
+
+# A target that no digest can satisfy, so the workers keep hashing for the whole duration
+IMPOSSIBLE_TARGET = bytes(32)
+
+'''
+Create a full block (C transactions) with the same sizes as the blocks that the nodes mine
+'''
+def sample_block(capacity: int = 5) -> Block:
+
+    block = Block(prev_hash=64 * 'f', transaction_list=[])
+    for i in range(capacity):
+        trans = Transaction(sender_address=f'sender_{i}', receiver_address=f'receiver_{i}', amount=parse_nbc('5.0'))
+        trans.signature = b'signature'
+        block.add_transaction(trans)
+
+    return block
+
+# -------------- Single core hash rates --------------
+
+'''
+The original mining loop: a random 64-byte nonce, a new bytearray for every try and a hexdigest comparison
+'''
+def loop_random_nonce(sha256_new, block_bytearray_before_nonce: bytes, duration: float, diff: int) -> int:
+
+    hashes = 0
+    stop_time = time.perf_counter() + duration
+    while time.perf_counter() < stop_time:
+        for _ in range(1000):
+            temp_bytearray = bytearray()
+            temp_bytearray.extend(block_bytearray_before_nonce)
+            temp_bytearray.extend(get_random_bytes(64))
+            sha256_new(temp_bytearray).hexdigest()[0:diff] == diff * '0'
+        hashes += 1000
+
+    return hashes
+
+'''
+Counter nonces hashed from a SHA256 state precomputed over the block bytearray
+'''
+def loop_counter_nonce(sha256_new, block_bytearray_before_nonce: bytes, duration: float, diff: int) -> int:
+
+    target = target_to_bytes(diff_to_target(diff))
+    block_hash_state = sha256_new(block_bytearray_before_nonce)
+
+    hashes = 0
+    stop_time = time.perf_counter() + duration
+    while time.perf_counter() < stop_time:
+        for counter in range(hashes, hashes + 1000):
+            block_hash = block_hash_state.copy()
+            block_hash.update(counter.to_bytes(mining.NONCE_SIZE, 'big'))
+            block_hash.digest() <= target
+        hashes += 1000
+
+    return hashes
+
+'''
+Block.find_hash_key, which every node runs for every block that it validates
+'''
+def loop_find_hash_key(block_dict: dict, duration: float) -> int:
+
+    hashes = 0
+    stop_time = time.perf_counter() + duration
+    while time.perf_counter() < stop_time:
+        for _ in range(100):
+            Block.find_hash_key(
+                nonce=block_dict['nonce'],
+                timestamp=block_dict['timestamp'],
+                previous_hash=block_dict['previousHashKey'],
+                transactions=block_dict['transactions']
+            )
+        hashes += 100
+
+    return hashes
+
+def single_core_rates(block: Block, duration: float, diff: int) -> dict:
+
+    block_bytearray_before_nonce = bytes(block.bytearray_before_nonce())
+
+    def crypto_sha256(data=b''):
+        return SHA256.new(data=data)
+
+    loops = {
+        'crypto_sha256_random_nonce': lambda: loop_random_nonce(crypto_sha256, block_bytearray_before_nonce, duration, diff),
+        'hashlib_sha256_random_nonce': lambda: loop_random_nonce(hashlib.sha256, block_bytearray_before_nonce, duration, diff),
+        'crypto_sha256_counter_nonce': lambda: loop_counter_nonce(crypto_sha256, block_bytearray_before_nonce, duration, diff),
+        'hashlib_sha256_counter_nonce': lambda: loop_counter_nonce(hashlib.sha256, block_bytearray_before_nonce, duration, diff)
+    }
+
+    rates = {}
+    for name, loop in loops.items():
+        rates[name] = loop() / duration
+        print(f'{name}: {rates[name]:,.0f} hashes/s')
+
+    block.is_mined(nonce=b'0', hash_key=64 * '0')
+    rates['find_hash_key'] = loop_find_hash_key(block.to_dict(), duration) / duration
+    print(f"find_hash_key: {rates['find_hash_key']:,.0f} hashes/s")
+
+    return rates
+
+# -------------- Scaling across workers --------------
+
+def _count_hashes(block_bytearray_before_nonce: bytes, duration: float, start: int, counts: multiprocessing.Queue):
+
+    hashes = 0
+    stop_time = time.perf_counter() + duration
+    while time.perf_counter() < stop_time:
+        mining.search_nonce_range(block_bytearray_before_nonce, IMPOSSIBLE_TARGET, start + hashes,
+                                  start + hashes + mining.CHECK_INTERVAL, lambda: False)
+        hashes += mining.CHECK_INTERVAL
+
+    counts.put(hashes)
+
+'''
+Run the mining workers (the same search as the MiningService) for the given duration and sum their hashes
+'''
+def workers_rate(block: Block, workers: int, duration: float) -> float:
+
+    ctx = multiprocessing.get_context('fork')
+    counts = ctx.Queue()
+    block_bytearray_before_nonce = bytes(block.bytearray_before_nonce())
+
+    procs = [
+        ctx.Process(target=_count_hashes,
+                    args=(block_bytearray_before_nonce, duration, mining.nonce_range(i, workers)[0], counts))
+        for i in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    total = sum(counts.get() for _ in procs)
+    for proc in procs:
+        proc.join()
+
+    return total / duration
+
+def scaling(block: Block, worker_counts: [int], duration: float) -> dict:
+
+    results = {}
+    base_rate = None
+    for workers in worker_counts:
+        rate = workers_rate(block, workers, duration)
+        base_rate = base_rate or rate / workers
+        results[str(workers)] = {
+            'hashes_per_second': rate,
+            'hashes_per_second_per_worker': rate / workers,
+            'efficiency': rate / (workers * base_rate)
+        }
+        print(f'{workers} workers: {rate:,.0f} hashes/s ({rate / workers:,.0f} per worker)')
+
+    return results
+
+# -------------- Time to solution --------------
+
+'''
+A hash satisfies DIFF when it starts with DIFF hex zeros, so on average we need 16^DIFF tries
+'''
+def time_to_solution(diffs: [int], workers: int, trials: int, rate: float) -> dict:
+
+    results = {}
+    for diff in diffs:
+
+        times = []
+        for trial in range(trials):
+            block = sample_block()
+            start = time.perf_counter()
+            mining.find_nonce(block.bytearray_before_nonce(), diff_to_target(diff), workers)
+            times.append(time.perf_counter() - start)
+
+        results[str(diff)] = {
+            'expected_hashes': 16 ** diff,
+            'expected_seconds': 16 ** diff / rate,
+            'observed_seconds_mean': statistics.mean(times),
+            'observed_seconds_median': statistics.median(times),
+            'observed_seconds': times
+        }
+        print(f"DIFF={diff}: expected {results[str(diff)]['expected_seconds']:.3f}s, "
+              f"observed {results[str(diff)]['observed_seconds_mean']:.3f}s (mean of {trials})")
+
+    return results
+
+
+if __name__ == '__main__':
+
+    cpu_count = os.cpu_count()
+
+    parser = ArgumentParser()
+    parser.add_argument('--duration', default=2.0, type=float, help='Seconds of hashing for every rate measurement')
+    parser.add_argument('--workers', default=None, type=int, nargs='+', help='Worker counts for the scaling test')
+    parser.add_argument('--diffs', default=[3, 4, 5, 6], type=int, nargs='+', help='Difficulties for the time to solution')
+    parser.add_argument('--trials', default=5, type=int, help='Blocks to mine for every difficulty')
+    parser.add_argument('--output', default=None, type=str, help='Write the results in this JSON file')
+    args = parser.parse_args()
+
+    worker_counts = args.workers or sorted({1, 2, 4, 8, 16, cpu_count} & set(range(1, cpu_count + 1)))
+
+    print('Single core hash rates')
+    print('---------------------------------------')
+    rates = single_core_rates(sample_block(), args.duration, max(args.diffs))
+
+    print('Scaling across workers')
+    print('---------------------------------------')
+    scaling_results = scaling(sample_block(), worker_counts, args.duration)
+
+    print('Time to solution')
+    print('---------------------------------------')
+    max_workers = max(worker_counts)
+    solution_results = time_to_solution(
+        args.diffs, max_workers, args.trials, scaling_results[str(max_workers)]['hashes_per_second']
+    )
+
+    results = {
+        'timestamp': str(datetime.datetime.now()),
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': cpu_count
+        },
+        'settings': vars(args),
+        'single_core_hashes_per_second': rates,
+        'scaling': scaling_results,
+        'time_to_solution': solution_results
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f'Results saved at {args.output}')
+    else:
+        print(json.dumps(results, indent=2))
@@ -4,7 +4,10 @@ from Crypto.Hash import SHA256
 
 class Block:
 
-    def __init__(self, transaction_list: [Transaction], hash_key: str = None, nonce: bytes = None, prev_hash: str = None):
+    __slots__ = ('previous_hash', 'timestamp', 'list_of_transactions', '_positions', 'hash_key', 'nonce', 'target')
+
+    def __init__(self, transaction_list: [Transaction], hash_key: str = None, nonce: bytes = None, prev_hash: str = None,
+                 target: str = None):
 
         # When we create a block we know its previous block
         self.previous_hash = prev_hash
@@ -13,10 +16,16 @@ class Block:
         # This a list which contains Transaction objects. At first is empty.
         self.list_of_transactions = transaction_list
 
+        # Index transaction id -> position in list_of_transactions, in order to find duplicates in O(1)
+        self._positions = {trans.id: i for i, trans in enumerate(transaction_list)}
+
         # These values will be known when the block is mined from some node.
         self.hash_key = hash_key
         self.nonce = nonce
 
+        # The difficulty target (64 hex digits) is set from the chain when we start mining
+        self.target = target
+
     '''
     Converts the block's transactions and previous_hash into a bytearray
     '''
@@ -29,7 +38,7 @@ class Block:
         for trans in self.list_of_transactions:
 
             # Add it to the bytearray by converting the string into bytes
-            block_bytearray.extend(trans.transaction_id.hexdigest().encode('utf-8'))
+            block_bytearray.extend(trans.id.encode('utf-8'))
 
         # Add the previous_hash & timestamp into the bytearray
         block_bytearray.extend(self.previous_hash.encode('utf-8'))
@@ -44,7 +53,7 @@ class Block:
     def get_transactions(self, only_ids=False) -> list:
 
         if only_ids:
-            return [trans.transaction_id.hexdigest() for trans in self.list_of_transactions]
+            return list(self._positions)
         else:
             return self.list_of_transactions
 
@@ -58,6 +67,7 @@ class Block:
             'hashKey': self.hash_key,
             'nonce': self.nonce.decode('ISO-8859-1') if self.nonce is not None else None,
             'timestamp': self.timestamp,
+            'target': self.target,
             'transactions': [trans.to_dict() for trans in self.list_of_transactions]
         }
 
@@ -66,8 +76,8 @@ class Block:
     '''
     def add_transaction(self, new_transaction: Transaction) -> None:
 
-        my_trans_ids = [x.transaction_id.hexdigest() for x in self.list_of_transactions]
-        if new_transaction.transaction_id.hexdigest() not in my_trans_ids:
+        if new_transaction.id not in self._positions:
+            self._positions[new_transaction.id] = len(self.list_of_transactions)
             self.list_of_transactions.append(new_transaction)
         else:
             print('Transaction is already in this block.')
@@ -88,14 +98,14 @@ class Block:
     '''
     def remove_common_transactions(self, transactions: [dict]) -> None:
 
-        # Convert the lists into sets in order to find differences
-        curr_transactions_ids = set(self.get_transactions(only_ids=True))
+        # Remove from the current block the transactions that are validated from another block
         other_transactions_ids = {trans['id'] for trans in transactions}
+        if other_transactions_ids.isdisjoint(self._positions):
+            return
 
-        # Remove from the current block the transactions that are validated from another block
-        unique_transactions_ids = curr_transactions_ids - other_transactions_ids
         self.list_of_transactions = [trans for trans in self.list_of_transactions
-                                     if trans.transaction_id.hexdigest() in unique_transactions_ids]
+                                     if trans.id not in other_transactions_ids]
+        self._positions = {trans.id: i for i, trans in enumerate(self.list_of_transactions)}
 
     '''
     This function is used when we try to validate a block and 
@@ -0,0 +1,276 @@
+import collections
+import glob
+import tempfile
+import struct
+import array
+import mmap
+import json
+import os
+
+# Where the block files of the nodes are stored, one file for every address:port of a node,
+# because a node takes a new node_id every time it joins the network
+BLOCK_STORE_DIR = tempfile.gettempdir()
+
+# How many decoded blocks we keep in memory, the last blocks are read again and again
+CACHE_SIZE = 64
+
+'''
+The header of the file: magic and the persisted height,
+the number of blocks whose state the node has stored (see StatePersistence.save)
+'''
+FILE_HEADER = struct.Struct('>4sI')
+FILE_MAGIC = b'NBCS'
+
+'''
+The fixed layout header of every block record:
+magic, height, length of the body, hashKey and previousHashKey (32 raw bytes each)
+'''
+HEADER = struct.Struct('>4sII32s32s')
+MAGIC = b'NBCB'
+
+def block_store_path(address: str, port: int) -> str:
+    return os.path.join(BLOCK_STORE_DIR, f'nbc_blocks_{address}_{str(port)}.blocks')
+
+def block_store_paths() -> [str]:
+    return glob.glob(os.path.join(BLOCK_STORE_DIR, 'nbc_blocks_*.blocks'))
+
+def raw_hash(hash_key: str) -> bytes:
+
+    # The previousHashKey of the genesis block is not a hash
+    try:
+        raw = bytes.fromhex(hash_key)
+    except (TypeError, ValueError):
+        return bytes(32)
+
+    return raw if len(raw) == 32 else bytes(32)
+
+'''
+The blocks of our chain in an append-only file which is memory mapped.
+Every block is a record of a fixed layout header and its body (the block dictionary in JSON).
+We keep in memory only the offset of every height and the height of every hash,
+so a block is decoded only when it is needed and the hash of a block is read from its header without decoding it.
+It behaves like the list of blocks (len, index, slice, iteration, append), so it replaces the chain list of the node.
+When the file already exists its headers are scanned, so the chain is reopened without parsing any JSON,
+and the blocks after the persisted height (whose state was never stored) are dropped.
+'''
+class BlockStore:
+
+    def __init__(self, path: str = None, cache_size: int = CACHE_SIZE):
+
+        self.path = path
+
+        # Without a path the blocks are kept in an anonymous temporary file
+        if path is None:
+            self.file = tempfile.TemporaryFile()
+        else:
+            self.file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT), 'r+b')
+
+        self.map = None
+
+        # offsets[height] is the offset of the record of the block, and heights[raw hash] its height
+        self.offsets = array.array('Q')
+        self.heights = {}
+        self.end = FILE_HEADER.size
+        self.persisted_height = 0
+
+        # height -> decoded block
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+
+        self.scan()
+
+    # -------------- List interface --------------
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+
+        if isinstance(index, slice):
+            return [self.block_at(height) for height in range(*index.indices(len(self)))]
+
+        return self.block_at(self.height_of_index(index))
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self.block_at(height)
+
+    def append(self, block: dict) -> None:
+
+        body = json.dumps(block).encode('utf-8')
+        header = HEADER.pack(MAGIC, len(self), len(body), raw_hash(block['hashKey']),
+                             raw_hash(block['previousHashKey']))
+
+        self.file.seek(self.end)
+        self.file.write(header + body)
+        self.file.flush()
+
+        height = len(self)
+        self.offsets.append(self.end)
+        self.heights[raw_hash(block['hashKey'])] = height
+        self.end += HEADER.size + len(body)
+        self.cache_block(height, block)
+
+    def extend(self, blocks: [dict]) -> None:
+        for block in blocks:
+            self.append(block)
+
+    '''
+    Remove the blocks from the given height and on, e.g. when we switch to another chain
+    '''
+    def truncate(self, height: int) -> None:
+
+        if height >= len(self):
+            return
+
+        for h in range(height, len(self)):
+            self.heights.pop(self.hash_at(h, raw=True), None)
+            self.cache.pop(h, None)
+
+        self.end = self.offsets[height]
+        del self.offsets[height:]
+
+        # The mapping must not cover the removed part of the file
+        self.map = None
+        self.file.truncate(self.end)
+
+        if self.persisted_height > height:
+            self.mark_persisted(height)
+
+    '''
+    Record that the state of the node is stored up to the given height, so a reopen keeps these blocks
+    '''
+    def mark_persisted(self, height: int) -> None:
+
+        if height != self.persisted_height:
+            os.pwrite(self.file.fileno(), FILE_HEADER.pack(FILE_MAGIC, height), 0)
+            self.persisted_height = height
+
+    '''
+    The height till which our blocks are the same as the given chain (a list of blocks),
+    the hashes of our blocks are read from their headers
+    '''
+    def fork_height(self, chain: [dict]) -> int:
+
+        height = min(len(self), len(chain))
+        while height > 0 and self.hash_at(height - 1) != chain[height - 1]['hashKey']:
+            height -= 1
+
+        return height
+
+    # -------------- Single blocks --------------
+
+    def height_of_index(self, index: int) -> int:
+
+        height = index + len(self) if index < 0 else index
+        if not 0 <= height < len(self):
+            raise IndexError('block index out of range')
+        return height
+
+    '''
+    The decoded block, which is parsed from a copy of its body and kept at the cache.
+    The body itself is read without copying it with body().
+    '''
+    def block_at(self, height: int) -> dict:
+
+        block = self.cache.get(height)
+        if block is not None:
+            self.cache.move_to_end(height)
+            return block
+
+        block = json.loads(bytes(self.body(height)))
+        self.cache_block(height, block)
+        return block
+
+    '''
+    The JSON body of the block as a memoryview of the mapped file, without copying it.
+    It is valid until the next append or truncate.
+    '''
+    def body(self, height: int) -> memoryview:
+
+        offset = self.offsets[height]
+        _, _, length, _, _ = HEADER.unpack_from(self.view(), offset)
+        return memoryview(self.view())[offset + HEADER.size:offset + HEADER.size + length]
+
+    '''
+    The hashKey of a block from its header, without decoding the block
+    '''
+    def hash_at(self, index: int, raw: bool = False):
+
+        _, _, _, hash_key, _ = HEADER.unpack_from(self.view(), self.offsets[self.height_of_index(index)])
+        return hash_key if raw else hash_key.hex()
+
+    def height_of(self, hash_key: str) -> int:
+        return self.heights.get(raw_hash(hash_key))
+
+    def get_by_hash(self, hash_key: str) -> dict:
+
+        height = self.height_of(hash_key)
+        return None if height is None else self.block_at(height)
+
+    def __contains__(self, hash_key: str) -> bool:
+        return self.height_of(hash_key) is not None
+
+    # -------------- File --------------
+
+    def view(self) -> mmap.mmap:
+
+        # Map the file again when it has grown
+        if self.map is None or len(self.map) < self.end:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self.map
+
+    '''
+    Read the headers of the records which are in the file, drop an incomplete record at its end
+    and the blocks after the persisted height
+    '''
+    def scan(self) -> None:
+
+        size = os.fstat(self.file.fileno()).st_size
+
+        # A new file (or not a block file), so start it with an empty chain
+        header = self.file.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header)[0] != FILE_MAGIC:
+            self.file.truncate(0)
+            os.pwrite(self.file.fileno(), FILE_HEADER.pack(FILE_MAGIC, 0), 0)
+            return
+
+        self.persisted_height = FILE_HEADER.unpack(header)[1]
+
+        view = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = FILE_HEADER.size
+        while offset + HEADER.size <= size:
+
+            magic, height, length, hash_key, _ = HEADER.unpack_from(view, offset)
+            if magic != MAGIC or height != len(self.offsets) or offset + HEADER.size + length > size:
+                break
+
+            self.offsets.append(offset)
+            self.heights[hash_key] = height
+            offset += HEADER.size + length
+
+        self.end = offset
+        self.map = view
+        if self.end < size:
+            self.map = None
+            self.file.truncate(self.end)
+
+        # The node stored its state before these blocks, so they can't be trusted
+        if len(self) > self.persisted_height:
+            self.truncate(self.persisted_height)
+
+        # Fewer blocks than the persisted height, the file has lost some of them
+        elif len(self) < self.persisted_height:
+            self.mark_persisted(len(self))
+
+    def cache_block(self, height: int, block: dict) -> None:
+
+        self.cache[height] = block
+        self.cache.move_to_end(height)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def close(self) -> None:
+        self.map = None
+        self.file.close()
@@ -0,0 +1,100 @@
+import json
+from Crypto.Hash import SHA256
+
+'''
+Keeps the location (block height, position in the block) of every transaction in our chain,
+so that we don't have to walk the whole chain in order to find if a transaction is already added.
+The index is updated incrementally when a block is added and rolled back when the chain is replaced.
+'''
+class TransactionIndex:
+
+    def __init__(self, chain: [dict] = None):
+
+        # Key: transaction id, Value: (block height, position in the block)
+        self.locations = {}
+
+        if chain is not None:
+            self.rebuild(chain)
+
+    def __contains__(self, transaction_id: str) -> bool:
+        return transaction_id in self.locations
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def get(self, transaction_id: str) -> tuple:
+        return self.locations.get(transaction_id)
+
+    def add_block(self, height: int, block: dict) -> None:
+
+        for position, trans in enumerate(block['transactions']):
+            self.locations[trans['id']] = (height, position)
+
+    '''
+    Remove the transactions of all the blocks of the chain from the given height and on
+    '''
+    def rollback(self, chain: [dict], height: int) -> None:
+
+        for block in chain[height:]:
+            for trans in block['transactions']:
+                location = self.locations.get(trans['id'])
+                if location is not None and location[0] >= height:
+                    del self.locations[trans['id']]
+
+    def rebuild(self, chain: [dict]) -> None:
+
+        self.locations = {}
+        for height, block in enumerate(chain):
+            self.add_block(height, block)
+
+    '''
+    Returns the ids of the given transactions which are already added in our chain
+    '''
+    def common_ids(self, transaction_ids) -> set:
+        return {trans_id for trans_id in transaction_ids if trans_id in self.locations}
+
+'''
+A rolling commitment to all the blocks of a chain:
+H_0 is 32 zero bytes and H_i = SHA256(H_{i-1} || SHA256(JSON of block i)).
+It is updated with every new block, so we never encode and hash the whole chain again.
+We keep H_i for every height, so when the chain is replaced after a fork only the new blocks are hashed.
+'''
+class ChainCommitment:
+
+    def __init__(self, chain: [dict] = None):
+
+        # H_1 ... H_n (raw digests)
+        self.digests = []
+
+        if chain is not None:
+            self.rebuild(chain)
+
+    def add_block(self, block: dict) -> None:
+
+        previous = self.digests[-1] if self.digests else bytes(32)
+        block_digest = SHA256.new(data=json.dumps(block).encode('utf-8')).digest()
+        self.digests.append(SHA256.new(data=previous + block_digest).digest())
+
+    '''
+    Forget the blocks from the given height and on
+    '''
+    def rollback(self, height: int) -> None:
+        del self.digests[height:]
+
+    def rebuild(self, chain: [dict]) -> None:
+
+        self.digests = []
+        for block in chain:
+            self.add_block(block)
+
+    def hexdigest(self) -> str:
+        return (self.digests[-1] if self.digests else bytes(32)).hex()
+
+    '''
+    The SHA256 hash object of the commitment, which is what the node signs
+    '''
+    def hash_object(self) -> SHA256:
+        return SHA256.new(data=bytes.fromhex(self.hexdigest()))
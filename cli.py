@@ -1,8 +1,8 @@
 import click
-import pymongo
 
-# Connect to database
-client = pymongo.MongoClient(host=['localhost:27017'], replicaset='rs0')
+from amount import parse_nbc, format_nbc
+from transport import create_transport, TRANSPORT, TRANSPORTS
+from storage import create_storage, STORAGE, STORAGES
 
 @click.group()
 def cli():
@@ -12,15 +12,21 @@ def cli():
 @click.argument('recipient_node_id', metavar='recipient_node_id')
 @click.argument('amount', metavar='amount')
 @click.option('--n', default='0', help='My node ID')
-def transaction(recipient_node_id: str, amount: str, n: str):
+@click.option('--t', default=TRANSPORT, type=click.Choice(TRANSPORTS), help='The transport of my node')
+def transaction(recipient_node_id: str, amount: str, n: str, t: str):
 
     """
     Transfer <amount> NBCs to node with id: <recipient_node_id>.
     """
 
-    db = client[f"node_{n}"]
-    message_queue = db['incoming_messages']
-    message_queue.insert_one({**{"type": "NewTransaction"}, **{
+    # The node converts the amount into base units, but we reject an invalid amount here
+    try:
+        parse_nbc(amount)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='amount')
+
+    transport = create_transport(kind=t, node_id=n)
+    transport.send({**{"type": "NewTransaction"}, **{
         "recipient_node_id": recipient_node_id,
         "amount": amount
     }})
@@ -29,31 +35,29 @@ def transaction(recipient_node_id: str, amount: str, n: str):
 
 @cli.command()
 @click.option('--n', default='0', help='My node ID')
-def view(n: str):
+@click.option('--s', default=STORAGE, type=click.Choice(STORAGES), help='The storage of my node')
+def view(n: str, s: str):
 
     """
     View the transactions contained in the last validated block in the blockchain.
     """
 
-    try:
+    storage = create_storage(kind=s, node_id=n)
 
-        db = client[f"node_{n}"]
-
-        # Get the node's current status
-        status_col = db["info"]
-        status_doc = list(status_col.find({"_id": "status_doc"}, {"_id": 0}))[0]
-        transactions = status_doc['chain'][-1]['transactions']
-
-        for x in transactions:
-            click.echo(x)
-            click.echo('------------------')
-
-    except IndexError:
+    # Get only the last block of the node's chain
+    last_block = storage.load_last_block()
+    if last_block is None:
         click.echo("There is not yet any validated block in the blockchain.")
+        return
+
+    for x in last_block['transactions']:
+        click.echo(x)
+        click.echo('------------------')
 
 @cli.command()
 @click.option('--n', default='0', help='My node ID')
-def balance(n: str):
+@click.option('--s', default=STORAGE, type=click.Choice(STORAGES), help='The storage of my node')
+def balance(n: str, s: str):
 
     """
     Shows the current balance of the wallet.
@@ -61,22 +65,16 @@ def balance(n: str):
 
     try:
 
-        db = client[f"node_{n}"]
+        storage = create_storage(kind=s, node_id=n)
 
         # Get the node's current status
-        status_col = db["info"]
-        status_doc = list(status_col.find({"_id": "status_doc"}, {"_id": 0}))[0]
+        status_doc = storage.load_status()
 
-        # Get all the node's UTXOs
+        # The node keeps the balance of every address, so we don't have to sum its UTXOs
         wallet_address = status_doc['public_key']
-        wallet_UTXOs = status_doc['UTXOs'][wallet_address]
-
-        # Calculate the balance
-        wallet_balance = 0.0
-        for utxo in wallet_UTXOs.values():
-            wallet_balance += float(utxo['amount'])
+        wallet_balance = storage.load_balance(wallet_address)
 
-        click.echo(wallet_balance)
+        click.echo(format_nbc(wallet_balance))
 
     except Exception as e:
         click.echo('Error with:')
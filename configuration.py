@@ -1,30 +1,22 @@
 from flask import Flask
 from flask_restx import Api
 from flask_cors import CORS
-import pymongo
-from pymongo import errors as pymongo_errors
 
-global db, api, app, message_queue, col
+global storage, api, app, persistence
 from node import Node
+from persistence import StatePersistence
+from storage import create_storage, STORAGE
 
-def init(node: Node):
+def init(node: Node, storage_kind: str = STORAGE):
 
-    global db, message_queue
+    global storage, persistence
 
-    client = pymongo.MongoClient(host=['localhost:27017'], replicaset='rs0')
+    # MongoDB or an embedded SQLite file
+    storage = create_storage(kind=storage_kind, node_id=node.node_id)
 
-    db = client[f"node_{node.node_id}"]
-    message_queue = db['incoming_messages']
-
-    # Initialize the database by adding one document into a collection
-    try:
-
-        db["info"].insert_one({**{
-            "_id": "status_doc"
-        }, **node.to_dict()})
-
-    except pymongo_errors.DuplicateKeyError:
-        print("Info collection already created")
+    # Initialize the database with the whole state of the node, after that we store only the changes
+    persistence = StatePersistence(storage)
+    persistence.init(node)
 
     # Initialize Flask application
     global api, app
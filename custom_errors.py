@@ -69,3 +69,18 @@ class TransactionAlreadyAdded(Exception):
 
     def __str__(self):
         return self.err
+
+class InvalidWireMessage(Exception):
+    def __init__(self, err: str):
+        self.err = err
+
+    def __str__(self):
+        return self.err
+
+class UnknownKeyReference(InvalidWireMessage):
+    def __init__(self, err: str, node_id: str = None):
+        self.err = err
+        self.node_id = node_id
+
+    def __str__(self):
+        return self.err
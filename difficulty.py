@@ -0,0 +1,73 @@
+import datetime
+
+'''
+The difficulty of a block is a target, a 256-bit number.
+A block is mined when its hash key (as a number) is at most the target of the block.
+Every block carries its target (as 64 hex digits) and the target is adjusted every RETARGET_INTERVAL blocks,
+so that the blocks are mined every TARGET_BLOCK_TIME seconds, whatever the number and the speed of the miners.
+'''
+
+MAX_TARGET = (1 << 256) - 1
+
+# The target can change at most by this factor at every retarget
+MAX_ADJUSTMENT = 4
+
+'''
+A hash key with DIFF leading hex zeros is the same as a hash key which is at most 2^(256 - 4*DIFF) - 1
+'''
+def diff_to_target(diff: int) -> int:
+    return (1 << (256 - 4 * diff)) - 1
+
+def target_to_hex(target: int) -> str:
+    return format(target, '064x')
+
+def target_to_bytes(target: int) -> bytes:
+    return target.to_bytes(32, 'big')
+
+def block_target(block: dict, initial_target: int) -> int:
+
+    # The genesis block of older chains has no target
+    if block.get('target') is None:
+        return initial_target
+
+    return int(block['target'], 16)
+
+def satisfies_target(hash_key: str, target: int) -> bool:
+    return int(hash_key, 16) <= target
+
+def parse_timestamp(timestamp: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(timestamp)
+
+def timespan_ms(start: datetime.datetime, end: datetime.datetime) -> int:
+    return (end - start) // datetime.timedelta(milliseconds=1)
+
+'''
+Find the target of the block at the given height of the chain, using only the blocks before it.
+The target stays the same as the target of the previous block, except every <interval> blocks,
+where it is scaled by the time that the last <interval> blocks actually took over the time they should take.
+'''
+def next_target(chain: [dict], height: int, initial_target: int, interval: int, block_time: float) -> int:
+
+    if height == 0:
+        return initial_target
+
+    prev_target = block_target(chain[height - 1], initial_target)
+
+    # It is not the time for retarget or there are not enough blocks yet
+    if height % interval != 0 or height <= interval:
+        return prev_target
+
+    # The timespans are integer milliseconds and the target is scaled with integer arithmetic only,
+    # so every node finds exactly the same target (floats would round the 256-bit target differently)
+    actual_ms = timespan_ms(
+        parse_timestamp(chain[height - 1 - interval]['timestamp']),
+        parse_timestamp(chain[height - 1]['timestamp'])
+    )
+    expected_ms = interval * round(block_time * 1000)
+
+    # Limit the adjustment, in order to avoid huge jumps because of a few fast or slow blocks
+    actual_ms = min(max(actual_ms, expected_ms // MAX_ADJUSTMENT), expected_ms * MAX_ADJUSTMENT)
+
+    new_target = prev_target * actual_ms // expected_ms
+
+    return min(max(new_target, 1), MAX_TARGET)
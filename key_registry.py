@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from Crypto.PublicKey import RSA
+from Crypto.Signature import pkcs1_15
+
+'''
+Importing a public key from its PEM address is expensive, so we do it only once for every key.
+The KeyRegistry keeps a ready pkcs1_15 verifier for the public key of every ring member,
+and the verifiers of the unknown senders in a bounded LRU cache.
+'''
+class KeyRegistry:
+
+    def __init__(self, cache_size: int = 128):
+
+        # Key: public address, Value: pkcs1_15 verifier
+        self.ring_verifiers = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    '''
+    This function is called every time the membership of the ring changes.
+    The keys that we have already parsed are not parsed again.
+    '''
+    def register_ring(self, ring: dict) -> None:
+
+        ring_verifiers = {}
+        for node in ring.values():
+            public_key = node['public_key']
+            verifier = self.ring_verifiers.get(public_key) or self.cache.pop(public_key, None)
+            ring_verifiers[public_key] = verifier if verifier is not None else self.new_verifier(public_key)
+
+        self.ring_verifiers = ring_verifiers
+
+    def verifier(self, public_key: str):
+
+        # Ring member
+        verifier = self.ring_verifiers.get(public_key)
+        if verifier is not None:
+            return verifier
+
+        # Unknown sender which we have already seen
+        verifier = self.cache.get(public_key)
+        if verifier is not None:
+            self.cache.move_to_end(public_key)
+            return verifier
+
+        # Unknown sender for the first time, so keep its verifier and forget the least recently used one
+        verifier = self.new_verifier(public_key)
+        self.cache[public_key] = verifier
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return verifier
+
+    '''
+    Raises ValueError when the signature is not valid, exactly like pkcs1_15
+    '''
+    def verify(self, public_key: str, msg_hash, signature: bytes) -> None:
+        self.verifier(public_key).verify(msg_hash, signature)
+
+    @staticmethod
+    def new_verifier(public_key: str):
+        return pkcs1_15.new(RSA.importKey(extern_key=public_key))
@@ -1,11 +1,17 @@
-from pymongo import errors as pymongo_errors
 import custom_errors
 from argparse import ArgumentParser
 import requests
 from subprocess import Popen
 from wallet import Wallet
-from transaction import Transaction
 from node import Node
+from block import Block
+from mempool import Mempool, TRANSACTION, REVERSED
+from scheduler import Scheduler, TRANSACTIONS
+from transport import create_transport, TRANSPORT, TRANSPORTS
+from storage import STORAGE, STORAGES
+from blockstore import block_store_path
+from verification import VerificationPool
+from amount import parse_nbc, format_nbc
 import network
 import time
 
@@ -13,6 +19,18 @@ import time
 bootstrap_address = '127.0.0.1'
 bootstrap_port = 5000
 
+# Keep a copy of every block that our node mines in the 'mined_blocks' collection (or table)
+AUDIT_MINED_BLOCKS = False
+
+# Processes which verify the signatures of the queued transactions in parallel (0 for one per core)
+VERIFICATION_WORKERS = 0
+
+# Smaller batches of queued transactions are verified one by one at the main loop
+VERIFICATION_MIN_BATCH = 8
+
+# The maximum number of queued transactions from the other nodes, the mempool evicts the rest
+MEMPOOL_SIZE = 10000
+
 # At first create a wallet
 my_wallet = Wallet()
 
@@ -20,6 +38,9 @@ my_wallet = Wallet()
 parser = ArgumentParser()
 parser.add_argument('-p', '--port', default=5000, type=int, help='port to listen on')
 parser.add_argument('-a', '--address', default='127.0.0.1', type=str, help='Network address')
+parser.add_argument('-t', '--transport', default=TRANSPORT, choices=TRANSPORTS,
+                    help='Transport of the incoming messages')
+parser.add_argument('-s', '--storage', default=STORAGE, choices=STORAGES, help='Storage of the node state')
 args = parser.parse_args()
 
 # Take the port & address & node_id of the new node
@@ -51,7 +72,8 @@ try:
     print('---------------------------------------')
 
     # Create the node object with the settings that we got from bootstrap
-    my_node = Node(wallet=my_wallet, chain=chain, ring=ring, UTXOs=UTXOs, node_id=node_id, address=address, port=port)
+    my_node = Node(wallet=my_wallet, chain=chain, ring=ring, UTXOs=UTXOs, node_id=node_id, address=address, port=port,
+                   block_store_path=block_store_path(address, port))
 
 except (requests.exceptions.ConnectionError, KeyError):
 
@@ -59,15 +81,51 @@ except (requests.exceptions.ConnectionError, KeyError):
     print("I am the Bootstrap node yeah!")
     print('---------------------------------------')
     node_id = '0'
-    my_node = Node(wallet=my_wallet, chain=[], ring={}, UTXOs={}, node_id=node_id, address=bootstrap_address, port=bootstrap_port)
+    my_node = Node(wallet=my_wallet, chain=[], ring={}, UTXOs={}, node_id=node_id, address=bootstrap_address, port=bootstrap_port,
+                   block_store_path=block_store_path(bootstrap_address, bootstrap_port))
+
+# ----------- Scheduler -----------
+# All the messages of the node are delivered to the main loop through the scheduler
+scheduler = Scheduler()
+
+# ----------- Verification Pool -----------
+# The processes of the pool and of the mining service are forked, so both start before any other thread of this process,
+# and the pool before the mining service, which starts its collector thread
+verification_pool = VerificationPool(workers=VERIFICATION_WORKERS)
+
+# The ids of the queued messages whose transactions have already been verified by the pool
+verified_messages = set()
+
+# ----------- Mining Service -----------
+def found_nonce(block_dict: dict):
+
+    # Notify the node that its block is mined, it preempts all the other messages
+    scheduler.put(message_type='FoundNonce', message_data={'block_dict': block_dict}, message_id=None)
+
+    # The database copy is only for monitoring, the node does not wait for it
+    if AUDIT_MINED_BLOCKS:
+        configuration.storage.save_mined_block(block_dict)
+
+# The mining workers are long-lived processes, which are started only once together with the node
+my_node.start_mining_service(on_found=found_nonce)
+
+# ----------- Mempool -----------
+# The transactions that wait to be added to our current block
+mempool = Mempool(max_size=MEMPOOL_SIZE)
 
 # ----------- Database Configuration -----------
 # We have now created a Node object, so we are ready to configure the database
 import configuration
-configuration.init(node=my_node)
+configuration.init(node=my_node, storage_kind=args.storage)
+
+# ----------- Transport -----------
+# The incoming messages are delivered to the scheduler, so the node has to listen before the server starts
+transport = create_transport(kind=args.transport, node_id=node_id)
+transport.start(scheduler)
 
 # ----------- Set Up Api Server -----------
-server_proc = Popen(["python", "server.py", "-a", address, "-p", str(port), "-n", node_id])
+server_proc = Popen(["python", "server.py", "-a", address, "-p", str(port), "-n", node_id, "-t", args.transport,
+                     "-s", args.storage])
 time.sleep(2)   # Wait till the server is up
 
 # Now we are ready to notify the bootstrap node that a new node has arrived
@@ -82,164 +140,139 @@ if node_id != '0':
         }
     )
 
-global queued_messages
-
 '''
 This function is for all the nodes and it is called after every action
 in order to monitor the system through the database
 '''
 def update_status(node: Node):
 
-    query = {"_id": "status_doc"}
-    new_values = {"$set": node.to_dict()}
-    configuration.db["info"].update_one(query, new_values)
+    # Store only what has changed
+    configuration.persistence.save(node)
 
-    print(my_node.wallet.balance(my_node.UTXOs))
+    print(format_nbc(my_node.wallet.balance(my_node.UTXOs)))
 
     print("STATUS UPDATED")
     print('---------------------------------------')
 
 '''
-When a new block arrives or when we have found a nonce number, we have to process the message immediately,
-So at dequeue_messages we always call this function in order to check if a new block arrived 
+Queue a 'transaction' or 'NewTransaction' message in the mempool.
+The messages of the duplicate or evicted transactions are deleted from the message collection.
 '''
-def check_for_new_block():
-
-    # Check if another node has mined a block
-    block_arrived_doc = list(configuration.message_queue.find({"type": "block"}))
-    if len(block_arrived_doc) > 0:
+def queue_message(message_type: str, message_data: dict, message_id: str):
 
-        print('New block arrived while dequeue process')
-        print('---------------------------------------')
-
-        return block_arrived_doc[0]
-
-    # Check if our node has mined its block
-    else:
-        found_nonce_doc = list(configuration.message_queue.find({"type": "FoundNonce"}))
-        if len(found_nonce_doc) > 0:
+    for dropped in mempool.add_message(message_type, message_data, message_id):
+        drop_message(dropped)
 
-            print('Found Nonce while dequeue process')
-            print('---------------------------------------')
+def drop_message(entry):
 
-            return found_nonce_doc[0]
+    print(f'Drop the queued transaction {entry.key}')
+    print('---------------------------------------')
 
-        # Nothing happened
-        else:
-            return None
+    verified_messages.discard(entry.message_id)
+    if entry.message_id is not None:
+        transport.ack(entry.message_id)
 
 '''
-This function sorts the messages in the list 'queued_messages' 
-giving priority to the type and the timestamp
+Verify the signatures and the hashes of all the queued transactions in parallel.
+The invalid transactions are removed from the queue, and the valid ones are only checked for their UTXOs when we dequeue them.
 '''
-def prioritize_messages():
+def verify_queued_transactions():
 
-    global queued_messages
+    batch = [x for x in mempool.of_kind(TRANSACTION) if x.message_id not in verified_messages]
+    if len(batch) < VERIFICATION_MIN_BATCH:
+        return
 
-    # First priority the oldest messages with the type 'transaction'
-    transaction_list = [x for x in queued_messages if x[0] == 'transaction']
-    sorted_transaction_list = sorted(transaction_list, key=lambda k: k[1]['timestamp'])
+    print(f'Verify {len(batch)} queued transactions in parallel')
+    print('---------------------------------------')
 
-    # Second priority the 'NewTransaction'
-    new_trans_list = [x for x in queued_messages if x[0] == 'NewTransaction']
+    errors = verification_pool.verify_batch([x.data for x in batch])
 
-    queued_messages = []
-    queued_messages.extend(sorted_transaction_list)
-    queued_messages.extend(new_trans_list)
+    for entry, error in zip(batch, errors):
+        if error is None:
+            verified_messages.add(entry.message_id)
+        else:
+            print(f'Error at node_{my_node.node_id}')
+            print(error)
+            mempool.remove(entry.key)
+            transport.ack(entry.message_id)
 
+'''
+Process the queued transactions until the mempool is empty, or until our node starts mining,
+or until a block arrives (or our node finds a nonce), which the main loop has to process first.
+'''
 def dequeue_messages(tagline: str = ''):
 
-    global queued_messages
-
-    prioritize_messages()
+    print(tagline)
+    print(mempool.summary())
+    print('---------------------------------------')
 
-    for _ in range(len(queued_messages)):
+    verify_queued_transactions()
 
-        print(tagline)
-        print('---------------------------------------')
+    while len(mempool) > 0:
 
-        new_block = check_for_new_block()
-        if new_block is not None:
-            process_the_message(
-                message_type=new_block['type'],
-                message_data={k: v for k, v in new_block.items() if k not in ['_id', 'type']},
-                message_id=new_block['_id']
-            )
+        # A new block is waiting at the scheduler
+        if scheduler.has_urgent():
+            print('A block is waiting, so stop getting messages from the queue')
+            print('---------------------------------------')
             return
 
-        q_messages_types = [x[0] for x in queued_messages]
-        print(q_messages_types)
-        print('---------------------------------------')
-
         # If the node started mining then stop
-        time.sleep(1)
-        if my_node.mining_proc.poll() is None:
+        if my_node.miner.is_mining():
             print('Mining started again, so stop getting messages from the queue')
             print('---------------------------------------')
             return
 
-        try:
-            # Add the transaction
-            q_message = queued_messages.pop(0)
+        entry = mempool.pop()
+        if entry is None:
+            return
+
+        # The reversed transactions are already validated, unless our pending transactions were reversed since then
+        if entry.kind == REVERSED:
+            my_node.add_reversed_transaction(transaction=entry.data)
+
+        # Add the transaction
+        else:
             process_the_message(
-                message_type=q_message[0],
-                message_data=q_message[1],
-                message_id=q_message[2]
+                message_type=entry.message_type(),
+                message_data=entry.data,
+                message_id=entry.message_id
             )
-        except IndexError:
-            return
 
 '''
 This function is used to reverse transactions in order not to lose them.
 For example when a node starts mining, after that it creates a new current_block, 
 so if the mining fails because of the arrival of another mined block 
 we don't want to lose the transactions in the block which was in mining process.
-So we reverse these transactions and we add them again to our current_block without validation
+So we put these Transaction objects back to the mempool, and they are added again to our current_block without validation
 '''
-def common_transaction_in_mining_block(new_block_trans_ids: [str], mining_block: dict, ignore_mining: bool = False):
+def common_transaction_in_mining_block(new_block_trans_ids, mining_block: Block, ignore_mining: bool = False):
 
-    if not ignore_mining and mining_block['hashKey'] is not None:
-        print('This node was not mining, so there is nothing for reverse.')
+    if mining_block is None:
         return
 
-    try:
-        mining_block_trans_ids = [trans['id'] for trans in mining_block['transactions']]
-        uncommon_trans_ids = [x for x in mining_block_trans_ids if x not in new_block_trans_ids]
-        uncommon_trans = [trans for trans in mining_block['transactions'] if trans['id'] in uncommon_trans_ids]
-    except TypeError:
+    if not ignore_mining and mining_block.hash_key is not None:
+        print('This node was not mining, so there is nothing for reverse.')
         return
 
+    # The transactions that are in our chain now (e.g. of our own mined block) are not reversed
+    new_block_trans_ids = set(new_block_trans_ids)
+    uncommon_trans = [trans for trans in mining_block.list_of_transactions
+                      if trans.id not in new_block_trans_ids and trans.id not in my_node.transaction_index]
+
     print(f'Reverse {len(uncommon_trans)} transactions.')
     print('---------------------------------------')
 
-    for trans in uncommon_trans:
-
-        # Create the transaction object
-        # Set the timestamp in order to create the same transaction id with the original
-        trans_object = Transaction(
-            sender_address=trans['sender'],
-            receiver_address=trans['receiver'],
-            amount=trans['amount'],
-            timestamp=trans['timestamp'],
-            transaction_inputs=trans['inputTransactions'],
-            signature=trans['signature'].encode('ISO-8859-1')
-        )
+    for trans_object in uncommon_trans:
 
-        # Create the TransactionOutputs
-        surplus = None
-        for output_trans in trans['outputTransactions']:
-            if output_trans['receiverAddress'] == trans['sender']:
-                surplus = output_trans['amount']
-        if surplus is None:
-            print('Error in creating the transaction outputs')
-        else:
-            trans_object.add_transaction_outputs(surplus)
-
-        print(f"Reverse transaction with amount {trans['amount']}.")
+        print(f"Reverse transaction with amount {format_nbc(trans_object.amount)}.")
         print('---------------------------------------')
 
-        # Add the uncommon transactions to my current block and avoid validation
-        my_node.add_transaction_to_block(transaction=trans_object)
+        for dropped in mempool.add_reversed(trans_object):
+            drop_message(dropped)
+
+    # Its transactions are at the mempool now, so they are not reversed again (e.g. by resolve_conflicts)
+    if mining_block is my_node.block_for_mining:
+        my_node.block_for_mining = None
 
 def process_the_message(message_type: str, message_data: dict, message_id: str):
 
@@ -247,18 +280,25 @@ def process_the_message(message_type: str, message_data: dict, message_id: str):
         if message_type == 'block':
 
             print('New block arrived.')
-            configuration.message_queue.delete_one({'_id': message_id})
+            transport.ack(message_id)
+
+            # The same block again (e.g. a retried message), so our mining goes on
+            if message_data['hashKey'] in my_node.chain:
+                raise custom_errors.NoValidationNeeded(err='This block is already in my chain.')
 
             # Need to stop every mining process running
-            if my_node.mining_proc is not None:
-                if my_node.mining_proc.poll() is None:
-                    print('Stop mining.')
-                    Popen.terminate(my_node.mining_proc)
-                    print('---------------------------------------')
+            if my_node.miner.is_mining():
+                print('Stop mining.')
+                my_node.miner.cancel()
+                print('---------------------------------------')
 
             # Receive the new block
             my_node.receive_block(message_data)
 
+            # The queued transactions which are in the new block are not needed anymore
+            for dropped in mempool.remove_transactions([trans['id'] for trans in message_data['transactions']]):
+                drop_message(dropped)
+
             print('Check for common transactions in the mining block in order not to lose them.')
             if my_node.block_for_mining is not None:
                 common_transaction_in_mining_block(
@@ -272,7 +312,8 @@ def process_the_message(message_type: str, message_data: dict, message_id: str):
         elif message_type == 'transaction':
 
             # ----
-            my_node.validate_transaction(message_data)
+            my_node.validate_transaction(message_data, verified=message_id in verified_messages)
+            verified_messages.discard(message_id)
 
         elif message_type == 'ring':
 
@@ -294,13 +335,11 @@ def process_the_message(message_type: str, message_data: dict, message_id: str):
 
             my_node.create_transaction(
                 receiver_node_id=message_data['recipient_node_id'],
-                amount=message_data['amount']
+                amount=parse_nbc(message_data['amount'])
             )
 
         elif message_type == 'FoundNonce':
 
-            configuration.message_queue.delete_one({'_id': message_id})
-
             # Get the mined block and broadcast it
             my_node.broadcast_block(block_dict=message_data['block_dict'])
 
@@ -337,6 +376,12 @@ def process_the_message(message_type: str, message_data: dict, message_id: str):
         print('Maybe it is time to call the Consensus Algorithm.')
         my_node.resolve_conflicts()
 
+        # The reversed transactions were validated on top of our old chain, so they are validated again
+        reversed_entries = sorted(mempool.of_kind(REVERSED), key=lambda entry: entry.sort_key)
+        for entry in reversed_entries:
+            mempool.remove(entry.key)
+        my_node.revalidate_transactions([entry.data for entry in reversed_entries])
+
         # Dequeue now all the messages
         dequeue_messages('Get some messages from my Queue. (Conflict)')
 
@@ -377,76 +422,50 @@ def process_the_message(message_type: str, message_data: dict, message_id: str):
     # Update status on every new action
     update_status(my_node)
 
-    # Remove the message from the message collection in MongoDB
-    configuration.message_queue.delete_one({'_id': message_id})
+    # Remove the message from the transport
+    # (the blocks that we mined are not stored there)
+    if message_id is not None:
+        transport.ack(message_id)
 
-# -------------------- Streaming messages --------------------
+# -------------------- Main loop --------------------
 
-pipeline = [{'$match': {'operationType': 'insert'}}]
+while True:
 
-try:
-    resume_token = None
-
-    queued_messages = []
-
-    with configuration.message_queue.watch(pipeline) as stream:
-        for insert_change in stream:
-
-            # Get the message type and keep only the usefull data
-            new_message_type = insert_change['fullDocument']['type']
-            new_message_data = {k: v for k, v in insert_change['fullDocument'].items() if k not in ['_id', 'type']}
-            new_message_id = insert_change['fullDocument']['_id']
-            new_message = (new_message_type, new_message_data, new_message_id)
-
-            try:
-
-                if new_message_type not in ['transaction', 'NewTransaction']:
-                    process_the_message(
-                        message_type=new_message_type,
-                        message_data=new_message_data,
-                        message_id=new_message_id
-                    )
-                else:
-                    # We are mining
-                    if my_node.mining_proc.poll() is None:
-                        print(f'Node is mining so we will queue this message. {new_message_type}')
-                        queued_messages.append(new_message)
-
-                    # We are NOT mining
-                    else:
-                        queued_messages.append(new_message)
-                        dequeue_messages('Dequeue from streaming function')
-
-            # We haven't mined any block yet
-            except AttributeError as e:
-
-                process_the_message(
-                    message_type=new_message_type,
-                    message_data=new_message_data,
-                    message_id=new_message_id
-                )
+    # Wait for the next message, the blocks come first
+    new_message = scheduler.get()
 
-            resume_token = stream.resume_token
-            time.sleep(1)
+    # The transport is closed
+    if new_message is None:
+        break
 
-except pymongo_errors.PyMongoError as e:
+    new_message_type, new_message_data, new_message_id = new_message
 
-    # The ChangeStream encountered an unrecoverable error or the
-    # resume attempt failed to recreate the cursor.
-    if resume_token is None:
+    if new_message_type not in ['transaction', 'NewTransaction']:
+        process_the_message(
+            message_type=new_message_type,
+            message_data=new_message_data,
+            message_id=new_message_id
+        )
+        continue
 
-        # There is no usable resume token because there was a
-        # failure during ChangeStream initialization.
-        print(str(e))
+    # Queue this message together with all the other transactions that are waiting, as one batch
+    queue_message(*new_message)
+    for waiting_message in scheduler.drain(TRANSACTIONS):
+        queue_message(*waiting_message)
 
+    # We are mining, so the transactions wait until the mining is finished or cancelled
+    if my_node.miner.is_mining():
+        print(f'Node is mining so we will queue the messages. {mempool.summary()}')
+        print('---------------------------------------')
+
+    # We are NOT mining
     else:
-        # Use the interrupted ChangeStream's resume token to create
-        # a new ChangeStream. The new stream will continue from the
-        # last seen insert change without missing any events.
-        with configuration.message_queue.watch(
-                pipeline, resume_after=resume_token) as stream:
-            for insert_change in stream:
-                print(insert_change)
-
-# Terminate the sever process
+        dequeue_messages('Dequeue from streaming function')
+
+# Terminate the sever process, the transport, the outgoing messages, the peer connections and the mining workers
 Popen.terminate(server_proc)
+transport.stop()
+my_node.outbound.stop()
+network.close_peers()
+my_node.miner.stop()
+verification_pool.stop()
@@ -0,0 +1,194 @@
+import heapq
+import itertools
+
+# The kinds of the pending entries, in order of priority
+REVERSED = 0        # Transaction objects of an abandoned mining block, they are already validated
+TRANSACTION = 1     # 'transaction' messages from the other nodes
+NEW_TRANSACTION = 2 # 'NewTransaction' messages from the cli
+
+KINDS = {
+    'transaction': TRANSACTION,
+    'NewTransaction': NEW_TRANSACTION
+}
+
+'''
+A pending message or transaction.
+The key is the transaction id, or the message id for a 'NewTransaction' which has no transaction yet.
+'''
+class MempoolEntry:
+
+    __slots__ = ('key', 'kind', 'data', 'message_id', 'sender', 'sort_key')
+
+    def __init__(self, key: str, kind: int, data, message_id, sender: str, sort_key: tuple):
+        self.key = key
+        self.kind = kind
+        self.data = data
+        self.message_id = message_id
+        self.sender = sender
+        self.sort_key = sort_key
+
+    def message_type(self) -> str:
+        return 'transaction' if self.kind == TRANSACTION else 'NewTransaction'
+
+'''
+The Mempool keeps the transactions that wait to be added to our current block.
+The entries are popped by kind and then by timestamp from a heap, so the oldest transactions come first.
+It keeps an index by key in order to drop duplicates, and an index by sender.
+When it is full the newest transaction of the sender with the most pending transactions is evicted.
+The reversed transactions and the 'NewTransaction' messages are never evicted.
+'''
+class Mempool:
+
+    def __init__(self, max_size: int = 10000):
+
+        self.max_size = max_size
+
+        # key -> MempoolEntry
+        self.entries = {}
+
+        # sender -> {keys of its evictable entries}
+        self.senders = {}
+
+        # Heap of (sort_key, key), the entries which are removed stay in the heap until they are popped
+        self.heap = []
+
+        # Keeps the arrival order of the entries with the same kind and timestamp
+        self.counter = itertools.count()
+
+        # The number of entries of every kind
+        self.counts = [0, 0, 0]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    '''
+    Add a message that came from the message queue.
+    Returns the entries that were dropped (the duplicate or the evicted ones), in order to delete their messages.
+    '''
+    def add_message(self, message_type: str, message_data: dict, message_id) -> list:
+
+        kind = KINDS[message_type]
+
+        if kind == TRANSACTION:
+            key = message_data['id']
+            sender = message_data['sender']
+            sort_key = (kind, message_data['timestamp'], next(self.counter))
+        else:
+            key = str(message_id)
+            sender = None
+            sort_key = (kind, '', next(self.counter))
+
+        return self._add(MempoolEntry(key, kind, message_data, message_id, sender, sort_key))
+
+    '''
+    Add back a Transaction object of a block that we were mining, without rebuilding it.
+    '''
+    def add_reversed(self, transaction) -> list:
+
+        # An older copy of the same transaction (e.g. a message that came twice) is replaced
+        dropped = []
+        if transaction.id in self.entries:
+            dropped.append(self.remove(transaction.id))
+
+        sort_key = (REVERSED, transaction.timestamp, next(self.counter))
+        return dropped + self._add(MempoolEntry(transaction.id, REVERSED, transaction, None, None, sort_key))
+
+    def _add(self, entry: MempoolEntry) -> list:
+
+        # Drop the duplicates
+        if entry.key in self.entries:
+            return [entry]
+
+        dropped = []
+        if entry.kind == TRANSACTION and len(self.entries) >= self.max_size:
+            evicted = self._evict(entry)
+            dropped.append(evicted)
+            if evicted is entry:
+                return dropped
+
+        self.entries[entry.key] = entry
+        self.counts[entry.kind] += 1
+        heapq.heappush(self.heap, (entry.sort_key, entry.key))
+        if entry.sender is not None:
+            self.senders.setdefault(entry.sender, set()).add(entry.key)
+
+        return dropped
+
+    '''
+    Choose which transaction to drop in order to make room for the new entry.
+    '''
+    def _evict(self, new_entry: MempoolEntry) -> MempoolEntry:
+
+        # The sender with the most pending transactions, counting the new one
+        sender, keys = max(self.senders.items(), key=lambda x: len(x[1]), default=(None, set()))
+        if len(keys) < len(self.senders.get(new_entry.sender, ())) + 1:
+            return new_entry
+
+        # Its newest transaction, unless the new one is even newer
+        victim = max((self.entries[key] for key in keys), key=lambda x: x.sort_key)
+        if new_entry.sender == sender and new_entry.sort_key > victim.sort_key:
+            return new_entry
+
+        return self.remove(victim.key)
+
+    '''
+    Remove and return the entry with the highest priority, or None when the mempool is empty
+    '''
+    def pop(self) -> MempoolEntry:
+
+        while self.heap:
+            sort_key, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+
+            # Skip the entries that were removed (or replaced) after they were pushed
+            if entry is not None and entry.sort_key == sort_key:
+                return self.remove(key)
+
+        return None
+
+    def remove(self, key: str) -> MempoolEntry:
+
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+
+        self.counts[entry.kind] -= 1
+        if entry.sender is not None:
+            keys = self.senders[entry.sender]
+            keys.discard(key)
+            if not keys:
+                del self.senders[entry.sender]
+
+        # Rebuild the heap when it is mostly removed entries
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [(x.sort_key, x.key) for x in self.entries.values()]
+            heapq.heapify(self.heap)
+
+        return entry
+
+    '''
+    Remove the transactions that are already in a block.
+    Returns the removed entries.
+    '''
+    def remove_transactions(self, transaction_ids: [str]) -> list:
+        return [self.remove(x) for x in transaction_ids if x in self.entries]
+
+    def of_sender(self, sender: str) -> list:
+        return [self.entries[key] for key in self.senders.get(sender, ())]
+
+    def of_kind(self, kind: int) -> list:
+        return [entry for entry in self.entries.values() if entry.kind == kind]
+
+    '''
+    The number of pending entries of every message type, for monitoring
+    '''
+    def summary(self) -> dict:
+
+        return {
+            'reversed': self.counts[REVERSED],
+            'transaction': self.counts[TRANSACTION],
+            'NewTransaction': self.counts[NEW_TRANSACTION]
+        }
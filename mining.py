@@ -1,58 +1,233 @@
-from argparse import ArgumentParser
-from Crypto.Random import get_random_bytes
-from Crypto.Hash import SHA256
-import json
+import multiprocessing
+import threading
+import hashlib
 import os
 
-# Get command line arguments
-parser = ArgumentParser()
-parser.add_argument('-b', '--block_bytearray_str', default=None, type=str)
-parser.add_argument('-bd', '--block_dict_str', default=None, type=str, help='The block_dict as a string in format of bytes')
-parser.add_argument('-d', '--diff', default=None, type=int)
-parser.add_argument('-n', '--node_id', default=None, type=str, help='Node ID')
+from difficulty import target_to_bytes
 
-args = parser.parse_args()
-block_bytearray_str = args.block_bytearray_str
-DIFF = args.diff
-node_id = args.node_id
+# Every nonce is a counter of NONCE_SIZE bytes in big endian order
+NONCE_SIZE = 8
 
-# Create the block_dict
-block_dict = json.loads(args.block_dict_str)
+# How many nonces a worker tries before checking if its job has been found, cancelled or replaced
+CHECK_INTERVAL = 1 << 12
 
-# Initialize Database Connection
-import pymongo
+'''
+Search the range [start, stop) of the nonce space.
+The SHA256 state of the block bytearray is computed once, so for every nonce we copy it and hash only the nonce.
+The raw digest is compared with the target (32 bytes in big endian order), so we don't produce any hexdigest.
+Returns (nonce, hash_key) or None when the range is exhausted or when is_stopped() becomes true.
+'''
+def search_nonce_range(block_bytearray_before_nonce: bytes, target: bytes, start: int, stop: int, is_stopped) -> tuple:
 
-client = pymongo.MongoClient(host=['localhost:27017'], replicaset='rs0')
+    block_hash_state = hashlib.sha256(block_bytearray_before_nonce)
 
-db = client[f"node_{node_id}"]
-message_queue = db['incoming_messages']
+    for batch_start in range(start, stop, CHECK_INTERVAL):
 
-# Start mining
-block_bytearray_before_nonce = block_bytearray_str.encode('utf-8')
-print('START MINING...')
-print("---------------------------------------")
-while True:
+        # Another worker has found the nonce or the job is cancelled
+        if is_stopped():
+            return None
 
-    # Find a random nonce (in bytes)
-    nonce = get_random_bytes(64)
+        for counter in range(batch_start, min(batch_start + CHECK_INTERVAL, stop)):
 
-    # Add the nonce to the bytearray
-    temp_bytearray = bytearray()
-    temp_bytearray.extend(block_bytearray_before_nonce)
-    temp_bytearray.extend(nonce)
+            nonce = counter.to_bytes(NONCE_SIZE, 'big')
+            block_hash = block_hash_state.copy()
+            block_hash.update(nonce)
 
-    # Hash the block with SHA256
-    block_hash = SHA256.new(data=temp_bytearray)
+            if block_hash.digest() <= target:
+                return nonce, block_hash.hexdigest()
 
-    if block_hash.hexdigest()[0:DIFF] == DIFF * "0":
-        print("FOUND nonce:", block_hash.hexdigest())
-        print("---------------------------------------")
+    return None
 
-        block_dict['nonce'] = nonce.decode('ISO-8859-1')
-        block_dict['hashKey'] = block_hash.hexdigest()
-        message_queue.insert_one({**{"type": "FoundNonce"}, **{"block_dict": block_dict}})
+def nonce_range(worker_index: int, workers: int) -> tuple:
 
-        break
+    nonce_space = 1 << (8 * NONCE_SIZE)
+    range_size = nonce_space // workers
 
-# Kill myself
-os.system(f"kill {str(os.getpid())}")
+    # The last worker takes also the remainder, so the whole nonce space is searched
+    stop = nonce_space if worker_index == workers - 1 else (worker_index + 1) * range_size
+    return worker_index * range_size, stop
+
+def _find_nonce_worker(block_bytearray_before_nonce: bytes, target: bytes, start: int, stop: int,
+                       found: multiprocessing.Event, results: multiprocessing.Queue) -> None:
+
+    result = search_nonce_range(block_bytearray_before_nonce, target, start, stop, found.is_set)
+    if result is not None:
+        found.set()
+        results.put(result)
+
+'''
+Split the nonce space into disjoint ranges and search them in parallel with one process per range.
+The first worker which finds a nonce stops all the others.
+A block is mined when its digest is at most the target.
+Returns the nonce and the hash key of the mined block.
+This is a one-shot search, the node itself uses the long-lived MiningService.
+'''
+def find_nonce(block_bytearray_before_nonce: bytes, target: int, workers: int = 0) -> tuple:
+
+    # Use all the cores by default
+    workers = workers or os.cpu_count()
+
+    ctx = multiprocessing.get_context('fork')
+    found = ctx.Event()
+    results = ctx.Queue()
+    target = target_to_bytes(target)
+
+    procs = [
+        ctx.Process(
+            target=_find_nonce_worker,
+            args=(bytes(block_bytearray_before_nonce), target, *nonce_range(i, workers), found, results),
+            daemon=True
+        )
+        for i in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+
+    nonce, hash_key = results.get()
+
+    # Stop the other workers
+    found.set()
+    for proc in procs:
+        proc.join(timeout=1)
+        if proc.is_alive():
+            proc.terminate()
+
+    return nonce, hash_key
+
+'''
+The loop of a long-lived mining worker.
+It waits for jobs (job_id, block_bytearray_before_nonce, target) and searches its own part of the nonce space.
+The current_job is shared with the node, so when the node cancels or replaces the job the worker stops at its next check.
+'''
+def _mining_worker(worker_index: int, workers: int, jobs: multiprocessing.SimpleQueue,
+                   current_job: multiprocessing.Value, results: multiprocessing.Queue) -> None:
+
+    start, stop = nonce_range(worker_index, workers)
+
+    while True:
+
+        job = jobs.get()
+
+        # The service is stopped
+        if job is None:
+            return
+
+        job_id, block_bytearray_before_nonce, target = job
+
+        # This job has already been cancelled or replaced
+        if current_job.value != job_id:
+            continue
+
+        result = search_nonce_range(block_bytearray_before_nonce, target, start, stop,
+                                    lambda: current_job.value != job_id)
+        if result is not None:
+            results.put((job_id, *result))
+
+'''
+The MiningService starts its worker processes once, together with the node, and keeps them alive.
+The node submits a job for every full block and can cancel or replace it at any time,
+by changing the shared current job id which the workers check while they search.
+When a nonce is found the mined block_dict is passed to the on_found callback.
+'''
+class MiningService:
+
+    def __init__(self, on_found, workers: int = 0):
+
+        self.on_found = on_found
+        self.workers = workers or os.cpu_count()
+
+        # The workers are forked at start(), and a forked child gets only the thread that forked it,
+        # so the service has to start before this process runs any other thread (a lock held there would stay held
+        # in the workers). Its own collector thread starts only after the workers.
+        ctx = multiprocessing.get_context('fork')
+
+        # Id of the job that the workers are searching, 0 means that we are not mining
+        self.current_job = ctx.Value('Q', 0, lock=False)
+        self.job_counter = 0
+
+        # The block_dict of every job which is not finished yet
+        self.block_dicts = {}
+        self.lock = threading.Lock()
+
+        self.job_queues = [ctx.SimpleQueue() for _ in range(self.workers)]
+        self.results = ctx.Queue()
+        self.procs = [
+            ctx.Process(
+                target=_mining_worker,
+                args=(i, self.workers, self.job_queues[i], self.current_job, self.results),
+                daemon=True
+            )
+            for i in range(self.workers)
+        ]
+
+        self.collector = threading.Thread(target=self._collect_results, daemon=True)
+
+    def start(self) -> None:
+
+        for proc in self.procs:
+            proc.start()
+        self.collector.start()
+
+        print(f'Mining service started with {self.workers} workers.')
+        print('---------------------------------------')
+
+    def stop(self) -> None:
+
+        self.cancel()
+        for jobs in self.job_queues:
+            jobs.put(None)
+        for proc in self.procs:
+            proc.join(timeout=1)
+            if proc.is_alive():
+                proc.terminate()
+
+    def is_mining(self) -> bool:
+        return self.current_job.value != 0
+
+    '''
+    Start mining a new block. If the workers are already mining then the old job is replaced.
+    '''
+    def submit(self, block_dict: dict, block_bytearray_before_nonce: bytes, target: int) -> int:
+
+        with self.lock:
+            self.job_counter += 1
+            job_id = self.job_counter
+
+            self.block_dicts = {job_id: block_dict}
+            self.current_job.value = job_id
+
+        job = (job_id, bytes(block_bytearray_before_nonce), target_to_bytes(target))
+        for jobs in self.job_queues:
+            jobs.put(job)
+
+        return job_id
+
+    '''
+    Stop mining the current block, e.g. when another node has mined a block first.
+    '''
+    def cancel(self) -> None:
+
+        with self.lock:
+            self.current_job.value = 0
+            self.block_dicts = {}
+
+    def _collect_results(self) -> None:
+
+        while True:
+
+            job_id, nonce, hash_key = self.results.get()
+
+            with self.lock:
+
+                # Ignore the results of cancelled or replaced jobs
+                if job_id != self.current_job.value:
+                    continue
+
+                # Stop the other workers
+                self.current_job.value = 0
+                block_dict = self.block_dicts.pop(job_id)
+
+            print("FOUND nonce:", hash_key)
+            print("---------------------------------------")
+
+            self.on_found({**block_dict, 'nonce': nonce.decode('ISO-8859-1'), 'hashKey': hash_key})
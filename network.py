@@ -1,84 +1,270 @@
+from requests.adapters import HTTPAdapter
+import concurrent.futures
+import threading
 import requests
 import json
+import time
+
+import custom_errors
+import wire
+
+# How long we wait for a peer to accept the connection and to answer (seconds)
+CONNECT_TIMEOUT = 3.0
+READ_TIMEOUT = 10.0
+
+# The chain and the init settings carry the whole chain, so they may take longer
+CHAIN_READ_TIMEOUT = 60.0
+
+# The keep-alive connections that we keep open to every peer
+POOL_SIZE = 4
+
+# After so many failures in a row a peer is considered unhealthy, till it answers again
+MAX_FAILURES = 3
+
+# An unhealthy peer is not asked for its chain, till so many seconds have passed since its last failure (seconds)
+HEALTH_COOLDOWN = 10.0
+
+# The requests of a broadcast run in parallel, at most BROADCAST_WORKERS at a time
+BROADCAST_WORKERS = 16
+
+# How long we wait for the peers of a broadcast, a slow peer is not waited after that (seconds)
+BROADCAST_DEADLINE = 5.0
+
+JSON_HEADERS = {
+    'Content-Type': 'application/json'
+}
+
+'''
+The client of one peer (address:port).
+It keeps a pool of keep-alive connections to the peer, so every message does not open a new TCP connection,
+and it tracks the health of the peer: its failures in a row, when it last answered and how fast.
+It also remembers if the peer understands the binary format of wire.py (None till we know).
+'''
+class PeerClient:
+
+    def __init__(self, address: str, port: int):
+
+        self.base_url = f"http://{address}:{str(port)}"
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+
+        # Health
+        self.failures = 0
+        self.last_success = None
+        self.last_failure = None
+        self.latency = None
+        self.lock = threading.Lock()
+
+        self.wire = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.failures < MAX_FAILURES
+
+    '''
+    A peer is worth waiting for when it is healthy, or when its cooldown has passed and it may answer again
+    '''
+    @property
+    def available(self) -> bool:
+        return self.healthy or time.time() - self.last_failure >= HEALTH_COOLDOWN
+
+    def request(self, method: str, path: str, payload: dict = None, read_timeout: float = READ_TIMEOUT,
+                headers: dict = None, data: bytes = None) -> requests.Response:
 
-def send_transaction(address: str, port: int, transaction: dict):
-
-    url = f"http://{address}:{str(port)}/transaction"
+        # A JSON payload, or the given data with its own headers
+        if payload is not None:
+            headers, data = JSON_HEADERS, json.dumps(payload)
+
+        start = time.monotonic()
+        try:
+            response = self.session.request(
+                method,
+                self.base_url + path,
+                headers=headers or {},
+                data=data,
+                timeout=(CONNECT_TIMEOUT, read_timeout)
+            )
+
+        except requests.exceptions.RequestException:
+            self.record_failure()
+            raise
+
+        # A server error means that the peer is not well, the errors of the request itself are our own
+        if response.status_code >= 500:
+            self.record_failure()
+        else:
+            self.record_success(time.monotonic() - start)
+        return response
+
+    '''
+    The answers which are not 2xx raise HTTPError, so a message is never counted as delivered when it was not
+    '''
+    def post(self, path: str, payload: dict) -> str:
+
+        response = self.request('POST', path, payload)
+        response.raise_for_status()
+        return response.text
+
+    def get(self, path: str, read_timeout: float = READ_TIMEOUT):
+
+        response = self.request('GET', path, read_timeout=read_timeout)
+        response.raise_for_status()
+        return response.json()
+
+    '''
+    Send the data in the binary format when the peer understands it, otherwise send the JSON payload.
+    A peer that does not understand it answers with 415, and one that does not know a key of our ring with 422.
+    '''
+    def post_wire(self, path: str, kind: str, data, payload: dict, ring: dict = None) -> str:
+
+        if self.wire is not False:
+            try:
+                body = wire.encode(kind, data, ring)
+            except custom_errors.InvalidWireMessage:
+                body = None
+
+            if body is not None:
+                response = self.request('POST', path, headers={'Content-Type': wire.content_type()}, data=body)
+                if response.status_code == 415:
+                    self.wire = False
+                elif response.status_code != 422:
+                    response.raise_for_status()
+                    self.wire = True
+                    return response.text
+
+        return self.post(path, payload)
+
+    '''
+    Ask for the data in the binary format too, the peer answers in the format that it understands
+    '''
+    def get_wire(self, path: str, ring: dict = None, read_timeout: float = READ_TIMEOUT):
+
+        if self.wire is False:
+            return self.get(path, read_timeout=read_timeout)
+
+        response = self.request('GET', path, read_timeout=read_timeout,
+                                headers={'Accept': f"{wire.CONTENT_TYPE}, application/json;q=0.5"})
+        response.raise_for_status()
+
+        if response.headers.get('Content-Type', '').startswith(wire.CONTENT_TYPE):
+            try:
+                return wire.decode(response.content, ring)[1]
+            except custom_errors.UnknownKeyReference:
+                return self.get(path, read_timeout=read_timeout)
+
+        return response.json()
+
+    def record_success(self, latency: float) -> None:
+
+        with self.lock:
+            self.failures = 0
+            self.last_success = time.time()
+
+            # Moving average of the latency of the peer
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+    def record_failure(self) -> None:
+
+        with self.lock:
+            self.failures += 1
+            self.last_failure = time.time()
+
+    def health(self) -> dict:
+
+        return {
+            'healthy': self.healthy,
+            'available': self.available,
+            'failures': self.failures,
+            'last_success': self.last_success,
+            'last_failure': self.last_failure,
+            'latency': self.latency
+        }
 
-    payload = json.dumps(transaction)
-    headers = {
-      'Content-Type': 'application/json'
-    }
+    def close(self) -> None:
+        self.session.close()
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+# One client for every peer that we talk to
+peers = {}
+peers_lock = threading.Lock()
 
-    return response.text
+def peer(address: str, port: int) -> PeerClient:
 
-def send_block(address: str, port: int, block: dict):
+    with peers_lock:
+        client = peers.get((address, port))
+        if client is None:
+            client = peers[(address, port)] = PeerClient(address, port)
+        return client
 
-    url = f"http://{address}:{str(port)}/block"
+def peers_health() -> dict:
 
-    payload = json.dumps(block)
-    headers = {
-      'Content-Type': 'application/json'
-    }
+    with peers_lock:
+        return {f"{address}:{str(port)}": client.health() for (address, port), client in peers.items()}
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+def close_peers() -> None:
 
-    return response.text
+    with peers_lock:
+        for client in peers.values():
+            client.close()
+        peers.clear()
 
-def send_ring(address: str, port: int, ring: dict):
+# The threads of the broadcasts, they are started with the first broadcast
+executor = None
 
-    url = f"http://{address}:{str(port)}/ring"
+'''
+Start the given requests in parallel, calls is a dictionary of the key of every peer and a function without arguments.
+It returns the futures, so the caller can do its own work while the requests are running.
+'''
+def fan_out(calls: dict) -> dict:
 
-    payload = json.dumps(ring)
-    headers = {
-      'Content-Type': 'application/json'
-    }
+    global executor
+    with peers_lock:
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix='broadcast')
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+    return {key: executor.submit(call) for key, call in calls.items()}
 
-    return response.text
+'''
+Wait till the deadline for the requests of fan_out, and return the results of the peers that answered.
+The failed and the late peers are only reported, the late requests end on their own at their timeout.
+'''
+def collect(futures: dict, deadline: float = None) -> dict:
 
-def send_settings(address: str, port: int, settings: dict):
+    if deadline is None:
+        deadline = BROADCAST_DEADLINE
 
-    url = f"http://{address}:{str(port)}/settings"
+    concurrent.futures.wait(futures.values(), timeout=deadline)
 
-    payload = json.dumps(settings)
-    headers = {
-      'Content-Type': 'application/json'
-    }
+    results = {}
+    for key, future in futures.items():
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+        if not future.done():
+            print(f'No answer from node_{key} in {deadline} seconds')
+        elif future.exception() is not None:
+            print(f'Failed to reach node_{key} --> {str(future.exception())}')
+        else:
+            results[key] = future.result()
 
-    return response.text
+    return results
 
-def get_init_settings(address: str, port: int):
-
-    url = f"http://{address}:{str(port)}/init_settings"
-
-    response = requests.request("GET", url, headers={}, data={})
+def send_transaction(address: str, port: int, transaction: dict):
+    return peer(address, port).post('/transaction', transaction)
 
-    return response.json()
+def send_transactions(address: str, port: int, transactions: [dict], ring: dict = None):
+    return peer(address, port).post_wire('/transactions', 'transactions', transactions, {'transactions': transactions}, ring)
 
-def get_chain(address: str, port: int):
+def send_block(address: str, port: int, block: dict, ring: dict = None):
+    return peer(address, port).post_wire('/block', 'block', block, block, ring)
 
-    url = f"http://{address}:{str(port)}/chain"
+def send_ring(address: str, port: int, ring: dict):
+    return peer(address, port).post('/ring', ring)
 
-    response = requests.request("GET", url, headers={}, data={})
+def get_init_settings(address: str, port: int):
+    return peer(address, port).get('/init_settings', read_timeout=CHAIN_READ_TIMEOUT)
 
-    return response.json()
+def get_chain(address: str, port: int, ring: dict = None):
+    return peer(address, port).get_wire('/chain', ring, read_timeout=CHAIN_READ_TIMEOUT)
 
 def send_new_node_arrived(address: str, port: int, new_node_specs: dict):
-
-    url = f"http://{address}:{str(port)}/new_node_arrived"
-
-    payload = json.dumps(new_node_specs)
-    headers = {
-        'Content-Type': 'application/json'
-    }
-
-    response = requests.request("POST", url, headers=headers, data=payload)
-
-    return response.text
-
+    return peer(address, port).post('/new_node_arrived', new_node_specs)
@@ -2,41 +2,77 @@ N = 10
 C = 5
 DIFF = 5
 
+# The difficulty starts from DIFF and every RETARGET_INTERVAL blocks it is adjusted,
+# in order to mine a block every TARGET_BLOCK_TIME seconds
+RETARGET_INTERVAL = 10
+TARGET_BLOCK_TIME = 30.0
+
+# We keep the UTXO undo records of the last UNDO_DEPTH blocks, so we can switch to a fork at most that deep
+UNDO_DEPTH = 100
+
+# Number of processes which search for the nonce in parallel (0 for one per core)
+MINING_WORKERS = 0
+
+import functools
 import json
 from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
 from Crypto.Signature import pkcs1_15
-from subprocess import Popen
+from mining import MiningService
 
 import custom_errors
+from key_registry import KeyRegistry
+from chain_index import TransactionIndex, ChainCommitment
+from blockstore import BlockStore
+from ring import Ring
+from utxo import UTXO, UTXOSet, UndoRecord
+from amount import UNITS_PER_NBC, format_nbc
 from block import Block
+import difficulty
 from wallet import Wallet
 import network
+from outbox import Outbound
 from transaction import Transaction
+from verification import verify_transaction
 
 class Node:
 
 	"""
-	The chain is a list of blocks in the form of a dictionary
-	The ring is a dictionary which contains all the necessary communication information with the other nodes
-	The UTXOs is a dictionary with key the public_key of each node and with value a dictionary of TransactionOutputs
-	The mining_proc is a value which helps us to understand if the mining process is finished or not
-	The block_for_mining is a block.to_dict() which helps us to reverse transactions
-	The chain_transaction_ids is a set of transaction ids in order to avoid duplicate transactions in our chain
+	The chain is the BlockStore of our blocks (in the form of a dictionary), at the file of block_store_path
+	or at a temporary file, and it is used like a list
+	The ring is a Ring (dictionary) which contains all the necessary communication information with the other nodes
+	The UTXOs is a UTXOSet with the unspent TransactionOutputs of every public_key and the balance of every public_key
+	The miner is the long-lived MiningService which helps us to understand if the mining process is finished or not
+	The block_for_mining is the Block that we are mining, which helps us to reverse its transactions
+	The transaction_index keeps the location of every transaction in our chain in order to avoid duplicate transactions
+	The key_registry keeps the parsed public keys of the ring members, in order to verify signatures
+	The undo_journal has the UndoRecord of every block in our chain (None when we don't know it),
+	and pending_undo the UndoRecord of every validated transaction which is not in our chain yet
+	The chain_commitment is the rolling hash of our chain, which is updated with every new block,
+	and the chain_signature keeps its signature for the current tip
+	The outbound keeps the outgoing messages of every other node, which are sent at the background
 	"""
-	def __init__(self,  wallet: Wallet, chain: [dict], ring: dict, UTXOs: dict, node_id: str = '0', address: str = '127.0.0.1', port: int = 5000):
+	def __init__(self,  wallet: Wallet, chain: [dict], ring: dict, UTXOs: dict, node_id: str = '0', address: str = '127.0.0.1', port: int = 5000,
+				 block_store_path: str = None):
 
 		self.network_address = address
 		self.port = port
 		self.node_id = node_id
 		self.wallet = wallet
-		self.mining_proc = None
+		self.miner = None
 		self.block_for_mining = None
-		self.chain_transaction_ids = set()
+		self.transaction_index = TransactionIndex()
+		self.key_registry = KeyRegistry()
+		self.undo_journal = []
+		self.pending_undo = {}
+		self.chain_commitment = ChainCommitment()
+		self.chain_signature = None
+		self.outbound = Outbound()
+
+		# The blocks of a previous run of this node are reopened, till the height whose state was persisted
+		self.chain = BlockStore(block_store_path)
 
-		# Key: Node public addresses
-		# Value: List of TransactionOutput.to_dict()
-		self.UTXOs = {}
+		# The unspent outputs indexed by the public addresses of their receivers
+		self.UTXOs = UTXOSet()
 
 		print('Creating the Node object.')
 
@@ -46,28 +82,30 @@ class Node:
 			# The ring is where we store information for every node, as its id, its address (ip:port) and its public key
 			# That's why here we only add at the ring the boostrap node
 			# It is a dictionary where the key is the id of each node
-			self.ring = {
+			self.ring = Ring({
 				'0': {
 					'address': address,
 					'port': port,
 					'public_key': self.wallet.address
 				}
-			}
+			})
+			self.key_registry.register_ring(self.ring)
+			self.outbound.register_ring(self.ring)
 
 			# Create the first transaction where the boostrap node takes the first NBCs
 			first_transaction = Transaction(
 				sender_address='0',
 				receiver_address=self.wallet.address,
-				amount=str(100.0*N),
+				amount=100*N*UNITS_PER_NBC,
 				transaction_inputs=[]
 			)
 
 			# This transaction does not need validation
-			first_transaction.add_transaction_outputs(surplus_amount='0')
+			first_transaction.add_transaction_outputs(surplus_amount=0)
 			first_transaction.sign_transaction(wallet.private_key)
 
 			# Create the genesis block
-			self.current_block = Block(prev_hash='1', transaction_list=[])
+			self.current_block = Block(prev_hash='1', transaction_list=[], target=difficulty.target_to_hex(difficulty.diff_to_target(DIFF)))
 			self.current_block.add_transaction(first_transaction)
 
 			# This block contains only the first transaction,
@@ -79,27 +117,39 @@ class Node:
 			self.current_block.is_mined(nonce=nonce, hash_key=block_hash.hexdigest())
 
 			# The genesis block does not need validation and that's why it is added to the chain
-			self.chain = [self.current_block.to_dict()]
+			# A new genesis block starts a new chain, so the blocks of a previous run are replaced
+			self.chain.truncate(0)
+			self.chain.append(self.current_block.to_dict())
+			self.transaction_index.add_block(0, self.chain[0])
+			self.chain_commitment.add_block(self.chain[0])
+			self.undo_journal = [UndoRecord()]
 			self.create_new_block()
 
 			# Now the bootstrap node owns 100*N NBCs
 			bootstrap_trans_output = first_transaction.transaction_outputs[0]
 
-			self.UTXOs[self.wallet.address] = {}
-			self.UTXOs[self.wallet.address][bootstrap_trans_output.id] = bootstrap_trans_output.to_dict()
+			self.UTXOs.add(UTXO.from_output(bootstrap_trans_output))
 
 		# This is for all the other nodes which are not bootstrap.
 		else:
 
 			# We take the current chain from the bootstrap node which means
-			self.chain = chain
-			self.validate_chain()
+			# The blocks of a previous run which are the same with it are kept and not validated again
+			fork_height = self.chain.fork_height(chain)
+			self.chain.truncate(fork_height)
+			self.chain.extend(chain[fork_height:])
+			self.validate_chain(start=max(fork_height, 1))
+			self.transaction_index.rebuild(self.chain)
+			self.chain_commitment.rebuild(self.chain)
 
 			# The node will get the full ring when all the nodes arrive.
-			self.ring = ring
+			self.ring = Ring(ring)
+			self.key_registry.register_ring(self.ring)
+			self.outbound.register_ring(self.ring)
 
-			# The node takes the UTXOs from the bootstrap
-			self.UTXOs = UTXOs
+			# The node takes the UTXOs from the bootstrap, so it does not know how to reverse the current blocks
+			self.UTXOs = UTXOSet.from_dict(UTXOs)
+			self.undo_journal = [None] * len(self.chain)
 
 			# Create the block where all the incoming transactions will be added.
 			self.create_new_block()
@@ -109,23 +159,28 @@ class Node:
 
 	# -------------- General  ---------------
 
-	def to_dict(self) -> dict:
+	'''
+	Sign the hash of our chain (its rolling commitment),
+	we will use these values when there is a conflict in the chain,
+	and we need tot avoid malicious chain broadcasting.
+	The signature changes only when the tip of the chain changes, so we keep it till then.
+	'''
+	def sign_chain(self) -> tuple:
 
-		"""
-		Find the chain hash in order to sign it,
-		we will use these values when there is a conflict in the chain,
-		and we need tot avoid malicious chain broadcasting.
-		"""
+		chain_hash = self.chain_commitment.hexdigest()
+		if self.chain_signature is None or self.chain_signature[0] != chain_hash:
+			signature_chain = pkcs1_15.new(self.wallet.private_key).sign(self.chain_commitment.hash_object())
+			self.chain_signature = (chain_hash, signature_chain.decode('ISO-8859-1'))
 
-		# First encode the dict into bytearray
-		encoded_chain = json.dumps(self.chain).encode('utf-8')
-		bytes_chain = bytearray(encoded_chain)
+		return self.chain_signature
 
-		# Create the hash key based on this bytearray
-		hash_chain = SHA256.new(data=bytes_chain)
+	'''
+	The small part of our state which is stored at the status document after every message.
+	The blocks and the UTXOs are stored separately and only with their changes (see persistence.py).
+	'''
+	def status_dict(self) -> dict:
 
-		# Now create the signature
-		signature_chain = pkcs1_15.new(self.wallet.private_key).sign(hash_chain)
+		chain_hash, signature_chain = self.sign_chain()
 
 		return {
 			"address": self.network_address,
@@ -133,15 +188,42 @@ class Node:
 			"node_id": self.node_id,
 			"ring": self.ring,
 			"public_key": self.wallet.address,
-			"chain": self.chain,
-			"chain_transaction_ids": list(self.chain_transaction_ids),
+			"height": len(self.chain),
+			"tip_hash": self.chain.hash_at(-1),
 			"current_block": self.current_block.to_dict(),
-			"UTXOs": self.UTXOs,
-			"chain_hash": hash_chain.hexdigest(),
-			"signature_chain": signature_chain.decode('ISO-8859-1'),
-			"last_block_timestamp": self.chain[-1]['timestamp']
+			"chain_hash": chain_hash,
+			"signature_chain": signature_chain,
+			"last_block_timestamp": self.chain[-1]['timestamp'],
+			"outbound": self.outbound.metrics(),
+			"peers": network.peers_health()
 		}
 
+	'''
+	Our whole state, as the other nodes get it
+	'''
+	def to_dict(self) -> dict:
+
+		return {
+			**self.status_dict(),
+			"chain": list(self.chain),
+			"chain_transaction_ids": list(self.transaction_index),
+			"UTXOs": self.UTXOs.to_dict(),
+			"balances": self.UTXOs.balances_dict()
+		}
+
+	'''
+	The difficulty target of the block at the given height of the chain (by default the given chain is our chain)
+	'''
+	def next_target(self, height: int, chain: [dict] = None) -> int:
+
+		return difficulty.next_target(
+			chain=self.chain if chain is None else chain,
+			height=height,
+			initial_target=difficulty.diff_to_target(DIFF),
+			interval=RETARGET_INTERVAL,
+			block_time=TARGET_BLOCK_TIME
+		)
+
 	# -------------- Receiver actions --------------
 
 	def add_transaction_to_block(self, transaction: Transaction) -> None:
@@ -159,29 +241,152 @@ class Node:
 
 	def receive_block(self, block: dict) -> None:
 
-		trans_amounts = [x['amount'] for x in block['transactions']]
+		trans_amounts = [format_nbc(x['amount']) for x in block['transactions']]
 		print(f'Receive block with: {trans_amounts} and with hashKey:')
 		print(block['hashKey'])
 
 		# First validate the incoming block
 		self.validate_block(block)
 
+		# The miner of the block may have spent other UTXOs for one of our validated transactions,
+		# so we reverse all of them and validate again on top of the block the ones which it does not contain
+		mismatched = [
+			trans['id'] for trans in block['transactions']
+			if trans['id'] in self.pending_undo and not self.pending_undo[trans['id']].matches(trans)
+		]
+		unmined = None
+		if len(mismatched) > 0:
+			print(f'The block has other inputs or outputs for our transactions {mismatched}, so we reverse them.')
+			unmined = self.unmined_transactions()
+			self.disconnect_pending()
+			self.block_for_mining = None
+			self.create_new_block()
+
+		# Keep how the block changed our UTXOs, a block which does not fit our UTXOs is rejected before we add it
+		try:
+			self.connect_block(block)
+		except custom_errors.InvalidUTXOs:
+			if unmined is not None:
+				self.revalidate_transactions(unmined)
+			raise
+
 		# Add block to our chain
 		self.chain.append(block)
 
 		# Remove the common transactions (if they exist)
 		self.current_block.remove_common_transactions(block['transactions'])
 
-		# Update the Chain transaction ids, where we keep the ids of all the transactions in our chain
-		for trans in block['transactions']:
-			self.chain_transaction_ids.add(trans['id'])
+		# Update the transaction index, where we keep the location of all the transactions in our chain
+		self.transaction_index.add_block(len(self.chain) - 1, block)
+		self.chain_commitment.add_block(block)
+
+		if unmined is not None:
+			self.revalidate_transactions(unmined)
+
+	'''
+	Record the UndoRecord of a block which is added to our chain.
+	The transactions that we have validated have already changed our UTXOs, so we just move their UndoRecords to the block.
+	For the rest of them we apply their inputs and outputs as they are in the block.
+	When one of them does not fit our UTXOs, our UTXOs are left as they were and InvalidUTXOs is raised.
+	'''
+	def connect_block(self, block: dict) -> None:
+
+		undo_record = UndoRecord()
+		pending_undo = dict(self.pending_undo)
+		applied = []
+		try:
+			for trans in block['transactions']:
+				trans_undo_record = self.pending_undo.pop(trans['id'], None)
+				if trans_undo_record is None:
+					trans_undo_record = self.UTXOs.apply_transaction(trans)
+					applied.append(trans_undo_record)
+				undo_record.extend(trans_undo_record)
+
+		except custom_errors.InvalidUTXOs:
+			for trans_undo_record in reversed(applied):
+				self.UTXOs.undo(trans_undo_record)
+			self.pending_undo = pending_undo
+			raise
+
+		self.undo_journal.append(undo_record)
+
+		# Forget the records of the blocks which are deeper than any fork we accept
+		if len(self.undo_journal) > UNDO_DEPTH:
+			self.undo_journal[-UNDO_DEPTH - 1] = None
+
+	'''
+	Reverse the changes of our blocks from the given height and on, starting from the last block
+	'''
+	def disconnect_blocks(self, height: int) -> None:
+
+		for undo_record in reversed(self.undo_journal[height:]):
+			self.UTXOs.undo(undo_record)
+
+		del self.undo_journal[height:]
+
+	'''
+	Reverse the changes of the transactions that we have validated but are not in our chain yet, starting from the last one
+	'''
+	def disconnect_pending(self) -> None:
+
+		for undo_record in reversed(list(self.pending_undo.values())):
+			self.UTXOs.undo(undo_record)
+
+		self.pending_undo = {}
+
+	'''
+	The Transaction objects that we have validated and are not in our chain yet,
+	of the block that we were mining and of our current block
+	'''
+	def unmined_transactions(self) -> [Transaction]:
+
+		blocks = [self.current_block] if self.block_for_mining is None else [self.block_for_mining, self.current_block]
+		transactions = {}
+		for block in blocks:
+			for trans in block.list_of_transactions:
+				if trans.id in self.pending_undo:
+					transactions[trans.id] = trans
+
+		return list(transactions.values())
+
+	'''
+	Add a transaction of the block that we were mining back to our current block (see main.py).
+	When our pending transactions were reversed in the meantime (e.g. by receive_block), it is validated again.
+	'''
+	def add_reversed_transaction(self, transaction: Transaction) -> None:
+
+		if transaction.id in self.pending_undo:
+			self.add_transaction_to_block(transaction)
+		else:
+			self.revalidate_transactions([transaction])
+
+	'''
+	Validate again the transactions that we had validated on top of another chain, e.g. after resolve_conflicts.
+	The transactions which are in our chain now, or which our UTXOs can't pay anymore, are dropped.
+	'''
+	def revalidate_transactions(self, transactions: [Transaction]) -> None:
+
+		seen_ids = set()
+		for trans in transactions:
+
+			if trans.id in self.transaction_index or trans.id in seen_ids:
+				continue
+			seen_ids.add(trans.id)
+
+			try:
+				self.validate_transaction(trans.to_dict(), verified=True)
+			except (custom_errors.InsufficientAmount, custom_errors.TransactionAlreadyAdded) as e:
+				print(f'Drop the transaction {trans.id} --> {str(e)}')
 
 	# ---------------- Creation ---------------
 
-	def create_transaction(self, receiver_node_id: str, amount: str) -> None:
+	'''
+	The amount is in base units
+	'''
+	def create_transaction(self, receiver_node_id: str, amount: int) -> None:
 
 		print("Create a transaction")
-		print(f"node_{self.node_id} --> node_{receiver_node_id} : {amount} NBCs")
+		print(f"node_{self.node_id} --> node_{receiver_node_id} : {format_nbc(amount)} NBCs")
 
 		# Get the public keys
 		rec_pub_key = self.ring[receiver_node_id]['public_key']
@@ -220,31 +425,16 @@ class Node:
 	This is one of the most important functions of the whole system
 	1. Check the capacity of the block in order to avoid asynchronous block over limit
 	2. Create the transaction object with the old timestamp in order to create the same transaction ID
-	3. Verify the signature
+	3. Verify the signature (unless it is already verified in a batch, see verification.py)
 	4. Verify the hash (which is out transaction_id) 
-	5. Check the UTXOs
-	6. Check the balance
-	7. Add the needed TransactionInputs
-	8. Create the 2 TransactionOutputs
-	9. Update our UTXOs
-	10. Check if this transaction exists in our chain
+	5. Check if this transaction exists in our chain
+	6. Check the UTXOs
+	7. Check the balance
+	8. Add the needed TransactionInputs
+	9. Create the 2 TransactionOutputs
+	10. Update our UTXOs and keep the UndoRecord of the changes
 	'''
-	def validate_transaction(self, transaction: dict) -> None:
-
-		# Extract all the necessary information form the transaction
-		sender_address = transaction['sender']
-		transaction_id = transaction['id']
-		signature = transaction['signature'].encode('ISO-8859-1')
-		amount = transaction['amount']
-
-		# Find the sender node_id
-		sender_node_id = None
-		for k, v in self.ring.items():
-			if v['public_key'] == sender_address:
-				sender_node_id = k
-				break
-
-		print(f"Validating new transaction from {sender_node_id} with amount {amount}")
+	def validate_transaction(self, transaction: dict, verified: bool = False) -> None:
 
 		# Check if the current block has reached its capacity
 		block_current_capacity = len(self.current_block.list_of_transactions)
@@ -254,45 +444,48 @@ class Node:
 			# self.mine_block()
 			return
 
-		# Create the transaction object from the given dictionary
-		transaction_object = Transaction(
-			sender_address=sender_address,
-			receiver_address=transaction['receiver'],
-			amount=amount,
-			timestamp=transaction['timestamp'],
-			signature=signature
-		)
+		if verified:
+			# The signature and the hash are already checked, so just create the transaction object
+			transaction_object = Transaction(
+				sender_address=transaction['sender'],
+				receiver_address=transaction['receiver'],
+				amount=transaction['amount'],
+				timestamp=transaction['timestamp'],
+				signature=transaction['signature'].encode('ISO-8859-1')
+			)
+		else:
+			# Create the transaction object and verify its signature and its hash, a malformed one raises InvalidHash
+			transaction_object = verify_transaction(transaction, self.key_registry)
 
-		# From the address we can create a public key in order to verify the signature
-		sender_public_key = RSA.importKey(extern_key=sender_address)
+		# Extract all the necessary information form the transaction, which is well-formed now
+		sender_address = transaction['sender']
+		amount = transaction['amount']
 
-		# Verify the signature
-		pkcs1_15.new(sender_public_key).verify(transaction_object.transaction_id, signature)
+		# Find the sender node_id
+		sender_node_id = self.ring.node_id_of(sender_address)
 
-		# Check that the transaction_object hash to be the same with the given transaction_id
-		if transaction_object.transaction_id.hexdigest() != transaction_id:
-			raise custom_errors.InvalidHash(
-				err=f"Could not validate the HashKey of the transaction {transaction_id}"
+		print(f"Validating new transaction from {sender_node_id} with amount {format_nbc(amount)}")
+
+		# Check if this transaction is already added in my chain, before we change our UTXOs
+		transaction_id = transaction_object.id
+		if transaction_id in self.transaction_index:
+			raise custom_errors.TransactionAlreadyAdded(
+				err="This transaction is already added in my chain"
+			)
+
+		# It is validated and waits to be mined, a second pass would spend the UTXOs of the sender again
+		if transaction_id in self.pending_undo:
+			raise custom_errors.TransactionAlreadyAdded(
+				err="This transaction is already validated and waits to be mined"
 			)
 
 		# Find the UTXOs which can provide a total amount >= needed amount
 		# When we use a UTXO we have to remove it from the saved UTXOs
-		coins_cnt = 0.0
-		input_transactions = []
-		for utxo_key, utxo_value in self.UTXOs[sender_address].items():
-
-			# Add the UTXO to input transactions
-			print(f"Collect {utxo_value['amount']}")
-			coins_cnt += float(utxo_value['amount'])
-			input_transactions.append(utxo_key)
-
-			# Check if we have sufficient amount of coins
-			if coins_cnt >= float(amount):
-				print(f"Needed {amount} and collected {str(coins_cnt)}")
-				break
+		input_transactions, coins_cnt = self.UTXOs.select(sender_address, amount)
+		print(f"Needed {format_nbc(amount)} and collected {format_nbc(coins_cnt)}")
 
 		print('Check the balance')
-		surplus = coins_cnt - float(amount)
+		surplus = coins_cnt - amount
 		if surplus < 0:
 			raise custom_errors.InsufficientAmount(
 				err="Can't create the transaction. Insufficient amount"
@@ -304,22 +497,16 @@ class Node:
 		print('Fix UTXOs')
 
 		# Now we have validated the input transactions we can update our UTXOs
+		undo_record = UndoRecord()
 		for input_trans_id in input_transactions:
-			del self.UTXOs[sender_address][input_trans_id]
+			self.UTXOs.spend(input_trans_id, undo_record)
 
 		# At this point we have validated the transaction, and we can produce the transaction outputs
-		transaction_object.add_transaction_outputs(surplus_amount=str(surplus))
+		transaction_object.add_transaction_outputs(surplus_amount=surplus)
 		for trans_output in transaction_object.transaction_outputs:
-			receiver_address = trans_output.receiver_address
-			if receiver_address not in self.UTXOs.keys():
-				self.UTXOs[receiver_address] = {}
-			self.UTXOs[receiver_address][trans_output.id] = trans_output.to_dict()
+			self.UTXOs.add(UTXO.from_output(trans_output), undo_record)
 
-		# Now check if this transaction is already added in my chain
-		if transaction_object.transaction_id.hexdigest() in self.chain_transaction_ids:
-			raise custom_errors.TransactionAlreadyAdded(
-				err="This transaction is already added in my chain"
-			)
+		self.pending_undo[transaction_id] = undo_record
 
 		print("Transaction validated")
 
@@ -329,18 +516,22 @@ class Node:
 
 	'''
 	Validate the given chain either from the bootstrap node either for the consensus algorithm
-	The validate_block is called for all the blocks except the genesis block
+	The validate_block is called for all the blocks except the genesis block, from the given height and on.
+	Without a chain our own chain is validated, otherwise the given list of blocks (e.g. of another node)
 	'''
-	def validate_chain(self) -> None:
+	def validate_chain(self, start: int = 1, chain: [dict] = None) -> None:
+
+		if chain is None:
+			chain = self.chain
 
 		# Validate each block in the chain which is a list of dicts
 		# except the genesis block which is the first block in the chain
-		for i in range(1, len(self.chain)):
-			block = self.chain[i]
+		for i in range(start, len(chain)):
+			block = chain[i]
 
 			# Check the validity of the hash_key with the difficulty
 			block_hash = block['hashKey']
-			if block_hash[0:DIFF] != DIFF * '0':
+			if not difficulty.satisfies_target(block_hash, difficulty.block_target(block, 0)):
 				raise custom_errors.InvalidHash(
 					err="Block hash does not satisfy the difficulty level."
 				)
@@ -358,24 +549,30 @@ class Node:
 				)
 
 			# Check the validity of the prev_hash
-			prev_block_hash = self.chain[i-1]['hashKey']
+			prev_block_hash = self.chain.hash_at(i-1) if chain is self.chain else chain[i-1]['hashKey']
 			if prev_block_hash != block['previousHashKey']:
 				raise custom_errors.InvalidPreviousHashKey(
 					err=f"The given PreviousHashKey: {block['previousHashKey']} of the block with hashKey: {block['hashKey']} is not the same with my previous block."
 				)
 
+			# Check that the target of the block is the one that the history of the chain gives
+			if block.get('target') != difficulty.target_to_hex(self.next_target(i, chain=chain)):
+				raise custom_errors.InvalidHash(
+					err="The target of the block does not follow the difficulty of the chain."
+				)
 
 	'''
 	1. Check if the hash_key has the required Difficulty
 	2. Check the nonce
 	3. Check the previous_hash_key
-	4. Check if the block contains transaction which are already added in our chain
+	4. Check the target of the block against the history of the chain
+	5. Check if the block contains transaction which are already added in our chain
 	'''
 	def validate_block(self, block: dict) -> None:
 
 		# Check the validity of the hash_key with the difficulty
 		block_hash = block['hashKey']
-		if block_hash[0:DIFF] != DIFF*'0':
+		if not difficulty.satisfies_target(block_hash, difficulty.block_target(block, 0)):
 			raise custom_errors.InvalidHash(
 				err="Block hash does not satisfy the difficulty level."
 			)
@@ -393,21 +590,20 @@ class Node:
 			)
 
 		# Check the validity of the prev_hash
-		prev_block_hash = self.chain[-1]['hashKey']
+		prev_block_hash = self.chain.hash_at(-1)
 		if prev_block_hash != block['previousHashKey']:
 			raise custom_errors.InvalidPreviousHashKey(
 				err=f"The given PreviousHashKey: {block['previousHashKey']} of the block with hashKey: {block['hashKey']} is not the same with my previous block."
 			)
 
-		# Last check if the block contains transactions which already added in my chain
-		my_trans_ids = set()
-		for my_block in self.chain:
-			for trans in my_block['transactions']:
-				my_trans_ids.add(trans['id'])
-
-		new_block_trans_ids = {trans['id'] for trans in block['transactions']}
+		# Check that the target of the block is the one that the history of our chain gives
+		if block.get('target') != difficulty.target_to_hex(self.next_target(len(self.chain))):
+			raise custom_errors.InvalidHash(
+				err="The target of the block does not follow the difficulty of the chain."
+			)
 
-		common_ids = my_trans_ids.intersection(new_block_trans_ids)
+		# Last check if the block contains transactions which already added in my chain
+		common_ids = self.transaction_index.common_ids(trans['id'] for trans in block['transactions'])
 
 		if len(common_ids) != 0:
 			print('Common transactions at block validation')
@@ -415,29 +611,29 @@ class Node:
 			raise custom_errors.InvalidBlockCommonTransactions(
 				err="Unable to accept this block because contains transactions which already added in my chain",
 				block_for_validation=block,
-				common_trans_ids=list(my_trans_ids)
+				common_trans_ids=self.transaction_index
 			)
 
 	# ---------------- Broadcasting ---------------
 
+	'''
+	The (node_id, node) of every node of the ring except us, the receivers of a broadcast
+	'''
+	def other_nodes(self) -> list:
+		return [(node_id, node) for node_id, node in self.ring.items() if node_id != self.node_id]
+
 	def broadcast_transaction(self, transaction: Transaction) -> None:
 
-		print(f"Start broadcasting the transaction with id {transaction.transaction_id.hexdigest()}")
+		print(f"Start broadcasting the transaction with id {transaction.id}")
 		print('---------------------------------------')
 
-		# Send the mined transaction to all the other nodes
-		for node_id, node in self.ring.items():
+		transaction_dict = transaction.to_dict()
 
-			if node_id != self.node_id:
-				print(f"Send it: node_{node_id} @ {node['address']}:{str(node['port'])}")
-				network.send_transaction(
-					address=node['address'],
-					port=node['port'],
-					transaction=transaction.to_dict()
-				)
+		# Put the transaction into the outbox of every other node, their senders deliver it at the background
+		self.outbound.broadcast(self.other_nodes(), 'transaction', transaction_dict)
 
 		print('Send transaction to myself.')
-		self.validate_transaction(transaction.to_dict())
+		self.validate_transaction(transaction_dict)
 
 		print('---------------------------------------')
 
@@ -446,17 +642,8 @@ class Node:
 		print('Start Block broadcasting')
 		print('---------------------------------------')
 
-		# Send the mined block to all the other nodes
-		for node_id, node in self.ring.items():
-
-			if node_id != self.node_id:
-
-				print(f"Send it: node_{node_id} @ {node['address']}:{str(node['port'])}")
-				network.send_block(
-					address=node['address'],
-					port=node['port'],
-					block=block_dict
-				)
+		# Put the mined block into the outbox of every other node, their senders deliver it at the background
+		self.outbound.broadcast(self.other_nodes(), 'block', block_dict)
 
 		print('Send block to myself.')
 		self.receive_block(block_dict)
@@ -470,21 +657,14 @@ class Node:
 		print('Start broadcasting the final ring.')
 		print('---------------------------------------')
 
+		ring = {
+			"ring_dict": dict(self.ring),
+			"signature": signature_ring,
+			"hash_ring": hash_ring
+		}
+
 		# Send the final ring to all the other nodes
-		for node_id, node in self.ring.items():
-
-			if node_id != self.node_id:
-
-				print(f"Send it: node_{node_id} @ {node['address']}:{str(node['port'])}")
-				network.send_ring(
-					address=node['address'],
-					port=node['port'],
-					ring={
-						"ring_dict": self.ring,
-						"signature": signature_ring,
-						"hash_ring": hash_ring
-					}
-				)
+		self.outbound.broadcast(self.other_nodes(), 'ring', ring)
 
 	# ---------------- Settings & Ring ---------------
 
@@ -507,9 +687,11 @@ class Node:
 			'port': port,
 			'public_key': public_key
 		}
+		self.key_registry.register_ring(self.ring)
+		self.outbound.register_ring(self.ring)
 
 		# Give the new node 100 NBC
-		self.create_transaction(receiver_node_id=new_node_id, amount='100.0')
+		self.create_transaction(receiver_node_id=new_node_id, amount=100*UNITS_PER_NBC)
 
 		# This means that all the nodes have arrived, and we are ready to broadcast the ring
 		if int(new_node_id) + 1 == N:
@@ -534,23 +716,6 @@ class Node:
 				hash_ring=hash_ring.hexdigest()
 			)
 
-	'''
-	Send the node_id, chain, UTXOs and ring to new node came into the network
-	'''
-	def send_init_settings(self, new_node_id: str) -> None:
-		settings = {
-			'node_id': new_node_id,
-			'ring': self.ring,
-			'UTXOs': self.UTXOs,
-			'chain': self.chain
-		}
-
-		network.send_settings(
-			address=self.ring[new_node_id]['address'],
-			port=self.ring[new_node_id]['port'],
-			settings=settings
-		)
-
 	'''
 	This is function is used only by simple nodes.
 	When all the nodes have arrived, the ring will be broadcast from the bootstrap node.
@@ -574,40 +739,49 @@ class Node:
 			raise custom_errors.InvalidHash(err="Invalid Hash Ring.")
 
 		# Check the validity of the sender by verifying the signature
-		bootstrap_public_key = RSA.importKey(extern_key=self.ring['0']['public_key'])
-		pkcs1_15.new(bootstrap_public_key).verify(temp_hash_ring, signature.encode('ISO-8859-1'))
+		self.key_registry.verify(self.ring['0']['public_key'], temp_hash_ring, signature.encode('ISO-8859-1'))
 
 		# Update the ring
-		self.ring = ring
+		self.ring = Ring(ring)
+		self.key_registry.register_ring(self.ring)
+		self.outbound.register_ring(self.ring)
 
 	# ---------------- Mining ---------------
 
 	'''
 	When a block has reached the capacity is ready to find the nonce (proof-of-work).
-	We will try random 'nonce' until the hash_key of block meets the requirements 
-	We create a new subprocess in order to achieve parallel mining
+	We will try 'nonce' values until the hash_key of block meets the requirements 
+	The mining workers run at the background in order to achieve parallel mining
 	'''
 	def mine_block(self) -> None:
 
 		print('Start mining')
 		print('---------------------------------------')
 
-		# We are ready to mine the block, so set the previous hash key
-		self.current_block.previous_hash = self.chain[-1]['hashKey']
+		# We are ready to mine the block, so set the previous hash key and the difficulty target
+		self.current_block.previous_hash = self.chain.hash_at(-1)
+		target = self.next_target(len(self.chain))
+		self.current_block.target = difficulty.target_to_hex(target)
 
 		# Get the bytes of the current block
 		block_bytearray_before_nonce = self.current_block.bytearray_before_nonce()
 
-		# Start parallel mining at the background
-		block_bytearray_before_nonce_str = block_bytearray_before_nonce.decode('utf-8')
-		self.block_for_mining = self.current_block.to_dict()
-		self.mining_proc = Popen([
-			"python", "mining.py",
-			"-b", block_bytearray_before_nonce_str,
-			"-d", str(DIFF),
-			"-n", self.node_id,
-			"-bd", json.dumps(self.current_block.to_dict())
-		])
+		# Give the block to the mining workers which run at the background
+		self.block_for_mining = self.current_block
+		self.miner.submit(
+			block_dict=self.block_for_mining.to_dict(),
+			block_bytearray_before_nonce=block_bytearray_before_nonce,
+			target=target
+		)
+
+	'''
+	Start the mining workers once, together with the node.
+	The on_found callback takes the mined block_dict when a nonce is found.
+	'''
+	def start_mining_service(self, on_found) -> None:
+
+		self.miner = MiningService(on_found=on_found, workers=MINING_WORKERS)
+		self.miner.start()
 
 	# ---------------- Consensus ---------------
 
@@ -625,32 +799,72 @@ class Node:
 		# Find the right chain
 		right_chain, right_UTXOs, right_chain_ids = self.find_the_right_chain(chains)
 
-		# Update the chain
-		self.chain = right_chain
-		# self.UTXOs = right_UTXOs
-		self.chain_transaction_ids = set(right_chain_ids)
+		# Our validated transactions which are not in our chain were validated on top of our old tip,
+		# so they are validated again on top of the new one
+		unmined = self.unmined_transactions()
+
+		# Only the blocks after the fork are different, so roll back the transaction index till there
+		fork_height = self.chain.fork_height(right_chain)
+		self.transaction_index.rollback(self.chain, fork_height)
+		self.chain_commitment.rollback(fork_height)
 
-		# Remove the common transactions between my current block and the blocks of the given chain
-		for block in self.chain:
-			self.current_block.remove_common_transactions(block['transactions'])
+		# Reverse the UTXO changes of our pending transactions and then of our blocks after the fork, if we know them
+		can_undo = None not in self.undo_journal[fork_height:]
+		if can_undo:
+			try:
+				self.disconnect_pending()
+				self.disconnect_blocks(fork_height)
+			except custom_errors.InvalidUTXOs as e:
+				print(f'Unable to reverse our UTXOs --> {str(e)}')
+				can_undo = False
+
+		# Update the chain, only the blocks after the fork are written
+		self.chain.truncate(fork_height)
+		self.chain.extend(right_chain[fork_height:])
+		for height in range(fork_height, len(self.chain)):
+			self.transaction_index.add_block(height, self.chain[height])
+			self.chain_commitment.add_block(self.chain[height])
+
+			# Apply the UTXO changes of the new blocks
+			if can_undo:
+				try:
+					self.connect_block(self.chain[height])
+				except custom_errors.InvalidUTXOs as e:
+					print(f'Unable to apply the new blocks to our UTXOs --> {str(e)}')
+					can_undo = False
+
+		# The fork is deeper than our undo records, or they don't fit our UTXOs, so take the UTXOs of the given chain
+		if not can_undo:
+			print('Take the UTXOs of the given chain.')
+			self.UTXOs = UTXOSet.from_dict(right_UTXOs)
+			self.undo_journal = [None] * len(self.chain)
+			self.pending_undo = {}
+
+		# Start a new current block with our transactions which are not in the given chain
+		self.block_for_mining = None
+		self.create_new_block()
+		self.revalidate_transactions(unmined)
 
 	def ask_for_chain(self) -> dict:
 
 		print('Start asking for chain.')
 		print('---------------------------------------')
 
-		chains = {}
-
-		# Ask everybody for their chain except myself
-		for node_id, node in self.ring.items():
+		# The unhealthy nodes would only make us wait till the deadline, so they are asked again after their cooldown
+		available = {
+			node_id: node for node_id, node in self.ring.items()
+			if network.peer(node['address'], node['port']).available
+		}
+		if len(available) < len(self.ring):
+			print(f'Skip the unhealthy nodes {sorted(set(self.ring) - set(available))}')
 
-			print(f"Ask for chain from: node_{node_id} @ {node['address']}:{str(node['port'])}")
-			chains[node_id] = network.get_chain(
-				address=node['address'],
-				port=node['port']
-			)
+		# Ask everybody for their chain in parallel, the nodes that do not answer in time are left out
+		futures = network.fan_out({
+			node_id: functools.partial(network.get_chain, address=node['address'], port=node['port'], ring=self.ring)
+			for node_id, node in available.items()
+		})
 
-		return chains
+		return network.collect(futures, deadline=network.CHAIN_READ_TIMEOUT)
 
 	'''
 	After getting all the chains from all the nodes in the network,
@@ -676,23 +890,21 @@ class Node:
 
 			# Try to validate the given chain
 			try:
-				# Check the validity of the content by comparing the hash keys
-				encoded_chain = json.dumps(chains[node_id]['chain']).encode('utf-8')
-				bytes_chain = bytearray(encoded_chain)
-				temp_hash_chain = SHA256.new(data=bytes_chain)
-				if temp_hash_chain.hexdigest() != chains[node_id]['chain_hash']:
+				# Check the validity of the content by comparing the commitments of the chains
+				temp_chain_commitment = ChainCommitment(chains[node_id]['chain'])
+				if temp_chain_commitment.hexdigest() != chains[node_id]['chain_hash']:
 					raise custom_errors.InvalidHash(err="Invalid Hash Chain.")
 
 				# Check the validity of the sender by verifying the signature
-				sender_public_key = RSA.importKey(extern_key=self.ring[node_id]['public_key'])
-				pkcs1_15.new(sender_public_key).verify(
-					msg_hash=temp_hash_chain,
+				self.key_registry.verify(
+					public_key=self.ring[node_id]['public_key'],
+					msg_hash=temp_chain_commitment.hash_object(),
 					signature=chains[node_id]['signature_chain'].encode('ISO-8859-1')
 				)
 
-				# Check now the validity of the blocks in the chain
-				# self.chain = chains[node_id]['chain']
-				# self.validate_chain()
+				# Check now the validity of the blocks in the chain, the ones till the fork are the same with ours
+				fork_height = self.chain.fork_height(chains[node_id]['chain'])
+				self.validate_chain(start=max(fork_height, 1), chain=chains[node_id]['chain'])
 
 				# If we reach at this point it means the chain is valid,
 				# so stop checking the other chains
@@ -705,7 +917,9 @@ class Node:
 			except (
 					custom_errors.InvalidHash,
 					custom_errors.InvalidPreviousHashKey,
-					ValueError
+					ValueError,
+					KeyError,
+					TypeError
 			) as e:
 				print(f'Error at validating a given chain --> {str(e)}')
 				print('Try the next one')
@@ -0,0 +1,257 @@
+import collections
+import threading
+import requests
+import time
+
+import network
+
+# How many messages wait for a peer at most, when it is full the oldest message is dropped
+OUTBOX_SIZE = 1000
+
+# After a failure the peer is retried after BACKOFF_BASE seconds, doubled with every failure in a row up to BACKOFF_MAX
+BACKOFF_BASE = 0.1
+BACKOFF_MAX = 30.0
+
+# The waiting transactions of a peer are sent together, at most BATCH_SIZE of them,
+# and the sender waits at most BATCH_WINDOW seconds for more before it sends a batch
+BATCH_SIZE = 100
+BATCH_WINDOW = 0.02
+
+# How every kind of message is sent to the peer
+SENDERS = {
+    'transactions': network.send_transactions,
+    'block': network.send_block,
+    'ring': network.send_ring
+}
+
+# These kinds are sent in the binary format of wire.py when the peer understands it, so they need our ring
+WIRE_KINDS = ['transactions', 'block']
+
+# Only the newest message of these kinds matters, e.g. a newer block replaces our previous tip at its place in the queue,
+# and the peer asks for the chain when it misses a block
+COALESCED = ['block', 'ring']
+
+def messages_count(kind: str, payload) -> int:
+    return len(payload) if kind == 'transactions' else 1
+
+'''
+The messages that wait to be sent to one peer, and the thread that sends them in order.
+The transactions are sent in batches (see BATCH_SIZE).
+When the peer fails, the message is retried with exponential backoff while the next messages wait,
+so a dead peer never blocks the node or the other peers.
+'''
+class PeerOutbox:
+
+    def __init__(self, node_id: str, address: str, port: int, size: int = OUTBOX_SIZE, ring: dict = None):
+
+        self.node_id = node_id
+        self.address = address
+        self.port = port
+        self.size = size
+        self.ring = ring
+
+        # (kind, payload) of every waiting message
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        # Metrics
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.retry_at = None
+
+        self.thread = threading.Thread(target=self.run, name=f'outbox_{node_id}', daemon=True)
+        self.thread.start()
+
+    def put(self, kind: str, payload: dict) -> None:
+
+        with self.condition:
+
+            # Replace the older message of the same kind where it is, so the newer one does not wait
+            # behind the messages that were queued after the older one
+            if kind in COALESCED:
+                for i, (queued_kind, _) in enumerate(self.queue):
+                    if queued_kind == kind:
+                        self.queue[i] = (kind, payload)
+                        self.coalesced += 1
+                        self.condition.notify()
+                        return
+
+            if len(self.queue) >= self.size:
+                self.queue.popleft()
+                self.dropped += 1
+
+            self.queue.append((kind, payload))
+            self.condition.notify()
+
+    def run(self) -> None:
+
+        while True:
+
+            with self.condition:
+                self.condition.wait_for(lambda: self.stopped or len(self.queue) > 0)
+                if self.stopped:
+                    return
+                kind, payload = self.queue.popleft()
+
+                if kind == 'transaction':
+                    kind, payload = 'transactions', self.take_transactions(payload)
+
+            try:
+                if kind in WIRE_KINDS:
+                    SENDERS[kind](self.address, self.port, payload, ring=self.ring)
+                else:
+                    SENDERS[kind](self.address, self.port, payload)
+
+            # The peer refused the message itself (4xx), so sending it again would not help
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code < 500:
+                    print(f'The {kind} was refused by node_{self.node_id} --> {str(e)}')
+                    with self.condition:
+                        self.dropped += messages_count(kind, payload)
+                    continue
+                self.retry(kind, payload, e)
+                continue
+
+            except requests.exceptions.RequestException as e:
+                self.retry(kind, payload, e)
+                continue
+
+            except Exception as e:
+                print(f'Unable to send the {kind} to node_{self.node_id} --> {str(e)}')
+                with self.condition:
+                    self.dropped += messages_count(kind, payload)
+                continue
+
+            with self.condition:
+                self.sent += messages_count(kind, payload)
+                self.failures = 0
+                self.retry_at = None
+
+    '''
+    Collect the transactions that are waiting after the first one, and wait for more till the batch window ends.
+    It is called with the condition acquired.
+    '''
+    def take_transactions(self, first: dict) -> [dict]:
+
+        batch = [first]
+        deadline = time.monotonic() + BATCH_WINDOW
+        while len(batch) < BATCH_SIZE:
+
+            if len(self.queue) > 0:
+
+                # Keep the order of the messages, so the batch ends before any other kind
+                if self.queue[0][0] != 'transaction':
+                    break
+                batch.append(self.queue.popleft()[1])
+                continue
+
+            remaining = deadline - time.monotonic()
+            if self.stopped or remaining <= 0:
+                break
+            self.condition.wait(remaining)
+
+        return batch
+
+    '''
+    Put the failed message back in front of the queue and wait before the next try
+    '''
+    def retry(self, kind: str, payload: dict, error: Exception) -> None:
+
+        with self.condition:
+
+            self.failures += 1
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.failures - 1))
+            self.retry_at = time.time() + delay
+
+            if self.failures == 1:
+                print(f'Failed to send the {kind} to node_{self.node_id}, retrying --> {str(error)}')
+
+            # A newer message of the same kind is waiting, so this one is not needed anymore
+            if kind in COALESCED and any(queued_kind == kind for queued_kind, _ in self.queue):
+                self.coalesced += 1
+            elif len(self.queue) >= self.size:
+                self.dropped += messages_count(kind, payload)
+            else:
+                self.queue.appendleft((kind, payload))
+
+            self.condition.wait_for(lambda: self.stopped, timeout=delay)
+
+    def metrics(self) -> dict:
+
+        with self.condition:
+            return {
+                'depth': len(self.queue),
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'failures': self.failures,
+                'retry_at': self.retry_at
+            }
+
+    def stop(self) -> None:
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+'''
+The outgoing messages of the node, with a PeerOutbox for every node of the ring that we send to.
+Sending only puts the message into the outbox of the peer, so it never waits for the network.
+'''
+class Outbound:
+
+    def __init__(self, size: int = OUTBOX_SIZE):
+
+        self.size = size
+        self.outboxes = {}
+        self.lock = threading.Lock()
+        self.ring = None
+
+    '''
+    This function is called every time the membership of the ring changes, like KeyRegistry.register_ring
+    '''
+    def register_ring(self, ring: dict) -> None:
+
+        with self.lock:
+            self.ring = ring
+            for outbox in self.outboxes.values():
+                outbox.ring = ring
+
+    def outbox(self, node_id: str, address: str, port: int) -> PeerOutbox:
+
+        with self.lock:
+
+            # The sender thread of a peer starts with its first message
+            outbox = self.outboxes.get(node_id)
+            if outbox is None:
+                outbox = self.outboxes[node_id] = PeerOutbox(node_id, address, port, self.size, self.ring)
+
+            outbox.address, outbox.port = address, port
+            return outbox
+
+    def send(self, node_id: str, address: str, port: int, kind: str, payload: dict) -> None:
+        self.outbox(node_id, address, port).put(kind, payload)
+
+    '''
+    Send the message to every given (node_id, node) of the ring
+    '''
+    def broadcast(self, nodes: list, kind: str, payload: dict) -> None:
+
+        for node_id, node in nodes:
+            self.send(node_id, node['address'], node['port'], kind, payload)
+
+    def metrics(self) -> dict:
+
+        with self.lock:
+            outboxes = list(self.outboxes.values())
+
+        return {outbox.node_id: outbox.metrics() for outbox in outboxes}
+
+    def stop(self) -> None:
+
+        with self.lock:
+            for outbox in self.outboxes.values():
+                outbox.stop()
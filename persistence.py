@@ -0,0 +1,110 @@
+'''
+The state of a node is stored at its Storage (see storage.py) in these roles:
+    1. blocks: one record for every block of the chain, by its height.
+       New blocks are appended, and only when we switch to another chain the blocks after the fork are replaced.
+    2. utxos: one record for every unspent transaction output, and the balance of every address.
+       The changes (spent and created outputs) of every save are also appended to the utxo log, in order.
+    3. status: the tip of the chain and the rest of the small metadata of the node.
+Every save writes only what has changed since the previous one.
+'''
+class StatePersistence:
+
+    def __init__(self, storage):
+
+        self.storage = storage
+
+        # The hashKey of every stored block, in order to find where our chain has changed
+        self.block_hashes = []
+
+        # The UTXOSet whose changes we store, and the ring that we have stored
+        self.utxo_set = None
+        self.ring = None
+
+        self.log_seq = 0
+
+    '''
+    Replace anything that a previous run has stored, with the whole state of the node
+    '''
+    def init(self, node) -> None:
+
+        self.storage.clear()
+        self.save(node)
+
+    def save(self, node) -> None:
+
+        with self.storage.batch():
+            self.save_blocks(node.chain)
+            self.save_utxos(node.UTXOs, height=len(node.chain))
+            self.save_status(node)
+
+        # Only now the blocks of the chain can be reopened after a restart
+        node.chain.mark_persisted(len(node.chain))
+
+    def save_blocks(self, chain: [dict]) -> None:
+
+        # Find the last stored block which is still in our chain, usually it is our previous tip
+        fork_height = min(len(self.block_hashes), len(chain))
+        while fork_height > 0 and chain[fork_height - 1]['hashKey'] != self.block_hashes[fork_height - 1]:
+            fork_height -= 1
+
+        # We have switched to another chain
+        if fork_height < len(self.block_hashes):
+            self.storage.truncate_blocks(fork_height)
+            del self.block_hashes[fork_height:]
+
+        new_blocks = chain[fork_height:]
+        if len(new_blocks) > 0:
+            self.storage.append_blocks(fork_height, new_blocks)
+            self.block_hashes.extend(block['hashKey'] for block in new_blocks)
+
+    def save_utxos(self, utxo_set, height: int) -> None:
+
+        # A new UTXOSet (e.g. from the chain of another node), so store all of it
+        if utxo_set is not self.utxo_set:
+
+            self.storage.replace_utxos(
+                utxos=[utxo.to_dict() for outputs in utxo_set.outputs.values() for utxo in outputs.values()],
+                balances=utxo_set.balances_dict()
+            )
+            self.log({'height': height, 'snapshot': True, 'spent': [], 'created': []})
+
+            utxo_set.track_changes()
+            self.utxo_set = utxo_set
+            return
+
+        delta = utxo_set.take_delta()
+        if len(delta.changes) == 0:
+            return
+
+        # The changes have to be applied in their order, e.g. an output may be created and spent
+        self.storage.apply_utxo_changes(
+            changes=[(is_spent, utxo.to_dict()) for is_spent, utxo in delta.changes],
+            balances={utxo.receiver_address: utxo_set.balance(utxo.receiver_address) for _, utxo in delta.changes}
+        )
+
+        self.log({
+            'height': height,
+            'snapshot': False,
+            'spent': [utxo.id for is_spent, utxo in delta.changes if is_spent],
+            'created': [utxo.to_dict() for is_spent, utxo in delta.changes if not is_spent]
+        })
+
+    def log(self, entry: dict) -> None:
+
+        self.log_seq += 1
+        self.storage.append_utxo_log(self.log_seq, entry)
+
+    def save_status(self, node) -> None:
+
+        status = node.status_dict()
+
+        # The ring changes only while the nodes arrive
+        if self.ring == node.ring:
+            del status['ring']
+        else:
+            self.ring = dict(node.ring)
+
+        self.storage.save_status(status)
+
+def chain_transaction_ids(chain: [dict]) -> [str]:
+    return [trans['id'] for block in chain for trans in block['transactions']]
@@ -1,9 +1,20 @@
-import pymongo
 import os, signal
-
-client = pymongo.MongoClient(host=['localhost:27017'], replicaset='rs0')
+from storage import sqlite_paths, STORAGE
+from blockstore import block_store_paths
 
 def clean_db():
+
+    # The SQLite and the block files of the nodes
+    for path in sqlite_paths() + block_store_paths():
+        print("Delete", path)
+        os.remove(path)
+
+    if STORAGE != 'mongo':
+        return
+
+    import pymongo
+    client = pymongo.MongoClient(host=['localhost:27017'], replicaset='rs0')
+
     db_names = client.list_database_names()
     for x in db_names:
         if "node" in x:
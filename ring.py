@@ -0,0 +1,66 @@
+from Crypto.Hash import SHA256
+
+'''
+The ring is a dictionary where the key is the id of each node and the value its address, port and public key.
+The Ring class keeps also two reverse indexes, from the public key and from a short fingerprint of the key to the node id,
+which are updated every time the membership changes. It is still a dict, so it is sent and stored exactly as before.
+'''
+class Ring(dict):
+
+    # Length of the key fingerprint (hex digits)
+    FINGERPRINT_SIZE = 16
+
+    def __init__(self, members: dict = None):
+
+        super().__init__()
+
+        # Key: public key, Value: node_id
+        self.node_ids = {}
+
+        # Key: fingerprint of the public key, Value: node_id
+        self.fingerprints = {}
+
+        if members is not None:
+            self.update(members)
+
+    def __setitem__(self, node_id: str, node: dict) -> None:
+
+        if node_id in self:
+            self._remove_from_indexes(node_id)
+
+        super().__setitem__(node_id, node)
+
+        self.node_ids[node['public_key']] = node_id
+        self.fingerprints[self.fingerprint(node['public_key'])] = node_id
+
+    def __delitem__(self, node_id: str) -> None:
+
+        self._remove_from_indexes(node_id)
+        super().__delitem__(node_id)
+
+    def update(self, members: dict = (), **kwargs) -> None:
+
+        for node_id, node in dict(members, **kwargs).items():
+            self[node_id] = node
+
+    def _remove_from_indexes(self, node_id: str) -> None:
+
+        public_key = self[node_id]['public_key']
+        self.node_ids.pop(public_key, None)
+        self.fingerprints.pop(self.fingerprint(public_key), None)
+
+    '''
+    Returns the node_id of the given public key or None if it is not a member of the ring
+    '''
+    def node_id_of(self, public_key: str) -> str:
+        return self.node_ids.get(public_key)
+
+    def node_id_of_fingerprint(self, fingerprint: str) -> str:
+        return self.fingerprints.get(fingerprint)
+
+    def fingerprint_of(self, node_id: str) -> str:
+        return self.fingerprint(self[node_id]['public_key'])
+
+    @staticmethod
+    def fingerprint(public_key: str) -> str:
+        return SHA256.new(data=public_key.encode('utf-8')).hexdigest()[:Ring.FINGERPRINT_SIZE]
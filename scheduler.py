@@ -0,0 +1,72 @@
+import collections
+import threading
+
+# The lanes of the scheduler, in order of priority
+BLOCKS = 0          # 'block' and 'FoundNonce', they preempt everything else
+CONTROL = 1         # 'ring', 'NewNodeArrived' etc.
+TRANSACTIONS = 2    # 'transaction' and 'NewTransaction', which are processed in batches
+
+LANES = {
+    'block': BLOCKS,
+    'FoundNonce': BLOCKS,
+    'transaction': TRANSACTIONS,
+    'NewTransaction': TRANSACTIONS
+}
+
+'''
+The Scheduler delivers the messages of the node to the main loop.
+The messages come from the transport of the node (see transport.py)
+and from the mining service, and every message is a tuple (message_type, message_data, message_id).
+The main loop waits on the scheduler instead of sleeping, and it always gets the message of the highest priority lane.
+'''
+class Scheduler:
+
+    def __init__(self):
+
+        self.lanes = [collections.deque() for _ in range(TRANSACTIONS + 1)]
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def put(self, message_type: str, message_data: dict, message_id) -> None:
+
+        with self.condition:
+            self.lanes[LANES.get(message_type, CONTROL)].append((message_type, message_data, message_id))
+            self.condition.notify()
+
+    '''
+    Wait for the next message. Returns None when the scheduler is closed or after the timeout.
+    '''
+    def get(self, timeout: float = None) -> tuple:
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or any(self.lanes), timeout=timeout)
+            for lane in self.lanes:
+                if lane:
+                    return lane.popleft()
+            return None
+
+    '''
+    Take all the waiting messages of a lane at once
+    '''
+    def drain(self, lane: int) -> list:
+
+        with self.condition:
+            messages = list(self.lanes[lane])
+            self.lanes[lane].clear()
+            return messages
+
+    '''
+    True when a block is waiting, so any long running work has to stop and let the main loop process it
+    '''
+    def has_urgent(self) -> bool:
+        return len(self.lanes[BLOCKS]) > 0
+
+    def pending(self) -> dict:
+        return {'blocks': len(self.lanes[BLOCKS]), 'control': len(self.lanes[CONTROL]),
+                'transactions': len(self.lanes[TRANSACTIONS])}
+
+    def close(self) -> None:
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
@@ -1,14 +1,22 @@
 from flask_restx import Api
-from flask import Flask, request
+from flask import Flask, request, Response
 from flask_restx import Resource, abort
 from flask_cors import CORS
 from argparse import ArgumentParser
+from transport import create_transport, TRANSPORT, TRANSPORTS
+from storage import create_storage, STORAGE, STORAGES
+import ring
+import custom_errors
+import persistence
+import wire
 
 # Get command line arguments
 parser = ArgumentParser()
 parser.add_argument('-p', '--port', default=5000, type=int, help='port to listen on')
 parser.add_argument('-a', '--address', default='127.0.0.1', type=str, help='Network address')
 parser.add_argument('-n', '--node_id', default='0', type=str, help='Node ID')
+parser.add_argument('-t', '--transport', default=TRANSPORT, choices=TRANSPORTS, help='Transport of the incoming messages')
+parser.add_argument('-s', '--storage', default=STORAGE, choices=STORAGES, help='Storage of the node state')
 args = parser.parse_args()
 
 # Take the port & address & node_id of the new node
@@ -17,23 +25,61 @@ address = args.address
 node_id = args.node_id
 
 # Initialize Database Connection
-import pymongo
+storage = create_storage(kind=args.storage, node_id=node_id)
 
-client = pymongo.MongoClient(host=['localhost:27017'], replicaset='rs0')
+# The incoming messages are sent to main.py through the transport
+transport = create_transport(kind=args.transport, node_id=node_id)
 
-db = client[f"node_{node_id}"]
-message_queue = db['incoming_messages']
 
+# The ring of the node, in order to find the public keys of the wire messages
+wire_ring = None
+
+def load_wire_ring() -> ring.Ring:
+
+    global wire_ring
+    status_doc = storage.load_status()
+    wire_ring = ring.Ring(status_doc['ring'] if status_doc is not None else {})
+    return wire_ring
+
+'''
+Decode the body of a request in the binary format of wire.py, 
+abort with 415 when we don't understand it, and with 422 when it refers to a node that we don't know yet.
+'''
+def read_wire(kind: str):
+
+    try:
+        for attempt in range(2):
+            try:
+                # The ring changes while the nodes arrive, so load it again when a node is not in it
+                members = wire_ring if wire_ring is not None and attempt == 0 else load_wire_ring()
+                message_kind, data = wire.decode(request.get_data(), members)
+                break
+            except custom_errors.UnknownKeyReference:
+                if attempt == 1:
+                    raise
+
+    except custom_errors.UnknownKeyReference as e:
+        abort(422, str(e))
+    except custom_errors.InvalidWireMessage as e:
+        abort(415, str(e))
+
+    if message_kind != kind:
+        abort(415, f'Expected a {kind} message.')
+
+    return data
+
+def is_wire_request() -> bool:
+    return request.mimetype == wire.CONTENT_TYPE
 
 class Block(Resource):
 
     def post(self):
 
         # Retrieve incoming block
-        block = request.json
+        block = read_wire('block') if is_wire_request() else request.json
 
-        # Add the block to the message collection
-        message_queue.insert_one({**{"type": "block"}, **block})
+        # Send it to the node through the transport
+        transport.send({**{"type": "block"}, **block})
 
         return {'msg': 'Block added successfully'}
 
@@ -44,28 +90,45 @@ class Transaction(Resource):
         # Retrieve incoming transaction
         transaction = request.json
 
-        # Add the block to the message collection
-        message_queue.insert_one({**{"type": "transaction"}, **transaction})
+        # Send it to the node through the transport
+        transport.send({**{"type": "transaction"}, **transaction})
 
         return {'msg': 'Transaction added successfully'}
 
+class Transactions(Resource):
+
+    def post(self):
+
+        # Retrieve the incoming batch of transactions
+        transactions = read_wire('transactions') if is_wire_request() else request.json['transactions']
+
+        # Send all of them to the node with one write
+        transport.send_many([{**{"type": "transaction"}, **transaction} for transaction in transactions])
+
+        return {'msg': f'{len(transactions)} transactions added successfully'}
+
 # Only for bootstrap node
 class InitSettings(Resource):
 
     def get(self):
 
-        try:
-            settings_col = db["info"]
-            settings_doc = list(settings_col.find({"_id": "status_doc"}, {"_id": 0}))[0]
-
-            return {
-                **{"new_node_id": str(len(settings_doc['ring']))},
-                **settings_doc
-            }
+        # The status, the chain and the UTXOs of the same save of the node
+        with storage.snapshot():
+            settings_doc = storage.load_status()
+            if settings_doc is not None:
+                chain = storage.load_chain()
+                UTXOs = storage.load_UTXOs()
 
-        except IndexError:
+        if settings_doc is None:
             abort(400, "Bootstrap node has not been configured yet.")
 
+        return {
+            **{"new_node_id": str(len(settings_doc['ring']))},
+            **settings_doc,
+            "chain": chain,
+            "UTXOs": UTXOs
+        }
+
 # Only for bootstrap node
 class NewNodeArrived(Resource):
 
@@ -74,8 +137,8 @@ class NewNodeArrived(Resource):
         # Retrieve the new node specs
         new_node_specs = request.json
 
-        # Add the block to the message collection
-        message_queue.insert_one({**{"type": "NewNodeArrived"}, **new_node_specs})
+        # Send it to the node through the transport
+        transport.send({**{"type": "NewNodeArrived"}, **new_node_specs})
 
         return {'msg': 'NewNodeArrived message added successfully'}
 
@@ -86,8 +149,8 @@ class Ring(Resource):
         # Retrieve incoming ring
         ring = request.json
 
-        # Add the block to the message collection
-        message_queue.insert_one({**{"type": "ring"}, **ring})
+        # Send it to the node through the transport
+        transport.send({**{"type": "ring"}, **ring})
 
         return {'msg': 'Ring added successfully'}
 
@@ -95,22 +158,30 @@ class Chain(Resource):
 
     def get(self):
 
-        try:
+        # The chain_hash and its signature must be of the same blocks and UTXOs that we send
+        with storage.snapshot():
+            status_doc = storage.load_status()
+            if status_doc is not None:
+                chain = storage.load_chain()
+                UTXOs = storage.load_UTXOs()
+
+        if status_doc is None:
+            abort(400, "This node has not any chain yet.")
 
-            settings_col = db["info"]
-            status_doc = list(settings_col.find({"_id": "status_doc"}, {"_id": 0}))[0]
+        response = {
+            "UTXOs": UTXOs,
+            "chain": chain,
+            "chain_hash": status_doc["chain_hash"],
+            "signature_chain": status_doc["signature_chain"],
+            "last_block_timestamp": status_doc["last_block_timestamp"],
+            "chain_transaction_ids": persistence.chain_transaction_ids(chain)
+        }
 
-            return {
-                "UTXOs": status_doc["UTXOs"],
-                "chain": status_doc["chain"],
-                "chain_hash": status_doc["chain_hash"],
-                "signature_chain": status_doc["signature_chain"],
-                "last_block_timestamp": status_doc["last_block_timestamp"],
-                "chain_transaction_ids": status_doc["chain_transaction_ids"]
-            }
+        # Answer in the binary format only when the node prefers it, JSON wins when both are equally accepted
+        if request.accept_mimetypes.best_match(['application/json', wire.CONTENT_TYPE]) == wire.CONTENT_TYPE:
+            return Response(wire.encode('chain', response, ring.Ring(status_doc['ring'])), content_type=wire.content_type())
 
-        except IndexError:
-            abort(400, "This node has not any chain yet.")
+        return response
 
 # .......................................................................................
 
@@ -121,6 +192,7 @@ api = Api(app=app, version='1.0', title='Blockchain Node Server')
 
 api.add_resource(Block, '/block')
 api.add_resource(Transaction, '/transaction')
+api.add_resource(Transactions, '/transactions')
 api.add_resource(Ring, '/ring')
 api.add_resource(InitSettings, '/init_settings')
 api.add_resource(Chain, '/chain')
@@ -129,4 +201,11 @@ api.add_resource(NewNodeArrived, '/new_node_arrived')
 
 if __name__ == '__main__':
 
-    app.run(host=address, port=port, debug=True)
+    # Waitress keeps the connections of the other nodes alive (see network.py),
+    # while the development server of Flask closes the connection after every request
+    try:
+        from waitress import serve
+    except ImportError:
+        app.run(host=address, port=port, debug=True)
+    else:
+        serve(app, host=address, port=port, threads=8)
@@ -1,5 +1,5 @@
-import pymongo
 from argparse import ArgumentParser
+from transport import create_transport, TRANSPORT, TRANSPORTS
 import time
 
 # Get command line arguments
@@ -7,6 +7,7 @@ parser = ArgumentParser()
 parser.add_argument('-n', '--node_id', default='0', type=str, help='Node ID')
 parser.add_argument('-p', '--port', default=5000, type=int, help='port to listen on')
 parser.add_argument('-a', '--address', default='127.0.0.1', type=str, help='Network address')
+parser.add_argument('-t', '--transport', default=TRANSPORT, choices=TRANSPORTS, help='Transport of the node')
 args = parser.parse_args()
 
 # Take the port & address & node_id of the new node
@@ -14,16 +15,12 @@ port = args.port
 address = args.address
 node_id = args.node_id
 
-# Initialize Database Connection
-
-client = pymongo.MongoClient(host=['localhost:27017'], replicaset='rs0')
-
-db = client[f"node_{node_id}"]
-message_queue = db['incoming_messages']
+# The transactions are sent to the node through its transport
+transport = create_transport(kind=args.transport, node_id=node_id)
 
 def add_transaction(recipient_node_id: str, amount: str):
 
-    message_queue.insert_one({**{"type": "NewTransaction"}, **{
+    transport.send({**{"type": "NewTransaction"}, **{
         "recipient_node_id": recipient_node_id,
         "amount": amount
     }})
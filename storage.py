@@ -0,0 +1,407 @@
+import contextlib
+import threading
+import tempfile
+import sqlite3
+import json
+import glob
+import os
+
+# The default storage of the node state, selectable with -s at main.py and server.py
+STORAGE = 'mongo'
+STORAGES = ['mongo', 'sqlite']
+
+# Where the SQLite databases of the nodes are stored, one file for every node
+SQLITE_DIR = tempfile.gettempdir()
+
+'''
+A Storage keeps the state of a node in these roles:
+    1. status: the small metadata of the node (fields of the status document)
+    2. blocks: the chain, one record for every block by its height
+    3. utxos: the unspent transaction outputs and the balance of every address, with a log of their changes
+    4. messages: the incoming messages of the node, until they are processed (see transport.py)
+The writes of the node are only changes, so every method takes only what has changed.
+'''
+class Storage:
+
+    '''
+    Group the writes of one save, so that they are stored together
+    '''
+    @contextlib.contextmanager
+    def batch(self):
+        yield
+
+    '''
+    Group the reads of e.g. one answer of the api server, so that they see the same save of the node
+    '''
+    @contextlib.contextmanager
+    def snapshot(self):
+        with self.batch():
+            yield
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    # -------------- Status --------------
+
+    def save_status(self, fields: dict) -> None:
+        raise NotImplementedError
+
+    def load_status(self) -> dict:
+        raise NotImplementedError
+
+    # -------------- Blocks --------------
+
+    '''
+    Remove the blocks from the given height and on
+    '''
+    def truncate_blocks(self, height: int) -> None:
+        raise NotImplementedError
+
+    def append_blocks(self, height: int, blocks: [dict]) -> None:
+        raise NotImplementedError
+
+    def load_chain(self) -> [dict]:
+        raise NotImplementedError
+
+    def load_last_block(self) -> dict:
+        raise NotImplementedError
+
+    # -------------- UTXOs --------------
+
+    '''
+    Replace all the UTXOs (a list of UTXO dictionaries) and the balances
+    '''
+    def replace_utxos(self, utxos: [dict], balances: dict) -> None:
+        raise NotImplementedError
+
+    '''
+    Apply a list of (is_spent, UTXO dictionary) in their order, and set the balances of the changed addresses
+    '''
+    def apply_utxo_changes(self, changes: list, balances: dict) -> None:
+        raise NotImplementedError
+
+    def append_utxo_log(self, seq: int, entry: dict) -> None:
+        raise NotImplementedError
+
+    # The nested dictionary format of UTXOSet.to_dict()
+    def load_UTXOs(self) -> dict:
+        raise NotImplementedError
+
+    def load_balance(self, address: str) -> int:
+        raise NotImplementedError
+
+    # -------------- Monitoring --------------
+
+    def save_mined_block(self, block: dict) -> None:
+        raise NotImplementedError
+
+def create_storage(kind: str, node_id: str) -> Storage:
+
+    if kind == 'mongo':
+        return MongoStorage(node_id)
+    elif kind == 'sqlite':
+        return SQLiteStorage(sqlite_path(node_id))
+    else:
+        raise ValueError(f'Unknown storage {kind}, choose one of {STORAGES}')
+
+def sqlite_path(node_id: str) -> str:
+    return os.path.join(SQLITE_DIR, f'nbc_node_{node_id}.sqlite3')
+
+def sqlite_paths() -> [str]:
+    return glob.glob(os.path.join(SQLITE_DIR, 'nbc_node_*.sqlite3*'))
+
+# ----------------------------- MongoDB -----------------------------
+
+'''
+Every role is a collection of the database 'node_<node_id>':
+'info' (the status document), 'blocks', 'utxos', 'balances', 'utxo_log', 'incoming_messages' and 'mined_blocks'.
+A batch (and a snapshot) is a transaction of a session, every thread has its own session.
+'''
+class MongoStorage(Storage):
+
+    def __init__(self, node_id: str):
+
+        import pymongo
+
+        self.client = pymongo.MongoClient(host=['localhost:27017'], replicaset='rs0')
+        self.local = threading.local()
+
+        self.db = self.client[f"node_{node_id}"]
+        self.status = self.db['info']
+        self.blocks = self.db['blocks']
+        self.utxos = self.db['utxos']
+        self.balances = self.db['balances']
+        self.utxo_log = self.db['utxo_log']
+        self.message_queue = self.db['incoming_messages']
+
+    '''
+    The session of the batch of this thread, None outside of a batch
+    '''
+    def session(self):
+        return getattr(self.local, 'session', None)
+
+    '''
+    The writes inside a batch are committed together, at the end of the outer batch,
+    and its reads see the snapshot of the start of the transaction
+    '''
+    @contextlib.contextmanager
+    def batch(self):
+
+        session = self.session()
+        if session is not None:
+            yield session
+            return
+
+        from pymongo.read_concern import ReadConcern
+        from pymongo import WriteConcern
+
+        with self.client.start_session() as session:
+            with session.start_transaction(read_concern=ReadConcern('snapshot'), write_concern=WriteConcern('majority')):
+                self.local.session = session
+                try:
+                    yield session
+                finally:
+                    self.local.session = None
+
+    def clear(self) -> None:
+        with self.batch() as session:
+            for collection in [self.status, self.blocks, self.utxos, self.balances, self.utxo_log]:
+                collection.delete_many({}, session=session)
+
+    def save_status(self, fields: dict) -> None:
+        self.status.update_one({'_id': 'status_doc'}, {'$set': fields}, upsert=True, session=self.session())
+
+    def load_status(self) -> dict:
+        return self.status.find_one({'_id': 'status_doc'}, {'_id': 0}, session=self.session())
+
+    def truncate_blocks(self, height: int) -> None:
+        self.blocks.delete_many({'_id': {'$gte': height}}, session=self.session())
+
+    def append_blocks(self, height: int, blocks: [dict]) -> None:
+        self.blocks.insert_many([{'_id': height + i, **block} for i, block in enumerate(blocks)], session=self.session())
+
+    def load_chain(self) -> [dict]:
+        return list(self.blocks.find({}, {'_id': 0}, session=self.session()).sort('_id', 1))
+
+    def load_last_block(self) -> dict:
+        return self.blocks.find_one({}, {'_id': 0}, sort=[('_id', -1)], session=self.session())
+
+    def replace_utxos(self, utxos: [dict], balances: dict) -> None:
+
+        with self.batch() as session:
+
+            self.utxos.delete_many({}, session=session)
+            self.balances.delete_many({}, session=session)
+
+            if len(utxos) > 0:
+                self.utxos.insert_many([{'_id': utxo['id'], **utxo} for utxo in utxos], session=session)
+            if len(balances) > 0:
+                self.balances.insert_many([{'_id': address, 'balance': balance} for address, balance in balances.items()],
+                                          session=session)
+
+    def apply_utxo_changes(self, changes: list, balances: dict) -> None:
+
+        from pymongo import ReplaceOne, DeleteOne, UpdateOne
+
+        with self.batch() as session:
+
+            self.utxos.bulk_write([
+                DeleteOne({'_id': utxo['id']}) if is_spent
+                else ReplaceOne({'_id': utxo['id']}, {'_id': utxo['id'], **utxo}, upsert=True)
+                for is_spent, utxo in changes
+            ], ordered=True, session=session)
+
+            self.balances.bulk_write([
+                UpdateOne({'_id': address}, {'$set': {'balance': balance}}, upsert=True)
+                for address, balance in balances.items()
+            ], session=session)
+
+    def append_utxo_log(self, seq: int, entry: dict) -> None:
+        self.utxo_log.insert_one({'_id': seq, **entry}, session=self.session())
+
+    def load_UTXOs(self) -> dict:
+
+        UTXOs = {}
+        for utxo in self.utxos.find({}, {'_id': 0}, session=self.session()):
+            UTXOs.setdefault(utxo['receiverAddress'], {})[utxo['id']] = utxo
+        return UTXOs
+
+    def load_balance(self, address: str) -> int:
+
+        balance_doc = self.balances.find_one({'_id': address}, session=self.session())
+        return 0 if balance_doc is None else balance_doc['balance']
+
+    def save_mined_block(self, block: dict) -> None:
+        self.db['mined_blocks'].insert_one(dict(block))
+
+# ----------------------------- SQLite -----------------------------
+
+'''
+All the roles are tables of one SQLite file, so the node needs no database server.
+The values are stored in JSON. Every thread (e.g. of the api server) has its own connection,
+and the file is in WAL mode, so the readers of the other processes don't block the node.
+'''
+class SQLiteStorage(Storage):
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS status (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS blocks (height INTEGER PRIMARY KEY, block TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS utxos (id TEXT PRIMARY KEY, receiver TEXT NOT NULL, utxo TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS balances (address TEXT PRIMARY KEY, balance INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS utxo_log (seq INTEGER PRIMARY KEY, entry TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS mined_blocks (id INTEGER PRIMARY KEY AUTOINCREMENT, block TEXT NOT NULL);
+    '''
+
+    def __init__(self, path: str):
+
+        self.path = path
+        self.local = threading.local()
+
+        self.connection().executescript(self.SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            self.local.depth = 0
+
+        return connection
+
+    '''
+    The writes inside a batch are committed together, at the end of the outer batch
+    '''
+    def batch(self):
+        return self.transaction('BEGIN IMMEDIATE')
+
+    '''
+    A read transaction, so its reads see the same version of the file even while the node writes (WAL mode)
+    '''
+    def snapshot(self):
+        return self.transaction('BEGIN')
+
+    '''
+    Only the outer batch or snapshot starts the transaction, with the given BEGIN statement
+    '''
+    @contextlib.contextmanager
+    def transaction(self, begin: str):
+
+        connection = self.connection()
+        if self.local.depth == 0:
+            connection.execute(begin)
+
+        self.local.depth += 1
+        try:
+            yield connection
+        except BaseException:
+            self.local.depth -= 1
+            if self.local.depth == 0:
+                connection.execute('ROLLBACK')
+            raise
+        else:
+            self.local.depth -= 1
+            if self.local.depth == 0:
+                connection.execute('COMMIT')
+
+    def clear(self) -> None:
+        with self.batch() as connection:
+            for table in ['status', 'blocks', 'utxos', 'balances', 'utxo_log']:
+                connection.execute(f'DELETE FROM {table}')
+
+    def save_status(self, fields: dict) -> None:
+        with self.batch() as connection:
+            connection.executemany('INSERT OR REPLACE INTO status (key, value) VALUES (?, ?)',
+                                   [(key, json.dumps(value)) for key, value in fields.items()])
+
+    def load_status(self) -> dict:
+
+        rows = self.connection().execute('SELECT key, value FROM status').fetchall()
+        if len(rows) == 0:
+            return None
+
+        return {key: json.loads(value) for key, value in rows}
+
+    def truncate_blocks(self, height: int) -> None:
+        with self.batch() as connection:
+            connection.execute('DELETE FROM blocks WHERE height >= ?', (height,))
+
+    def append_blocks(self, height: int, blocks: [dict]) -> None:
+        with self.batch() as connection:
+            connection.executemany('INSERT INTO blocks (height, block) VALUES (?, ?)',
+                                   [(height + i, json.dumps(block)) for i, block in enumerate(blocks)])
+
+    def load_chain(self) -> [dict]:
+        rows = self.connection().execute('SELECT block FROM blocks ORDER BY height').fetchall()
+        return [json.loads(block) for block, in rows]
+
+    def load_last_block(self) -> dict:
+        row = self.connection().execute('SELECT block FROM blocks ORDER BY height DESC LIMIT 1').fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def replace_utxos(self, utxos: [dict], balances: dict) -> None:
+        with self.batch() as connection:
+            connection.execute('DELETE FROM utxos')
+            connection.execute('DELETE FROM balances')
+            connection.executemany('INSERT INTO utxos (id, receiver, utxo) VALUES (?, ?, ?)',
+                                   [(utxo['id'], utxo['receiverAddress'], json.dumps(utxo)) for utxo in utxos])
+            connection.executemany('INSERT INTO balances (address, balance) VALUES (?, ?)', balances.items())
+
+    def apply_utxo_changes(self, changes: list, balances: dict) -> None:
+        with self.batch() as connection:
+            for is_spent, utxo in changes:
+                if is_spent:
+                    connection.execute('DELETE FROM utxos WHERE id = ?', (utxo['id'],))
+                else:
+                    connection.execute('INSERT OR REPLACE INTO utxos (id, receiver, utxo) VALUES (?, ?, ?)',
+                                       (utxo['id'], utxo['receiverAddress'], json.dumps(utxo)))
+            connection.executemany('INSERT OR REPLACE INTO balances (address, balance) VALUES (?, ?)',
+                                   balances.items())
+
+    def append_utxo_log(self, seq: int, entry: dict) -> None:
+        with self.batch() as connection:
+            connection.execute('INSERT INTO utxo_log (seq, entry) VALUES (?, ?)', (seq, json.dumps(entry)))
+
+    def load_UTXOs(self) -> dict:
+
+        UTXOs = {}
+        for receiver, utxo in self.connection().execute('SELECT receiver, utxo FROM utxos ORDER BY rowid'):
+            utxo = json.loads(utxo)
+            UTXOs.setdefault(receiver, {})[utxo['id']] = utxo
+        return UTXOs
+
+    def load_balance(self, address: str) -> int:
+        row = self.connection().execute('SELECT balance FROM balances WHERE address = ?', (address,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def save_mined_block(self, block: dict) -> None:
+        with self.batch() as connection:
+            connection.execute('INSERT INTO mined_blocks (block) VALUES (?)', (json.dumps(block),))
+
+    # -------------- Messages --------------
+
+    def push_message(self, message: dict) -> None:
+        self.push_messages([message])
+
+    def push_messages(self, messages: [dict]) -> None:
+        with self.batch() as connection:
+            connection.executemany('INSERT INTO messages (message) VALUES (?)',
+                                   [(json.dumps(message),) for message in messages])
+
+    '''
+    Returns the (id, message) of the messages after the given id, in their order
+    '''
+    def messages_after(self, message_id: int) -> list:
+        rows = self.connection().execute('SELECT id, message FROM messages WHERE id > ? ORDER BY id',
+                                         (message_id,)).fetchall()
+        return [(row_id, json.loads(message)) for row_id, message in rows]
+
+    def last_message_id(self) -> int:
+        return self.connection().execute('SELECT COALESCE(MAX(id), 0) FROM messages').fetchone()[0]
+
+    def delete_message(self, message_id: int) -> None:
+        with self.batch() as connection:
+            connection.execute('DELETE FROM messages WHERE id = ?', (message_id,))
@@ -1,5 +1,7 @@
 from block import Block
 from transaction import Transaction
+from amount import parse_nbc, format_nbc
+from storage import create_storage, STORAGE
 from Crypto.Random import get_random_bytes
 from Crypto.Hash import SHA256
 from subprocess import call, Popen
@@ -7,13 +9,12 @@ from subprocess import call, Popen
 DIFF = 5
 node_id = '0'
 import hashlib
-import pymongo
-client = pymongo.MongoClient(host=['localhost:27017'], replicaset='rs0')
+import json
 
 def test_hash_validation():
     # ---------- CREATE BLOCK ----------
     block = Block(prev_hash='1', transaction_list=[])
-    trans = Transaction(sender_address='sender', receiver_address='receiver', amount='5.0',
+    trans = Transaction(sender_address='sender', receiver_address='receiver', amount=parse_nbc('5.0'),
                         transaction_inputs=['trans_in_1', 'trans_in_2'])
     trans.signature = b'signature'
     block.add_transaction(trans)
@@ -95,7 +96,7 @@ def test_hash_validation():
 def test_parallel_mining():
     # ---------- CREATE BLOCK ----------
     block = Block(prev_hash='1', transaction_list=[])
-    trans = Transaction(sender_address='sender', receiver_address='receiver', amount='5.0',
+    trans = Transaction(sender_address='sender', receiver_address='receiver', amount=parse_nbc('5.0'),
                         transaction_inputs=['trans_in_1', 'trans_in_2'])
     trans.signature = b'signature'
     block.add_transaction(trans)
@@ -103,11 +104,502 @@ def test_parallel_mining():
     # ---------- HASH BEFORE NONCE ----------
     block_bytearray_before_nonce = block.bytearray_before_nonce()
 
-    block_bytearray_before_nonce_str = block_bytearray_before_nonce.decode('utf-8')
-    proc = Popen(["python", "mining.py", "-b", block_bytearray_before_nonce_str, "-d", str(DIFF), "-n", node_id])
+    from mining import MiningService
+    from difficulty import diff_to_target
     import time
-    time.sleep(4)
-    Popen.terminate(proc)
+    from difficulty import satisfies_target
+    found = []
+    miner = MiningService(on_found=found.append)
+    miner.start()
+    miner.submit(block.to_dict(), block_bytearray_before_nonce, diff_to_target(DIFF))
+
+    # Wait for the nonce, but not for ever
+    deadline = time.monotonic() + 120
+    while len(found) == 0 and time.monotonic() < deadline:
+        time.sleep(0.1)
+    miner.stop()
+
+    # ---------- CHECK THE MINED BLOCK ----------
+    assert len(found) == 1
+    mined = found[0]
+    assert satisfies_target(mined['hashKey'], diff_to_target(DIFF))
+    assert Block.find_hash_key(nonce=mined['nonce'], timestamp=mined['timestamp'], previous_hash=mined['previousHashKey'],
+                               transactions=mined['transactions']).hexdigest() == mined['hashKey']
+
+def test_nonce_ranges():
+    from mining import nonce_range, NONCE_SIZE
+
+    # The ranges of the workers are disjoint and cover the whole nonce space
+    for workers in [1, 3, 7]:
+        ranges = [nonce_range(i, workers) for i in range(workers)]
+        assert ranges[0][0] == 0
+        assert ranges[-1][1] == 1 << (8 * NONCE_SIZE)
+        assert all(ranges[i][1] == ranges[i + 1][0] for i in range(workers - 1))
+
+def test_retarget():
+    import datetime
+    from difficulty import next_target, target_to_hex, diff_to_target, MAX_ADJUSTMENT
+
+    interval, block_time = 4, 10.0
+    initial_target = diff_to_target(2)
+
+    def chain_with_block_time(seconds: float) -> [dict]:
+        start = datetime.datetime(2024, 1, 1)
+        return [{'timestamp': str(start + datetime.timedelta(seconds=i * seconds)), 'target': target_to_hex(initial_target)}
+                for i in range(2 * interval)]
+
+    # On time, the target stays the same, and it only changes every <interval> blocks
+    assert next_target(chain_with_block_time(block_time), 2 * interval, initial_target, interval, block_time) == initial_target
+    assert next_target(chain_with_block_time(1), 2 * interval - 1, initial_target, interval, block_time) == initial_target
+
+    # Twice as slow, twice as easy, with integer arithmetic only
+    assert next_target(chain_with_block_time(2 * block_time), 2 * interval, initial_target, interval, block_time) \
+           == initial_target * 2
+
+    # Much faster, the adjustment is limited
+    assert next_target(chain_with_block_time(0.001), 2 * interval, initial_target, interval, block_time) \
+           == initial_target * (interval * 10000 // MAX_ADJUSTMENT) // (interval * 10000)
+
+def test_utxo_undo():
+    from utxo import UTXOSet, UTXO
+    import custom_errors
+
+    utxos = UTXOSet()
+    utxos.add(UTXO('a', 't0', 'alice', 100))
+    transaction = {
+        'id': 't1',
+        'inputTransactions': ['a'],
+        'outputTransactions': [
+            {'id': 'b', 'officialTransactionId': 't1', 'receiverAddress': 'bob', 'amount': 60},
+            {'id': 'c', 'officialTransactionId': 't1', 'receiverAddress': 'alice', 'amount': 40}
+        ]
+    }
+
+    # Apply and reverse a transaction, the coins stay the same
+    undo_record = utxos.apply_transaction(transaction)
+    assert utxos.balance('bob') == 60 and utxos.total() == 100
+    utxos.undo(undo_record)
+    assert utxos.to_dict() == {'alice': {'a': UTXO('a', 't0', 'alice', 100).to_dict()}, 'bob': {}}
+
+    # A missing input or an existing output does not change anything
+    utxos.apply_transaction(transaction)
+    for bad in [transaction, {**transaction, 'inputTransactions': ['b'], 'outputTransactions': transaction['outputTransactions'][1:]}]:
+        before = utxos.to_dict()
+        try:
+            utxos.apply_transaction(bad)
+            assert False, 'InvalidUTXOs was not raised'
+        except custom_errors.InvalidUTXOs:
+            pass
+        assert utxos.to_dict() == before and utxos.total() == 100
+
+    # An undo record of another set can't be reversed
+    try:
+        utxos.undo(undo_record)
+        utxos.undo(undo_record)
+        assert False, 'InvalidUTXOs was not raised'
+    except custom_errors.InvalidUTXOs:
+        pass
+
+def test_validate_twice():
+    from node import Node
+    from wallet import Wallet
+    import custom_errors
+
+    node = Node(wallet=Wallet(), chain=[], ring={}, UTXOs={}, node_id='0')
+    supply = node.UTXOs.total()
+
+    trans = Transaction(node.wallet.address, node.wallet.address, parse_nbc('3'))
+    trans.sign_transaction(node.wallet.private_key)
+    node.validate_transaction(trans.to_dict())
+
+    # The same transaction again (e.g. a retried message) is rejected before it spends anything
+    try:
+        node.validate_transaction(trans.to_dict())
+        assert False, 'TransactionAlreadyAdded was not raised'
+    except custom_errors.TransactionAlreadyAdded:
+        pass
+
+    assert node.UTXOs.total() == supply
+    assert [t.id for t in node.current_block.list_of_transactions] == [trans.id]
+
+    # and it is validated again only once
+    node.disconnect_pending()
+    node.create_new_block()
+    node.revalidate_transactions([trans, trans])
+    assert node.UTXOs.total() == supply and len(node.pending_undo) == 1
+
+def test_malformed_transaction():
+    from node import Node
+    from wallet import Wallet
+    import custom_errors
+
+    node = Node(wallet=Wallet(), chain=[], ring={}, UTXOs={}, node_id='0')
+    supply = node.UTXOs.total()
+
+    trans = Transaction(node.wallet.address, node.wallet.address, parse_nbc('3'))
+    trans.sign_transaction(node.wallet.private_key)
+
+    # A negative amount, a missing field and a wrong signature are rejected as InvalidHash, as at the pool
+    other = Transaction(node.wallet.address, node.wallet.address, parse_nbc('4'))
+    other.sign_transaction(node.wallet.private_key)
+    for malformed in [{**trans.to_dict(), 'amount': -1},
+                      {key: value for key, value in trans.to_dict().items() if key != 'timestamp'},
+                      {**trans.to_dict(), 'signature': other.to_dict()['signature']}]:
+        try:
+            node.validate_transaction(malformed)
+            assert False, 'InvalidHash was not raised'
+        except custom_errors.InvalidHash:
+            pass
+
+    assert node.UTXOs.total() == supply and not node.pending_undo
+
+def test_reorg_keeps_the_supply():
+    import json
+    import queue
+    import node as node_module
+    from node import Node
+    from wallet import Wallet
+
+    diff, workers = node_module.DIFF, node_module.MINING_WORKERS
+    node_module.DIFF, node_module.MINING_WORKERS = 2, 1
+    mined = queue.Queue()
+
+    # ---------- TWO NODES WITH THE SAME FIRST BLOCK ----------
+    wallet_a, wallet_b = Wallet(), Wallet()
+    node_a = Node(wallet=wallet_a, chain=[], ring={}, UTXOs={}, node_id='0')
+    node_a.start_mining_service(on_found=mined.put)
+    supply = node_a.UTXOs.total()
+
+    for i in range(node_module.C):
+        node_a.create_transaction('0', parse_nbc('1'))
+    node_a.broadcast_block(mined.get(timeout=60))
+
+    node_b = Node(wallet=wallet_b, chain=json.loads(json.dumps(list(node_a.chain))), ring=json.loads(json.dumps(node_a.ring)),
+                  UTXOs=node_a.UTXOs.to_dict(), node_id='1')
+    node_b.miner = node_a.miner
+
+    try:
+        # ---------- FORK: ONE BLOCK AT NODE A, TWO BLOCKS AT NODE B ----------
+        for i in range(node_module.C):
+            node_a.create_transaction('0', parse_nbc('2'))
+        node_a.broadcast_block(mined.get(timeout=60))
+
+        shared = []
+        for b in range(2):
+            for i in range(node_module.C):
+                trans = Transaction(wallet_a.address, wallet_b.address, parse_nbc('3') + b * 10 + i)
+                trans.sign_transaction(wallet_a.private_key)
+                node_b.validate_transaction(trans.to_dict())
+                shared.append(trans)
+            node_b.receive_block(mined.get(timeout=60))
+
+        # Node A has validated transactions which are not mined, one of them is in the chain of node B
+        node_a.validate_transaction(shared[0].to_dict())
+        node_a.create_transaction('0', 7)
+        node_a.create_transaction('0', 9)
+
+        # ---------- SWITCH TO THE CHAIN OF NODE B ----------
+        node_a.ask_for_chain = lambda: {}
+        node_a.find_the_right_chain = lambda chains: (json.loads(json.dumps(list(node_b.chain))), node_b.UTXOs.to_dict(), [])
+        node_a.resolve_conflicts()
+
+        assert list(node_a.chain) == list(node_b.chain)
+        assert node_a.UTXOs.total() == supply
+        assert len(node_a.undo_journal) == len(node_a.chain)
+
+        # Only the transactions which are not in the new chain are validated again
+        assert [trans.amount for trans in node_a.current_block.list_of_transactions] == [7, 9]
+
+        # Without them, our UTXOs are the ones of node B
+        for undo_record in reversed(list(node_a.pending_undo.values())):
+            node_a.UTXOs.undo(undo_record)
+        assert node_a.UTXOs.to_dict() == node_b.UTXOs.to_dict()
+
+    finally:
+        node_a.miner.stop()
+        node_module.DIFF, node_module.MINING_WORKERS = diff, workers
+
+def test_block_with_other_inputs():
+    import json
+    import queue
+    import node as node_module
+    from node import Node
+    from wallet import Wallet
+
+    diff, workers = node_module.DIFF, node_module.MINING_WORKERS
+    node_module.DIFF, node_module.MINING_WORKERS = 2, 1
+    mined = queue.Queue()
+
+    # ---------- TWO NODES WITH THE SAME UTXOS ----------
+    wallet_a, wallet_b = Wallet(), Wallet()
+    node_a = Node(wallet=wallet_a, chain=[], ring={}, UTXOs={}, node_id='0')
+    node_b = Node(wallet=wallet_b, chain=json.loads(json.dumps(list(node_a.chain))), ring=json.loads(json.dumps(node_a.ring)),
+                  UTXOs=node_a.UTXOs.to_dict(), node_id='1')
+    node_b.start_mining_service(on_found=mined.put)
+    supply = node_a.UTXOs.total()
+
+    def signed(receiver, amount):
+        trans = Transaction(wallet_a.address, receiver, amount)
+        trans.sign_transaction(wallet_a.private_key)
+        return trans
+
+    try:
+        # Node B validates another transaction first, so the shared one spends other UTXOs there
+        shared = signed(wallet_b.address, parse_nbc('3'))
+        node_b.validate_transaction(signed(wallet_b.address, parse_nbc('2')).to_dict())
+        node_b.validate_transaction(shared.to_dict())
+        for i in range(node_module.C - 2):
+            node_b.validate_transaction(signed(wallet_b.address, parse_nbc('1') + i).to_dict())
+        block = mined.get(timeout=60)
+
+        # Node A has validated the shared transaction and one more on top of it
+        own = signed(wallet_a.address, parse_nbc('4'))
+        node_a.validate_transaction(shared.to_dict())
+        node_a.validate_transaction(own.to_dict())
+        assert not node_a.pending_undo[shared.id].matches(next(t for t in block['transactions'] if t['id'] == shared.id))
+
+        # ---------- THE BLOCK OF NODE B ----------
+        node_a.receive_block(json.loads(json.dumps(block)))
+        node_b.receive_block(block)
+
+        assert node_a.UTXOs.total() == supply
+        assert [trans.id for trans in node_a.current_block.list_of_transactions] == [own.id]
+        assert list(node_a.pending_undo) == [own.id]
+
+        # A transaction of the block that we were mining is validated again, unless it is pending or in our chain
+        node_a.create_new_block()
+        node_a.add_reversed_transaction(own)
+        node_a.add_reversed_transaction(shared)
+        assert [trans.id for trans in node_a.current_block.list_of_transactions] == [own.id]
+        assert node_a.UTXOs.total() == supply and list(node_a.pending_undo) == [own.id]
+
+        # Without our own transaction, our UTXOs are the ones of node B
+        node_a.UTXOs.undo(node_a.pending_undo[own.id])
+        assert node_a.UTXOs.to_dict() == node_b.UTXOs.to_dict()
+
+    finally:
+        node_b.miner.stop()
+        node_module.DIFF, node_module.MINING_WORKERS = diff, workers
+
+def test_reject_an_invalid_chain():
+    import json
+    import queue
+    import node as node_module
+    from node import Node
+    from chain_index import ChainCommitment
+    from Crypto.Signature import pkcs1_15
+    from wallet import Wallet
+    import custom_errors
+
+    diff, workers = node_module.DIFF, node_module.MINING_WORKERS
+    node_module.DIFF, node_module.MINING_WORKERS = 2, 1
+    mined = queue.Queue()
+
+    wallet_a = Wallet()
+    node_a = Node(wallet=wallet_a, chain=[], ring={}, UTXOs={}, node_id='0')
+    node_b = Node(wallet=Wallet(), chain=json.loads(json.dumps(list(node_a.chain))), ring=json.loads(json.dumps(node_a.ring)),
+                  UTXOs=node_a.UTXOs.to_dict(), node_id='1')
+    node_a.start_mining_service(on_found=mined.put)
+
+    try:
+        for i in range(node_module.C):
+            node_a.create_transaction('0', parse_nbc('1'))
+        node_a.broadcast_block(mined.get(timeout=60))
+        given = json.loads(json.dumps(node_a.to_dict()))
+        assert node_b.find_the_right_chain({'0': given})[0] == given['chain']
+
+        # A block with another nonce, which is signed by its sender, is not accepted
+        given['chain'][1]['nonce'] = given['chain'][0]['nonce']
+        commitment = ChainCommitment(given['chain'])
+        given['chain_hash'] = commitment.hexdigest()
+        given['signature_chain'] = pkcs1_15.new(wallet_a.private_key).sign(commitment.hash_object()).decode('ISO-8859-1')
+        try:
+            node_b.find_the_right_chain({'0': given})
+            assert False, 'UnableResolveConflict was not raised'
+        except custom_errors.UnableResolveConflict:
+            pass
+
+    finally:
+        node_a.miner.stop()
+        node_module.DIFF, node_module.MINING_WORKERS = diff, workers
+
+def test_wire_round_trip():
+    import wire
+    import custom_errors
+    from ring import Ring
+    from wallet import Wallet
+
+    wallets = [Wallet(), Wallet()]
+    ring = Ring({str(i): {'address': '127.0.0.1', 'port': 5000 + i, 'public_key': wallet.address} for i, wallet in enumerate(wallets)})
+
+    transactions = []
+    for i in range(3):
+        trans = Transaction(wallets[0].address, wallets[1].address, parse_nbc('1.5') + i, transaction_inputs=[SHA256.new(data=bytes([i])).hexdigest()])
+        trans.sign_transaction(wallets[0].private_key)
+        trans.add_transaction_outputs(surplus_amount=i)
+        transactions.append(trans.to_dict())
+
+    block = {'previousHashKey': '1', 'hashKey': SHA256.new(data=b'block').hexdigest(), 'nonce': '0',
+             'timestamp': '2024-01-01 00:00:00', 'target': SHA256.new(data=b'target').hexdigest(), 'transactions': transactions}
+    chain = {'chain': [block], 'UTXOs': {}, 'chain_hash': 'hash', 'signature_chain': None,
+             'last_block_timestamp': block['timestamp'], 'chain_transaction_ids': [trans['id'] for trans in transactions]}
+
+    # Every kind of message decodes exactly to its JSON dictionary, compressed or not
+    for kind, data in [('block', block), ('transactions', transactions), ('chain', chain)]:
+        for compress in [True, False]:
+            payload = wire.encode(kind, data, ring, compress=compress)
+            assert wire.decode(payload, ring) == (kind, json.loads(json.dumps(data)))
+
+    # The binary format is smaller than JSON
+    assert len(wire.encode('block', block, ring)) < len(json.dumps(block))
+
+    # A peer which does not know our ring members can't decode it
+    try:
+        wire.decode(wire.encode('block', block, ring), Ring({}))
+        assert False, 'UnknownKeyReference was not raised'
+    except custom_errors.UnknownKeyReference as e:
+        assert e.node_id == '0'
+
+    # A truncated message is rejected
+    try:
+        wire.decode(wire.encode('block', block, ring, compress=False)[:-5], ring)
+        assert False, 'InvalidWireMessage was not raised'
+    except custom_errors.InvalidWireMessage:
+        pass
+
+def test_mempool_order():
+    from mempool import Mempool, REVERSED, TRANSACTION, NEW_TRANSACTION
+
+    mempool = Mempool(max_size=5)
+
+    def message(trans_id: str, sender: str, timestamp: str) -> dict:
+        return {'id': trans_id, 'sender': sender, 'timestamp': timestamp}
+
+    mempool.add_message('NewTransaction', {'recipient_node_id': '1', 'amount': '1'}, 'm0')
+    mempool.add_message('transaction', message('t2', 'alice', '2024-01-01 00:00:02'), 'm2')
+    mempool.add_message('transaction', message('t1', 'bob', '2024-01-01 00:00:01'), 'm1')
+    reversed_trans = Transaction('carol', 'alice', 1, timestamp='2024-01-01 00:00:09')
+    mempool.add_reversed(reversed_trans)
+
+    # A duplicate is dropped
+    dropped = mempool.add_message('transaction', message('t1', 'bob', '2024-01-01 00:00:01'), 'm1b')
+    assert [entry.message_id for entry in dropped] == ['m1b']
+
+    # When it is full, the newest transaction of the sender with the most pending transactions is evicted
+    mempool.add_message('transaction', message('t3', 'alice', '2024-01-01 00:00:03'), 'm3')
+    dropped = mempool.add_message('transaction', message('t4', 'dave', '2024-01-01 00:00:00'), 'm4')
+    assert [entry.key for entry in dropped] == ['t3']
+
+    # When the sender has as many pending transactions as any other, its new transaction is the one dropped
+    dropped = mempool.add_message('transaction', message('t5', 'dave', '2024-01-01 00:00:00'), 'm5')
+    assert [entry.key for entry in dropped] == ['t5']
+
+    # The reversed transactions first, then the oldest transactions, then the cli messages
+    order = []
+    while len(mempool) > 0:
+        entry = mempool.pop()
+        order.append((entry.kind, entry.key))
+    assert order == [(REVERSED, reversed_trans.id), (TRANSACTION, 't4'), (TRANSACTION, 't1'), (TRANSACTION, 't2'),
+                     (NEW_TRANSACTION, 'm0')]
+
+def test_block_store_reopen():
+    import os
+    import tempfile
+    from blockstore import BlockStore
+
+    path = os.path.join(tempfile.mkdtemp(), 'test.blocks')
+
+    def block(height: int) -> dict:
+        return {'hashKey': SHA256.new(data=bytes([height])).hexdigest(),
+                'previousHashKey': '1' if height == 0 else SHA256.new(data=bytes([height - 1])).hexdigest(), 'height': height}
+
+    store = BlockStore(path)
+    store.extend([block(i) for i in range(5)])
+    store.mark_persisted(4)
+    store.close()
+
+    # The block after the persisted height is dropped, the rest are found from their headers
+    store = BlockStore(path)
+    assert len(store) == 4 and list(store) == [block(i) for i in range(4)]
+    assert store.hash_at(-1) == block(3)['hashKey'] and store.height_of(block(2)['hashKey']) == 2
+    assert bytes(store.body(1)) == json.dumps(block(1)).encode('utf-8')
+    assert store.fork_height([block(0), block(1), {'hashKey': 'other'}]) == 2
+
+    # A torn record at the end of the file is dropped
+    store.close()
+    with open(path, 'ab') as file:
+        file.write(b'NBCB torn')
+    store = BlockStore(path)
+    assert len(store) == 4
+
+    # Removed blocks are not persisted anymore
+    store.truncate(2)
+    store.close()
+    store = BlockStore(path)
+    assert len(store) == 2 and store.persisted_height == 2
+    store.close()
+
+def test_outbox():
+    import time
+    import threading
+    import requests
+    import outbox
+
+    def http_error(status_code: int) -> requests.exceptions.HTTPError:
+        response = requests.Response()
+        response.status_code = status_code
+        return requests.exceptions.HTTPError(f'{status_code} error', response=response)
+
+    senders = dict(outbox.SENDERS)
+    sent = []
+    busy = threading.Event()
+    release = threading.Event()
+    block_errors = [requests.exceptions.ConnectionError('down'), http_error(503)]
+
+    def send_transactions(address, port, payload, ring=None):
+        busy.set()
+        release.wait(10)
+        sent.append(('transactions', payload))
+
+    def send_block(address, port, payload, ring=None):
+        if block_errors:
+            raise block_errors.pop(0)
+        sent.append(('block', payload))
+
+    def send_ring(address, port, payload):
+        raise http_error(400)
+
+    outbox.SENDERS.update({'transactions': send_transactions, 'block': send_block, 'ring': send_ring})
+    peer_outbox = outbox.PeerOutbox('1', '127.0.0.1', 5001)
+    try:
+        # The sender is busy with a transaction, while the rest wait
+        peer_outbox.put('transaction', {'t': 1})
+        assert busy.wait(10)
+        peer_outbox.put('block', {'b': 1})
+        peer_outbox.put('ring', {'r': 1})
+        peer_outbox.put('block', {'b': 2})
+
+        # The newer block replaces the older one where it is, so it does not wait behind the ring
+        assert list(peer_outbox.queue) == [('block', {'b': 2}), ('ring', {'r': 1})]
+        assert peer_outbox.metrics()['coalesced'] == 1
+
+        # The block can't be reached and then gets a server error, so it is retried with backoff,
+        # while the ring is refused and dropped
+        release.set()
+        deadline = time.monotonic() + 10
+        while peer_outbox.metrics()['depth'] + len(block_errors) > 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        while peer_outbox.metrics()['dropped'] == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert sent == [('transactions', [{'t': 1}]), ('block', {'b': 2})]
+
+        metrics = peer_outbox.metrics()
+        assert metrics['sent'] == 2 and metrics['dropped'] == 1 and metrics['failures'] == 0 and metrics['depth'] == 0
+
+    finally:
+        peer_outbox.stop()
+        outbox.SENDERS.clear()
+        outbox.SENDERS.update(senders)
 
 '''
 from wallet import Wallet
@@ -124,10 +616,9 @@ pkcs1_15.new(b.public_key).verify(
 )
 '''
 
-def find_utxos(db):
-    info = db['info']
-    info_doc = list(info.find({"_id": "status_doc"}, {"_id": 0}))[0]
-    chain = info_doc['chain']
+def find_utxos(storage):
+    info_doc = storage.load_status()
+    chain = storage.load_chain()
     ring = info_doc['ring']
     # chain.append(info_doc['current_block'])
 
@@ -183,39 +674,39 @@ def find_utxos(db):
             print(k)
         print()
     '''
-    final_balance = 0.0
+    final_balance = 0
     for node_id, node_obj in ring.items():
-        wallet_balance = 0.0
+        wallet_balance = 0
         wallet_UTXOs = new_UTXOs[node_obj['public_key']]
 
         for utxo in wallet_UTXOs.values():
-            wallet_balance += float(utxo['amount'])
+            wallet_balance += utxo['amount']
 
-        print(f'Wallet of node_{node_id}: {wallet_balance}')
+        print(f'Wallet of node_{node_id}: {format_nbc(wallet_balance)}')
         final_balance += wallet_balance
 
-    print('Final -->', final_balance)
+    print('Final -->', format_nbc(final_balance))
 
-def show_balances(db):
-    info = db['info']
-    info_doc = list(info.find({"_id": "status_doc"}, {"_id": 0}))[0]
+def show_balances(storage):
+    info_doc = storage.load_status()
     ring = info_doc['ring']
-    UTXOs = info_doc['UTXOs']
+    UTXOs = storage.load_UTXOs()
 
-    final_balance = 0.0
+    final_balance = 0
 
     for node_id, node_obj in ring.items():
-        wallet_balance = 0.0
+        wallet_balance = 0
         wallet_UTXOs = UTXOs[node_obj['public_key']]
 
         for utxo in wallet_UTXOs.values():
-            wallet_balance += float(utxo['amount'])
+            wallet_balance += utxo['amount']
 
-        print(f'Wallet of node_{node_id}: {wallet_balance}')
+        print(f'Wallet of node_{node_id}: {format_nbc(wallet_balance)}')
         final_balance += wallet_balance
 
-    print('Final -->', final_balance)
+    print('Final -->', format_nbc(final_balance))
 
-for i in range(0, 10):
-    show_balances(client[f'node_{str(i)}'])
-    print('-------------------------')
\ No newline at end of file
+if __name__ == '__main__':
+    for i in range(0, 10):
+        show_balances(create_storage(kind=STORAGE, node_id=str(i)))
+        print('-------------------------')
\ No newline at end of file
@@ -3,6 +3,8 @@ from Crypto.PublicKey import RSA
 from Crypto.Signature import pkcs1_15
 import datetime
 
+from amount import encode_amount
+
 '''
 A transaction can be created only from the sender who is also the owner of the wallet, in order to sign it.
 When someone gets a transaction has to validate it.
@@ -10,22 +12,22 @@ We always need UTXOs as input for a transaction, in order to prevent double spen
 '''
 class Transaction:
 
-    def __init__(self, sender_address: str, receiver_address: str, amount: str, transaction_inputs: [str] = None,
+    # Slotted, because the validation pipeline creates one object for every transaction it sees
+    __slots__ = ('sender_address', 'receiver_address', 'amount', 'timestamp', 'transaction_id', '_id',
+                 'transaction_inputs', 'transaction_outputs', 'signature')
+
+    def __init__(self, sender_address: str, receiver_address: str, amount: int, transaction_inputs: [str] = None,
                  signature: bytes = None, timestamp: str = None):
         self.sender_address = sender_address
         self.receiver_address = receiver_address
         self.amount = amount
         self.timestamp = str(datetime.datetime.now()) if timestamp is None else timestamp
 
-        # Create the bytearray which contains the necessary fields
-        temp_bytearray = bytearray()  # Initialize the bytearray
-        temp_bytearray.extend(sender_address.encode('utf-8'))  # Add the sender_address
-        temp_bytearray.extend(receiver_address.encode('utf-8'))  # Add the recipient_address
-        temp_bytearray.extend(amount.encode('utf-8'))  # Add the value
-        temp_bytearray.extend(self.timestamp.encode('utf-8'))  # Add the timestamp
+        # Create the hash key based on the necessary fields, we keep only the raw digest (32 bytes)
+        self.transaction_id = SHA256.new(data=self.preimage()).digest()
 
-        # Create the hash key based on this bytearray
-        self.transaction_id = SHA256.new(data=temp_bytearray)
+        # The hex form of the transaction_id is computed when it is first needed
+        self._id = None
 
         '''
         The transaction_inputs is a list of transaction ids, which shows from the money came from.
@@ -40,12 +42,38 @@ class Transaction:
         # Initialize with None the signature at first and wait till the sender signs the transaction
         self.signature = signature
 
+    '''
+    The transaction_id in hex, which is used as the id of the transaction in the blocks and the messages.
+    '''
+    @property
+    def id(self) -> str:
+        if self._id is None:
+            self._id = self.transaction_id.hex()
+        return self._id
+
+    '''
+    The SHA256 hash object of the transaction, which is what the sender signs.
+    '''
+    def hash_object(self) -> SHA256:
+        return SHA256.new(data=self.preimage())
+
+    '''
+    The bytearray which is hashed in order to find the transaction_id.
+    '''
+    def preimage(self) -> bytearray:
+        temp_bytearray = bytearray()
+        temp_bytearray.extend(self.sender_address.encode('utf-8'))
+        temp_bytearray.extend(self.receiver_address.encode('utf-8'))
+        temp_bytearray.extend(encode_amount(self.amount))
+        temp_bytearray.extend(self.timestamp.encode('utf-8'))
+        return temp_bytearray
+
     '''
     # Convert the object into dictionary in order to transfer it to other nodes
     '''
     def to_dict(self) -> dict:
         return {
-            'id': self.transaction_id.hexdigest(),
+            'id': self.id,
             'sender': self.sender_address,
             'receiver': self.receiver_address,
             'amount': self.amount,
@@ -64,17 +92,19 @@ class Transaction:
         1. A unique transaction id,
         2. Τhe transaction id from which it comes from,
         3. The recipient of the transaction (the new holder of the coins),
-        4. The amount that transferred.
+        4. The amount that transferred (in base units).
     '''
-    def add_transaction_outputs(self, surplus_amount: str) -> None:
+    def add_transaction_outputs(self, surplus_amount: int) -> None:
 
         # In this TransactionOutput the receiver is the Transaction receiver
         receiver_transaction_output = TransactionOutput(official_transaction_id=self.transaction_id,
+                                                        official_transaction_hex=self.id,
                                                         receiver_address=self.receiver_address,
                                                         amount=self.amount)
 
         # In this TransactionOutput the receiver is the Transaction sender
         sender_transaction_output = TransactionOutput(official_transaction_id=self.transaction_id,
+                                                      official_transaction_hex=self.id,
                                                       receiver_address=self.sender_address,
                                                       amount=surplus_amount)
 
@@ -85,7 +115,7 @@ class Transaction:
     This function creates a PKCS#1 v1.5 signature of a message, which is the hash key of some data.
     '''
     def sign_transaction(self, sender_private_key: RSA.RsaKey) -> None:
-        self.signature = pkcs1_15.new(sender_private_key).sign(self.transaction_id)
+        self.signature = pkcs1_15.new(sender_private_key).sign(self.hash_object())
 
 '''
 There are no accounts or balances 
@@ -93,17 +123,23 @@ there are only unspent transaction outputs (UTXO) scattered in the blockchain.
 '''
 class TransactionOutput:
 
-    def __init__(self, official_transaction_id: SHA256, receiver_address: str, amount: str):
+    __slots__ = ('official_transaction_id', 'official_transaction_hex', 'receiver_address', 'amount', 'id')
+
+    def __init__(self, official_transaction_id: bytes, receiver_address: str, amount: int,
+                 official_transaction_hex: str = None):
 
+        # The raw digest of the transaction and its hex form, which the Transaction has already computed
         self.official_transaction_id = official_transaction_id
+        self.official_transaction_hex = official_transaction_id.hex() if official_transaction_hex is None \
+            else official_transaction_hex
         self.receiver_address = receiver_address
         self.amount = amount
 
         # Hash the transaction in order to find its unique id
         temp_bytearray = bytearray()  # Initialize the bytearray
-        temp_bytearray.extend(official_transaction_id.hexdigest().encode('utf-8'))  # Add the sender_address
+        temp_bytearray.extend(self.official_transaction_hex.encode('utf-8'))  # Add the official transaction id
         temp_bytearray.extend(receiver_address.encode('utf-8'))  # Add the recipient_address
-        temp_bytearray.extend(amount.encode('utf-8'))  # Add the value
+        temp_bytearray.extend(encode_amount(amount))  # Add the value (in base units)
 
         self.id = SHA256.new(data=temp_bytearray).hexdigest()
 
@@ -111,7 +147,7 @@ class TransactionOutput:
     def to_dict(self) -> dict:
         return {
             'id': self.id,
-            'officialTransactionId': self.official_transaction_id.hexdigest(),
+            'officialTransactionId': self.official_transaction_hex,
             'receiverAddress': self.receiver_address,
             'amount': self.amount
         }
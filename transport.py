@@ -0,0 +1,390 @@
+import itertools
+import threading
+import tempfile
+import socket
+import struct
+import json
+import time
+import os
+
+# The default transport of the messages between server.py, cli.py, simulation.py and main.py
+TRANSPORT = 'mongo'
+TRANSPORTS = ['mongo', 'unix', 'sqlite', 'memory']
+
+# How long the change stream waits for a new message before the reader checks if it is stopped (ms)
+STREAM_MAX_AWAIT_MS = 1000
+
+# After a failure the change stream is resumed after STREAM_RETRY_BASE seconds, doubled with every failure in a row
+# up to STREAM_RETRY_MAX, and after STREAM_MAX_FAILURES failures in a row the reader stops
+STREAM_RETRY_BASE = 0.1
+STREAM_RETRY_MAX = 10.0
+STREAM_MAX_FAILURES = 10
+
+# How often the SQLite message table is checked for new messages (seconds)
+SQLITE_POLL_INTERVAL = 0.005
+
+# Every message on a socket is prefixed with its length (4 bytes in big endian order)
+FRAME_HEADER = struct.Struct('>I')
+
+'''
+A Transport delivers the messages of a node from their producers (the api server, the cli and the simulations)
+to the main loop of the node.
+Every message is a dictionary with its 'type' and its data, like the documents of the message collection.
+The producers call send() (or send_many() for a batch) and the node calls start() with its Scheduler, and ack() when a message is processed.
+'''
+class Transport:
+
+    def send(self, message: dict) -> None:
+        raise NotImplementedError
+
+    '''
+    Send many messages at once, the transports that can write them together override it
+    '''
+    def send_many(self, messages: [dict]) -> None:
+        for message in messages:
+            self.send(message)
+
+    def start(self, scheduler) -> None:
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        pass
+
+    '''
+    The message is processed, so it can be deleted
+    '''
+    def ack(self, message_id) -> None:
+        pass
+
+    @staticmethod
+    def put_message(scheduler, message: dict, message_id) -> None:
+
+        # Keep only the usefull data
+        scheduler.put(
+            message_type=message['type'],
+            message_data={k: v for k, v in message.items() if k not in ['_id', 'type']},
+            message_id=message_id
+        )
+
+def create_transport(kind: str, node_id: str) -> Transport:
+
+    if kind == 'mongo':
+        return MongoTransport(node_id)
+    elif kind == 'unix':
+        return UnixSocketTransport(socket_path(node_id))
+    elif kind == 'sqlite':
+        from storage import create_storage
+        return SQLiteTransport(create_storage('sqlite', node_id))
+    elif kind == 'memory':
+        return MemoryTransport.of_node(node_id)
+    else:
+        raise ValueError(f'Unknown transport {kind}, choose one of {TRANSPORTS}')
+
+def socket_path(node_id: str) -> str:
+    return os.path.join(tempfile.gettempdir(), f'nbc_node_{node_id}.sock')
+
+# ----------------------------- MongoDB -----------------------------
+
+'''
+The messages are inserted into the 'incoming_messages' collection of the node and the node reads them with a change stream.
+It needs MongoDB with a replica set.
+'''
+class MongoTransport(Transport):
+
+    def __init__(self, node_id: str):
+
+        import pymongo
+
+        client = pymongo.MongoClient(host=['localhost:27017'], replicaset='rs0')
+        self.collection = client[f"node_{node_id}"]['incoming_messages']
+        self.reader = None
+
+    def send(self, message: dict) -> None:
+        self.collection.insert_one(dict(message))
+
+    def send_many(self, messages: [dict]) -> None:
+        if len(messages) > 0:
+            self.collection.insert_many([dict(message) for message in messages], ordered=True)
+
+    def start(self, scheduler) -> None:
+
+        self.reader = MessageStreamReader(self.collection, scheduler, max_await_time_ms=STREAM_MAX_AWAIT_MS)
+        self.reader.start()
+
+    def stop(self) -> None:
+        if self.reader is not None:
+            self.reader.stop()
+
+    def ack(self, message_id) -> None:
+        if message_id is not None:
+            self.collection.delete_one({'_id': message_id})
+
+'''
+Reads the inserts of the message collection through a change stream at the background and puts them into the scheduler.
+When the stream fails it is resumed from the last seen insert with exponential backoff.
+If it can't be resumed (no resume token, an error which is not resumable or too many failures in a row)
+the scheduler is closed.
+'''
+class MessageStreamReader(threading.Thread):
+
+    PIPELINE = [{'$match': {'operationType': 'insert'}}]
+
+    def __init__(self, collection, scheduler, max_await_time_ms: int = 1000):
+
+        super().__init__(daemon=True)
+        self.collection = collection
+        self.scheduler = scheduler
+        self.max_await_time_ms = max_await_time_ms
+        self.resume_token = None
+        self.failures = 0
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+
+        from pymongo import errors as pymongo_errors
+
+        try:
+            while not self.stopped.is_set():
+                try:
+                    self._read_stream()
+
+                except pymongo_errors.PyMongoError as e:
+
+                    # There is no usable resume token because there was a
+                    # failure during ChangeStream initialization.
+                    if self.resume_token is None:
+                        print(str(e))
+                        return
+
+                    self.failures += 1
+                    if not self.is_resumable(e) or self.failures > STREAM_MAX_FAILURES:
+                        print(f'Unable to resume the change stream after {self.failures} failures: {str(e)}')
+                        return
+
+                    # Otherwise the new ChangeStream continues from the last seen insert without missing any events
+                    delay = min(STREAM_RETRY_MAX, STREAM_RETRY_BASE * 2 ** (self.failures - 1))
+                    print(f'Resume the change stream in {delay} seconds after: {str(e)}')
+                    print('---------------------------------------')
+                    self.stopped.wait(delay)
+        finally:
+            self.scheduler.close()
+
+    def _read_stream(self) -> None:
+
+        with self.collection.watch(self.PIPELINE, resume_after=self.resume_token,
+                                   max_await_time_ms=self.max_await_time_ms) as stream:
+
+            # The stream is open again
+            self.failures = 0
+
+            while stream.alive and not self.stopped.is_set():
+
+                insert_change = stream.try_next()
+                if insert_change is not None:
+                    document = insert_change['fullDocument']
+                    Transport.put_message(self.scheduler, document, document['_id'])
+
+                self.resume_token = stream.resume_token
+
+    '''
+    The network errors and the errors that the server labels as resumable, the rest (e.g. the history of
+    the change stream is lost or the resume token is invalid) can't be fixed by opening the stream again
+    '''
+    @staticmethod
+    def is_resumable(error) -> bool:
+
+        from pymongo import errors as pymongo_errors
+        return isinstance(error, pymongo_errors.ConnectionFailure) or error.has_error_label('ResumableChangeStreamError')
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+# ----------------------------- Unix domain socket -----------------------------
+
+'''
+The node listens on a Unix domain socket and the producers send length-prefixed JSON messages to it.
+The messages are not stored anywhere, so there is nothing to delete when they are processed.
+'''
+class UnixSocketTransport(Transport):
+
+    def __init__(self, path: str):
+
+        self.path = path
+
+        # The producer side keeps one connection to the node
+        self.connection = None
+        self.lock = threading.Lock()
+
+        # The node side
+        self.listener = None
+        self.scheduler = None
+        self.message_ids = itertools.count(1)
+
+    def send(self, message: dict) -> None:
+        self.send_many([message])
+
+    def send_many(self, messages: [dict]) -> None:
+
+        # All the messages are written with one call
+        frames = bytearray()
+        for message in messages:
+            payload = json.dumps(message).encode('utf-8')
+            frames += FRAME_HEADER.pack(len(payload)) + payload
+
+        with self.lock:
+
+            # Reconnect once if the node has closed our connection
+            for attempt in range(2):
+                try:
+                    if self.connection is None:
+                        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        self.connection.connect(self.path)
+                    self.connection.sendall(frames)
+                    return
+
+                except OSError:
+                    self.close_connection()
+                    if attempt == 1:
+                        raise
+
+    def close_connection(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def start(self, scheduler) -> None:
+
+        self.scheduler = scheduler
+
+        # Remove the socket of a previous run
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen()
+
+        threading.Thread(target=self._accept_connections, daemon=True).start()
+
+    def stop(self) -> None:
+
+        self.close_connection()
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def _accept_connections(self) -> None:
+
+        while self.listener is not None:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+
+            threading.Thread(target=self._read_messages, args=(connection,), daemon=True).start()
+
+    def _read_messages(self, connection: socket.socket) -> None:
+
+        with connection, connection.makefile('rb') as stream:
+            while True:
+
+                header = stream.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    return
+
+                payload = stream.read(FRAME_HEADER.unpack(header)[0])
+                try:
+                    message = json.loads(payload)
+                except ValueError:
+                    print('Invalid message at the socket')
+                    return
+
+                self.put_message(self.scheduler, message, next(self.message_ids))
+
+# ----------------------------- SQLite -----------------------------
+
+'''
+The messages are inserted into the messages table of the SQLite storage of the node (see storage.py),
+and the node reads the new ones at the background. They are deleted when they are processed, like at MongoDB.
+'''
+class SQLiteTransport(Transport):
+
+    def __init__(self, storage):
+
+        self.storage = storage
+        self.reader = None
+        self.stopped = threading.Event()
+
+    def send(self, message: dict) -> None:
+        self.storage.push_message(message)
+
+    def send_many(self, messages: [dict]) -> None:
+        self.storage.push_messages(messages)
+
+    def start(self, scheduler) -> None:
+
+        # Like a change stream, we read only the messages that are sent after we started
+        last_id = self.storage.last_message_id()
+
+        self.reader = threading.Thread(target=self._read_messages, args=(scheduler, last_id), daemon=True)
+        self.reader.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def ack(self, message_id) -> None:
+        if message_id is not None:
+            self.storage.delete_message(message_id)
+
+    def _read_messages(self, scheduler, last_id: int) -> None:
+
+        while not self.stopped.is_set():
+
+            messages = self.storage.messages_after(last_id)
+            for message_id, message in messages:
+                self.put_message(scheduler, message, message_id)
+                last_id = message_id
+
+            if not messages:
+                time.sleep(SQLITE_POLL_INTERVAL)
+
+# ----------------------------- In memory -----------------------------
+
+'''
+The producers and the node run in the same process, so the messages go directly into the scheduler.
+It is mostly useful for tests and simulations, where many nodes run in one process.
+'''
+class MemoryTransport(Transport):
+
+    nodes = {}
+
+    def __init__(self):
+
+        self.scheduler = None
+        self.message_ids = itertools.count(1)
+
+        # The messages that were sent before the node started
+        self.pending = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def of_node(node_id: str):
+        return MemoryTransport.nodes.setdefault(node_id, MemoryTransport())
+
+    def send(self, message: dict) -> None:
+
+        with self.lock:
+            if self.scheduler is None:
+                self.pending.append(dict(message))
+            else:
+                self.put_message(self.scheduler, message, next(self.message_ids))
+
+    def start(self, scheduler) -> None:
+
+        with self.lock:
+            self.scheduler = scheduler
+            for message in self.pending:
+                self.put_message(scheduler, message, next(self.message_ids))
+            self.pending = []
@@ -0,0 +1,254 @@
+from transaction import TransactionOutput
+import custom_errors
+
+'''
+A compact record of an unspent transaction output. The amount is in base units.
+'''
+class UTXO:
+
+    __slots__ = ('id', 'official_transaction_id', 'receiver_address', 'amount')
+
+    def __init__(self, utxo_id: str, official_transaction_id: str, receiver_address: str, amount: int):
+
+        self.id = utxo_id
+        self.official_transaction_id = official_transaction_id
+        self.receiver_address = receiver_address
+        self.amount = amount
+
+    @staticmethod
+    def from_output(trans_output: TransactionOutput):
+        return UTXO(
+            utxo_id=trans_output.id,
+            official_transaction_id=trans_output.official_transaction_hex,
+            receiver_address=trans_output.receiver_address,
+            amount=trans_output.amount
+        )
+
+    @staticmethod
+    def from_dict(utxo: dict):
+        return UTXO(
+            utxo_id=utxo['id'],
+            official_transaction_id=utxo['officialTransactionId'],
+            receiver_address=utxo['receiverAddress'],
+            amount=utxo['amount']
+        )
+
+    # The same format as the TransactionOutput.to_dict()
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'officialTransactionId': self.official_transaction_id,
+            'receiverAddress': self.receiver_address,
+            'amount': self.amount
+        }
+
+'''
+The changes that a transaction or a block has made to the UTXOs, in their order:
+the outputs it spent and the outputs it created.
+With them we can reverse a block without replaying the chain, e.g. when we switch to another chain.
+'''
+class UndoRecord:
+
+    __slots__ = ('changes',)
+
+    def __init__(self):
+
+        # List of (is_spent, UTXO)
+        self.changes = []
+
+    def spent(self, utxo: UTXO) -> None:
+        self.changes.append((True, utxo))
+
+    def created(self, utxo: UTXO) -> None:
+        self.changes.append((False, utxo))
+
+    def extend(self, undo_record) -> None:
+        self.changes.extend(undo_record.changes)
+
+    '''
+    Check that the record is the one of the given transaction of a block (see Node.validate_transaction):
+    it spent exactly its inputTransactions and created exactly its outputTransactions, in their order
+    '''
+    def matches(self, transaction: dict) -> bool:
+
+        spent_ids = [utxo.id for is_spent, utxo in self.changes if is_spent]
+        created = [utxo.to_dict() for is_spent, utxo in self.changes if not is_spent]
+        return spent_ids == transaction['inputTransactions'] and created == transaction['outputTransactions']
+
+'''
+The set of all the unspent transaction outputs, indexed by their receiver address.
+The balance of every address is updated with every insert and spend, so we never have to sum its outputs again.
+'''
+class UTXOSet:
+
+    def __init__(self):
+
+        # Key: receiver address, Value: {utxo_id: UTXO}
+        self.outputs = {}
+
+        # Key: receiver address, Value: the sum of its unspent outputs (in base units)
+        self.balances = {}
+
+        # Key: utxo_id, Value: receiver address
+        self.owners = {}
+
+        # All the changes since the last take_delta(), when we track them (e.g. in order to store them)
+        self.delta = None
+
+    def __contains__(self, utxo_id: str) -> bool:
+        return utxo_id in self.owners
+
+    def __len__(self) -> int:
+        return len(self.owners)
+
+    def get(self, utxo_id: str) -> UTXO:
+
+        address = self.owners.get(utxo_id)
+        if address is None:
+            return None
+
+        return self.outputs[address][utxo_id]
+
+    '''
+    When an UndoRecord is given, the change is recorded there in order to be reversed later
+    '''
+    def add(self, utxo: UTXO, undo_record=None) -> None:
+
+        if utxo.id in self.owners:
+            return
+
+        address = utxo.receiver_address
+        self.outputs.setdefault(address, {})[utxo.id] = utxo
+        self.balances[address] = self.balances.get(address, 0) + utxo.amount
+        self.owners[utxo.id] = address
+
+        if undo_record is not None:
+            undo_record.created(utxo)
+        if self.delta is not None:
+            self.delta.created(utxo)
+
+    def spend(self, utxo_id: str, undo_record=None) -> UTXO:
+
+        address = self.owners.pop(utxo_id)
+        utxo = self.outputs[address].pop(utxo_id)
+        self.balances[address] -= utxo.amount
+
+        if undo_record is not None:
+            undo_record.spent(utxo)
+        if self.delta is not None:
+            self.delta.spent(utxo)
+
+        return utxo
+
+    '''
+    Apply the inputs and the outputs of a transaction of a block, which we have not validated ourselves.
+    Returns the UndoRecord of the changes.
+    When an input is not unspent or an output already exists, nothing is changed and InvalidUTXOs is raised.
+    '''
+    def apply_transaction(self, transaction: dict):
+
+        missing_ids = [input_id for input_id in transaction['inputTransactions'] if input_id not in self]
+        if len(missing_ids) > 0:
+            raise custom_errors.InvalidUTXOs(
+                err=f"The transaction {transaction['id']} spends the outputs {missing_ids} which are not unspent."
+            )
+
+        existing_ids = [output['id'] for output in transaction['outputTransactions'] if output['id'] in self]
+        if len(existing_ids) > 0:
+            raise custom_errors.InvalidUTXOs(
+                err=f"The transaction {transaction['id']} creates the outputs {existing_ids} which already exist."
+            )
+
+        undo_record = UndoRecord()
+
+        for input_id in transaction['inputTransactions']:
+            self.spend(input_id, undo_record)
+
+        for output in transaction['outputTransactions']:
+            self.add(UTXO.from_dict(output), undo_record)
+
+        return undo_record
+
+    '''
+    Reverse the changes of an UndoRecord, from the last one to the first.
+    When a spent output exists again or a created output is missing, the set is not the one that the record was made on,
+    so InvalidUTXOs is raised (the changes before it are already reversed).
+    '''
+    def undo(self, undo_record) -> None:
+
+        for is_spent, utxo in reversed(undo_record.changes):
+
+            if (utxo.id in self) == is_spent:
+                raise custom_errors.InvalidUTXOs(
+                    err=f"Unable to reverse the {'spend' if is_spent else 'creation'} of the output {utxo.id}."
+                )
+
+            if is_spent:
+                self.add(utxo)
+            else:
+                self.spend(utxo.id)
+
+    '''
+    Start recording every change of the set, so that we can store only what has changed
+    '''
+    def track_changes(self) -> None:
+        self.delta = UndoRecord()
+
+    '''
+    Returns the changes since the last call, as an UndoRecord
+    '''
+    def take_delta(self) -> UndoRecord:
+
+        delta = self.delta
+        self.delta = UndoRecord()
+        return delta
+
+    def balance(self, address: str) -> int:
+        return self.balances.get(address, 0)
+
+    def outputs_of(self, address: str) -> dict:
+        return self.outputs.get(address, {})
+
+    '''
+    Find the oldest outputs of the address which can provide a total amount >= needed amount.
+    Returns the ids of the selected outputs and their total amount.
+    When the balance is not enough we return immediately without looking at the outputs.
+    '''
+    def select(self, address: str, amount: int) -> tuple:
+
+        if self.balance(address) < amount:
+            return [], self.balance(address)
+
+        selected_ids = []
+        total = 0
+        for utxo in self.outputs_of(address).values():
+            selected_ids.append(utxo.id)
+            total += utxo.amount
+            if total >= amount:
+                break
+
+        return selected_ids, total
+
+    def balances_dict(self) -> dict:
+        return dict(self.balances)
+
+    # All the coins of the network, which must always be the same
+    def total(self) -> int:
+        return sum(self.balances.values())
+
+    # The nested dictionary format which is sent to the other nodes and stored at the database
+    def to_dict(self) -> dict:
+        return {
+            address: {utxo_id: utxo.to_dict() for utxo_id, utxo in outputs.items()}
+            for address, outputs in self.outputs.items()
+        }
+
+    @staticmethod
+    def from_dict(UTXOs: dict):
+
+        utxo_set = UTXOSet()
+        for outputs in UTXOs.values():
+            for utxo in outputs.values():
+                utxo_set.add(UTXO.from_dict(utxo))
+
+        return utxo_set
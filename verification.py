@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+
+import custom_errors
+from key_registry import KeyRegistry
+from transaction import Transaction
+
+'''
+Create the transaction object from the given dictionary and check:
+1. the signature, with the public key of the sender
+2. the hash, which is the transaction_id
+These checks do not depend on the state of the node, so they can run in parallel for many transactions.
+A malformed transaction (e.g. a missing field, a negative amount or a wrong signature) raises InvalidHash too,
+so the inline path and the pool reject it the same way.
+'''
+def verify_transaction(transaction: dict, key_registry: KeyRegistry) -> Transaction:
+
+    try:
+        signature = transaction['signature'].encode('ISO-8859-1')
+
+        # Create the transaction object with the old timestamp in order to create the same transaction ID
+        transaction_object = Transaction(
+            sender_address=transaction['sender'],
+            receiver_address=transaction['receiver'],
+            amount=transaction['amount'],
+            timestamp=transaction['timestamp'],
+            signature=signature
+        )
+
+        # Verify the signature
+        key_registry.verify(transaction['sender'], transaction_object.hash_object(), signature)
+
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        raise custom_errors.InvalidHash(
+            err=f"Invalid signature of the transaction {transaction.get('id')}: {str(e)}"
+        )
+
+    # Check that the transaction_object hash to be the same with the given transaction_id
+    if transaction_object.id != transaction.get('id'):
+        raise custom_errors.InvalidHash(
+            err=f"Could not validate the HashKey of the transaction {transaction.get('id')}"
+        )
+
+    return transaction_object
+
+# Every worker process keeps its own parsed keys
+_worker_key_registry = KeyRegistry(cache_size=1024)
+
+'''
+Runs at the worker processes. Returns None for a valid transaction, otherwise the error message.
+'''
+def _check_transaction(transaction: dict):
+
+    try:
+        verify_transaction(transaction, _worker_key_registry)
+        return None
+
+    except custom_errors.InvalidHash as e:
+        return str(e)
+
+'''
+A pool of processes which verify batches of incoming transactions in parallel.
+Only the UTXO update of every transaction, which depends on the order, runs afterwards at the node.
+'''
+class VerificationPool:
+
+    def __init__(self, workers: int = 0):
+
+        self.workers = workers or os.cpu_count()
+
+        # All the workers are forked here, before the threads of the pool start, and they are never forked again.
+        # A forked child gets only the thread that forked it, so the pool has to be created before this process
+        # runs any other thread, e.g. the collector of the MiningService (see main.py)
+        self.pool = multiprocessing.get_context('fork').Pool(processes=self.workers)
+
+    '''
+    Returns a list with one result for each given transaction: None when it is valid, otherwise the error message
+    '''
+    def verify_batch(self, transactions: [dict]) -> list:
+
+        chunksize = max(1, len(transactions) // (4 * self.workers))
+        return self.pool.map(_check_transaction, transactions, chunksize=chunksize)
+
+    def stop(self) -> None:
+        self.pool.terminate()
@@ -1,4 +1,5 @@
 from Crypto.PublicKey import RSA
+from utxo import UTXOSet
 
 '''
 Wallet.rsa_key     --> RSA
@@ -24,15 +25,8 @@ class Wallet:
 
     '''
     The balance of a user's wallet is the sum of all unspent transaction outputs
-    which have as recipient the specific wallet.
+    which have as recipient the specific wallet (in base units). The UTXOSet keeps this sum for every address.
     '''
-    def balance(self, UTXOs: dict):
-
-        wallet_balance = 0.0
-        wallet_UTXOs = UTXOs[self.address]
-
-        for utxo in wallet_UTXOs.values():
-            wallet_balance += float(utxo['amount'])
-
-        return wallet_balance
+    def balance(self, UTXOs: UTXOSet):
+        return UTXOs.balance(self.address)
 
@@ -0,0 +1,339 @@
+import zlib
+import json
+
+import custom_errors
+import persistence
+
+'''
+The binary format of the messages between the nodes, for the blocks, the batches of transactions and the chain.
+Every message starts with a header: MAGIC, the VERSION of the format, its flags and its kind, and then its body.
+In the body:
+    - integers are varints (7 bits per byte, the lowest first),
+    - ids and hashes are their 32 raw bytes instead of 64 hex digits,
+    - the public keys of the ring members are their node_id instead of their PEM,
+    - signatures and nonces are length-prefixed raw bytes instead of ISO-8859-1 strings,
+and the whole body is compressed with zlib when it is big enough.
+The decoded message is exactly the dictionary that the JSON format gives, so the rest of the node does not know about it.
+A peer that does not understand the format answers with 415 (see network.py), and then we use JSON.
+'''
+
+VERSION = 1
+CONTENT_TYPE = 'application/x-nbc-wire'
+MAGIC = b'NBW'
+
+# Flags
+COMPRESSED = 0x01
+
+# The body is compressed only when it is bigger than this (bytes)
+COMPRESS_MIN_SIZE = 512
+
+KINDS = {'block': 1, 'transactions': 2, 'chain': 3}
+KIND_NAMES = {value: name for name, value in KINDS.items()}
+
+# Tags of the fields that may have more than one form
+HEX_RAW, HEX_TEXT, HEX_NONE = 0, 1, 2
+KEY_TEXT, KEY_RING = 0, 1
+BYTES_NONE, BYTES_RAW = 0, 1
+
+def content_type() -> str:
+    return f'{CONTENT_TYPE}; v={VERSION}'
+
+def encode(kind: str, data, ring: dict = None, compress: bool = True) -> bytes:
+
+    writer = Writer(ring)
+    if kind == 'block':
+        writer.block(data)
+    elif kind == 'transactions':
+        writer.list(data, writer.transaction)
+    elif kind == 'chain':
+        writer.chain(data)
+    else:
+        raise custom_errors.InvalidWireMessage(err=f'Unknown kind of message {kind}')
+
+    body = bytes(writer.out)
+    flags = 0
+    if compress and len(body) >= COMPRESS_MIN_SIZE:
+        compressed = zlib.compress(body)
+        if len(compressed) < len(body):
+            body = compressed
+            flags |= COMPRESSED
+
+    return MAGIC + bytes([VERSION, flags, KINDS[kind]]) + body
+
+'''
+Returns the kind and the data of the message
+'''
+def decode(payload: bytes, ring: dict = None) -> tuple:
+
+    if len(payload) < len(MAGIC) + 3 or payload[:len(MAGIC)] != MAGIC:
+        raise custom_errors.InvalidWireMessage(err='Not a wire message.')
+
+    version, flags, kind = payload[len(MAGIC):len(MAGIC) + 3]
+    if version != VERSION:
+        raise custom_errors.InvalidWireMessage(err=f'Unsupported wire version {version}.')
+    if kind not in KIND_NAMES:
+        raise custom_errors.InvalidWireMessage(err=f'Unknown kind of message {kind}.')
+
+    body = payload[len(MAGIC) + 3:]
+    if flags & COMPRESSED:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as e:
+            raise custom_errors.InvalidWireMessage(err=f'Invalid compressed body: {str(e)}')
+
+    reader = Reader(body, ring)
+    try:
+        if KIND_NAMES[kind] == 'block':
+            data = reader.block()
+        elif KIND_NAMES[kind] == 'transactions':
+            data = reader.list(reader.transaction)
+        else:
+            data = reader.chain()
+
+    except (IndexError, ValueError) as e:
+        raise custom_errors.InvalidWireMessage(err=f'Invalid {KIND_NAMES[kind]} message: {str(e)}')
+
+    if not reader.at_end():
+        raise custom_errors.InvalidWireMessage(err=f'Invalid {KIND_NAMES[kind]} message: trailing bytes.')
+
+    return KIND_NAMES[kind], data
+
+# ----------------------------- Encoding -----------------------------
+
+'''
+The ring is a Ring (see ring.py), which finds the node_id of a public key
+'''
+class Writer:
+
+    def __init__(self, ring: dict = None):
+        self.out = bytearray()
+        self.ring = ring
+
+    def uint(self, value: int) -> None:
+
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise custom_errors.InvalidWireMessage(err=f'Invalid unsigned integer {value}')
+
+        while value >= 0x80:
+            self.out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        self.out.append(value)
+
+    def raw(self, data: bytes) -> None:
+        self.uint(len(data))
+        self.out.extend(data)
+
+    def text(self, value: str) -> None:
+        self.raw(value.encode('utf-8'))
+
+    '''
+    A hex id or hash as its raw bytes, and anything else (e.g. the previousHashKey of the genesis block) as it is
+    '''
+    def hex_id(self, value: str) -> None:
+
+        if value is None:
+            self.out.append(HEX_NONE)
+            return
+
+        try:
+            raw = bytes.fromhex(value)
+        except ValueError:
+            raw = None
+
+        if raw is not None and len(raw) == 32 and raw.hex() == value:
+            self.out.append(HEX_RAW)
+            self.out.extend(raw)
+        else:
+            self.out.append(HEX_TEXT)
+            self.text(value)
+
+    '''
+    The public key of a ring member as its node_id, and any other key as it is
+    '''
+    def key(self, public_key: str) -> None:
+
+        node_id = self.ring.node_id_of(public_key) if self.ring is not None else None
+        if node_id is not None and node_id.isdigit():
+            self.out.append(KEY_RING)
+            self.uint(int(node_id))
+        else:
+            self.out.append(KEY_TEXT)
+            self.text(public_key)
+
+    '''
+    A signature or a nonce, which are bytes carried as ISO-8859-1 strings
+    '''
+    def iso_bytes(self, value: str) -> None:
+
+        if value is None:
+            self.out.append(BYTES_NONE)
+        else:
+            self.out.append(BYTES_RAW)
+            self.raw(value.encode('ISO-8859-1'))
+
+    def list(self, items: list, write_item) -> None:
+
+        self.uint(len(items))
+        for item in items:
+            write_item(item)
+
+    def transaction(self, transaction: dict) -> None:
+
+        self.hex_id(transaction['id'])
+        self.key(transaction['sender'])
+        self.key(transaction['receiver'])
+        self.uint(transaction['amount'])
+        self.iso_bytes(transaction['signature'])
+        self.list(transaction['inputTransactions'], self.hex_id)
+        self.list(transaction['outputTransactions'], self.transaction_output)
+        self.text(transaction['timestamp'])
+
+    def transaction_output(self, output: dict) -> None:
+
+        self.hex_id(output['id'])
+        self.hex_id(output['officialTransactionId'])
+        self.key(output['receiverAddress'])
+        self.uint(output['amount'])
+
+    def block(self, block: dict) -> None:
+
+        self.hex_id(block['previousHashKey'])
+        self.hex_id(block['hashKey'])
+        self.iso_bytes(block['nonce'])
+        self.text(block['timestamp'])
+        self.hex_id(block['target'])
+        self.list(block['transactions'], self.transaction)
+
+    '''
+    The blocks of the chain, and the rest of the response (UTXOs, hash and signature of the chain) as JSON.
+    The transaction ids of the chain are found from its blocks.
+    '''
+    def chain(self, chain: dict) -> None:
+
+        self.list(chain['chain'], self.block)
+        self.text(json.dumps({k: v for k, v in chain.items() if k not in ['chain', 'chain_transaction_ids']}))
+
+# ----------------------------- Decoding -----------------------------
+
+class Reader:
+
+    def __init__(self, data: bytes, ring: dict = None):
+        self.data = memoryview(data)
+        self.offset = 0
+        self.ring = ring
+
+    def at_end(self) -> bool:
+        return self.offset == len(self.data)
+
+    def byte(self) -> int:
+        value = self.data[self.offset]
+        self.offset += 1
+        return value
+
+    def uint(self, max_shift: int = 63) -> int:
+
+        value, shift = 0, 0
+        while True:
+            byte = self.byte()
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+            if shift > max_shift:
+                raise custom_errors.InvalidWireMessage(err='Invalid varint.')
+
+    def raw(self) -> bytes:
+
+        length = self.uint()
+        if self.offset + length > len(self.data):
+            raise custom_errors.InvalidWireMessage(err='Truncated message.')
+
+        value = bytes(self.data[self.offset:self.offset + length])
+        self.offset += length
+        return value
+
+    def text(self) -> str:
+        return self.raw().decode('utf-8')
+
+    def hex_id(self) -> str:
+
+        tag = self.byte()
+        if tag == HEX_RAW:
+            if self.offset + 32 > len(self.data):
+                raise custom_errors.InvalidWireMessage(err='Truncated message.')
+            value = self.data[self.offset:self.offset + 32].hex()
+            self.offset += 32
+            return value
+        elif tag == HEX_TEXT:
+            return self.text()
+        elif tag == HEX_NONE:
+            return None
+        raise custom_errors.InvalidWireMessage(err=f'Invalid tag {tag}.')
+
+    def key(self) -> str:
+
+        tag = self.byte()
+        if tag == KEY_TEXT:
+            return self.text()
+        elif tag == KEY_RING:
+            node_id = str(self.uint())
+            if self.ring is None or node_id not in self.ring:
+                raise custom_errors.UnknownKeyReference(err=f'Unknown ring member node_{node_id}.', node_id=node_id)
+            return self.ring[node_id]['public_key']
+        raise custom_errors.InvalidWireMessage(err=f'Invalid tag {tag}.')
+
+    def iso_bytes(self) -> str:
+
+        tag = self.byte()
+        if tag == BYTES_NONE:
+            return None
+        elif tag == BYTES_RAW:
+            return self.raw().decode('ISO-8859-1')
+        raise custom_errors.InvalidWireMessage(err=f'Invalid tag {tag}.')
+
+    def list(self, read_item) -> list:
+        return [read_item() for _ in range(self.uint())]
+
+    # The dictionaries have the keys in the order of Transaction.to_dict(), TransactionOutput.to_dict() and Block.to_dict()
+
+    def transaction(self) -> dict:
+
+        return {
+            'id': self.hex_id(),
+            'sender': self.key(),
+            'receiver': self.key(),
+            'amount': self.uint(),
+            'signature': self.iso_bytes(),
+            'inputTransactions': self.list(self.hex_id),
+            'outputTransactions': self.list(self.transaction_output),
+            'timestamp': self.text()
+        }
+
+    def transaction_output(self) -> dict:
+
+        return {
+            'id': self.hex_id(),
+            'officialTransactionId': self.hex_id(),
+            'receiverAddress': self.key(),
+            'amount': self.uint()
+        }
+
+    def block(self) -> dict:
+
+        return {
+            'previousHashKey': self.hex_id(),
+            'hashKey': self.hex_id(),
+            'nonce': self.iso_bytes(),
+            'timestamp': self.text(),
+            'target': self.hex_id(),
+            'transactions': self.list(self.transaction)
+        }
+
+    def chain(self) -> dict:
+
+        blocks = self.list(self.block)
+        return {
+            **json.loads(self.text()),
+            'chain': blocks,
+            'chain_transaction_ids': persistence.chain_transaction_ids(blocks)
+        }